@@ -66,7 +66,9 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['ansible'],
+    # NB. the ansible templating backend uses internals of the ansible templar (tested with ansible 2.3) when available,
+    # and falls back to the public Templar.template otherwise
+    install_requires=['ansible>=2.3'],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
@@ -1,2 +1,4 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type 
+
+__version__ = '0.7.5'
@@ -1,28 +1,172 @@
 import sys
 from optparse import OptionParser
 
-def main(args=None): 
+# NB. only lightweight modules are imported here, so help and argument errors are fast;
+# the executor (yaml, jinja2, ansible) is imported only when a playbook is executed
+from vagrantplaybook.templating.backend import TEMPLATING_BACKENDS, DEFAULT_TEMPLATING_BACKEND
+
+def main(args=None):
     """The main routine."""
     if args is None:
         args = sys.argv[1:]
 
-    parser = OptionParser(usage="vagrant-playbook [OPTIONS]",
+    parser = OptionParser(usage="vagrant-playbook [serve] [OPTIONS]\n       vagrant-playbook batch [OPTIONS] PLAYBOOK|DIRECTORY|GLOB...",
     description="Parser for declarative cluster definition for vagrant, aka vagrant playbooks, and generates a yaml to be used with vagrant-compose plugin.")
 
     parser.add_option("-f", "--file", dest="file",
                       help="File name containing the vagrant playbook", metavar="PLAYBOOK FILE")
     parser.add_option("-p", "--playbook", dest="playbook",
                       help="String containing the vagrant playbook", metavar="PLAYBOOK STRING")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                      help="Number of worker processes to be used for composing the cluster, or playbooks in batch (default 1)", metavar="N")
+    parser.add_option("--only", dest="only", action="append",
+                      help="Compose only the selected nodes, with the same values of a full compose: a comma separated list of nodegroups, each one optionally followed by an index or a slice, e.g. master or master[0:2],slave[3] (can be repeated)", metavar="SELECTION")
+    parser.add_option("-o", "--output-dir", dest="output_dir",
+                      help="Directory composed clusters are written to in batch (default next to each playbook, as .composed.yml)", metavar="DIRECTORY")
+    parser.add_option("-t", "--templating", dest="templating", type="choice", choices=TEMPLATING_BACKENDS, default=DEFAULT_TEMPLATING_BACKEND,
+                      help="Templating backend to be used for value generators: ansible or native (default ansible)", metavar="BACKEND")
+    parser.add_option("--format", dest="format", type="choice", choices=['yaml', 'json'], default='yaml',
+                      help="Format of the composed cluster: yaml or json (default yaml)", metavar="FORMAT")
+    parser.add_option("--compact", dest="compact", action="store_true", default=False,
+                      help="Write the composed cluster without whitespaces (with --format json)")
+    parser.add_option("--sort-keys", dest="sort_keys", action="store_true", default=False,
+                      help="Write vars and attributes of the composed cluster with keys in sorted order (with --format json; yaml is always sorted)")
+    parser.add_option("--inventory", dest="inventory", action="store_true", default=False,
+                      help="Write the ansible inventory tree (inventory, group_vars/*.yml and host_vars/*.yml files) to the ansible_playbook_path of the cluster, rewriting only changed files; a summary is reported to stderr")
+    parser.add_option("--inventory-dir", dest="inventory_dir",
+                      help="Directory the ansible inventory tree is written to (implies --inventory)", metavar="DIRECTORY")
+    parser.add_option("--no-cache", dest="cache", action="store_false", default=True,
+                      help="Compose the playbook without using the cache of composed clusters (.vagrant/playbook-cache)")
+    parser.add_option("--incremental", dest="incremental", action="store_true", default=False,
+                      help="Recompose only the parts of the cluster affected by changes since the last execution (state is stored in .vagrant/playbook-state)")
+    parser.add_option("--incremental-report", dest="incremental_report", action="store_true", default=False,
+                      help="Report the parts of the cluster recomposed by --incremental to stderr")
+    parser.add_option("--profile", dest="profile", action="store_true", default=False,
+                      help="Report wall time, CPU time and generated objects for each execution phase to stderr")
+    parser.add_option("--profile-generators", dest="profile_generators", type="int", default=0,
+                      help="Report the N most expensive value generators (calls, time and size of generated values) to stderr", metavar="N")
+    parser.add_option("--profile-memory", dest="profile_memory", type="int", default=0,
+                      help="Report the memory allocated by each execution phase, and the N top allocating source lines (or object types, if tracemalloc is not available) to stderr", metavar="N")
+    parser.add_option("--trace", dest="trace",
+                      help="Write a trace of the execution (phases, nodegroups, nodes, value generators) in Chrome trace event format", metavar="TRACE FILE")
+    parser.add_option("--connect", dest="connect", action="store_true", default=False,
+                      help="Execute the playbook in the compose server started by 'vagrant-playbook serve', or in-process if the server is not running")
+    parser.add_option("--socket", dest="socket",
+                      help="The unix domain socket of the compose server (default a socket in a private directory under $XDG_RUNTIME_DIR or the temp directory, one for each user)", metavar="PATH")
+    parser.add_option("--stop", dest="stop", action="store_true", default=False,
+                      help="Stop the compose server (with serve)")
+    parser.add_option("--startup-profile", dest="startup_profile", action="store_true", default=False,
+                      help="Report the time spent importing each module to stderr")
+
+    (options, args) = parser.parse_args(args)
 
-    (options, args) = parser.parse_args()
+    if args == ['serve']:
+        return serve(options)
+    elif args[:1] == ['batch']:
+        if len(args) == 1:
+            parser.error('Playbooks not provided. Execute vagrant-playbook -h for available options.')
+        return batch(options, args[1:])
+    elif args:
+        parser.error('Unknown command %s. Execute vagrant-playbook -h for available options.' % ' '.join(args))
 
     if not options.file and not options.playbook:
         parser.error('Playbook not provided. Execute vagrant-playbook -h for available options.')
 
-    from vagrantplaybook.playbook.executor import Executor
-    yaml = Executor().execute(yamlfile=options.file, yamlplaybook=options.playbook)
+    profiler = None
+    if options.startup_profile:
+        from vagrantplaybook.importprofile import ImportProfiler
+        profiler = ImportProfiler()
+        profiler.install()
+
+    if options.inventory_dir:
+        options.inventory = True
+
+    # the playbook is executed in the compose server, if running (profiling and inventory trees require an in-process execution)
+    if options.connect and not (options.inventory or options.profile or options.profile_generators > 0 or options.profile_memory > 0 or options.trace or options.startup_profile):
+        from vagrantplaybook.server import request
+        response = request(options.socket, yamlfile=options.file, yamlplaybook=options.playbook, jobs=options.jobs,
+                           templating=options.templating, cache=options.cache, incremental=options.incremental,
+                           output_format=options.format, compact=options.compact, sort_keys=options.sort_keys, only=options.only)
+        if response is not None:
+            output, report = response
+            sys.stdout.write(output)
+            if options.incremental_report:
+                sys.stderr.write(report if report is not None else 'Recompose report\n  cluster returned from cache, or not composed incrementally\n')
+            return
+
+    try:
+        from vagrantplaybook.playbook.executor import Executor
+        from vagrantplaybook.playbook.cache import ComposeCache
+        from vagrantplaybook.compose.state import ComposeState
+        cache = ComposeCache() if options.cache else None
+        state = ComposeState.DEFAULT_PATH if options.incremental else None
+        profile = None
+        if options.profile or options.profile_generators > 0 or options.profile_memory > 0 or options.trace:
+            from vagrantplaybook.profiler import Profiler
+            profile = Profiler(generators=options.profile_generators > 0, trace=bool(options.trace), memory=options.profile_memory > 0)
+        executor = Executor(templating=options.templating, cache=cache, state=state, profiler=profile,
+                            output_format=options.format, compact=options.compact, sort_keys=options.sort_keys,
+                            inventory=options.inventory, inventory_path=options.inventory_dir)
+        executor.execute(yamlfile=options.file, yamlplaybook=options.playbook, jobs=options.jobs, out=sys.stdout, only=options.only)
+
+        if options.profile or options.profile_memory > 0:
+            profile.report(sys.stderr)
+        if options.profile_memory > 0:
+            profile.memory.report(sys.stderr, options.profile_memory)
+        if options.profile_generators > 0:
+            profile.generators.report(sys.stderr, options.profile_generators)
+        if options.trace:
+            profile.trace.save(options.trace)
+        if executor.inventory_writer is not None:
+            sys.stderr.write(executor.inventory_writer.report())
+
+        if options.incremental_report:
+            sys.stderr.write(executor.state.report() if executor.state is not None else 'Recompose report\n  cluster returned from cache, or not composed incrementally\n')
+    finally:
+        if profiler is not None:
+            profiler.uninstall()
+            profiler.report(sys.stderr)
+
+def serve(options):
+    """Starts the compose server, or stops it."""
+    from vagrantplaybook.server import ComposeServer, DEFAULT_SOCKET, stop
+
+    path = options.socket or DEFAULT_SOCKET
+    if options.stop:
+        if not stop(path):
+            sys.stderr.write('No compose server listening on %s\n' % path)
+        return
+
+    # SIGTERM stops the server like a stop request, so the socket is removed
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    server = ComposeServer(path, templating=options.templating)
+    server.start()
+    sys.stderr.write('Compose server listening on %s\n' % path)
+    server.serve_forever()
+
+def batch(options, paths):
+    """Composes many playbooks, and prints a summary; exits with status 1 if some playbooks can't be composed."""
+    from vagrantplaybook.batch import find_playbooks, get_outputs, run_batch, report
+
+    playbooks = find_playbooks(paths)
+    if not playbooks:
+        sys.stderr.write('No playbooks found in %s\n' % ' '.join(paths))
+        sys.exit(1)
+
+    try:
+        outputs = get_outputs(playbooks, options.output_dir, output_format=options.format)
+    except ValueError, e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
+
+    results = run_batch(playbooks, outputs, jobs=options.jobs, templating=options.templating, cache=options.cache,
+                        output_format=options.format, compact=options.compact, sort_keys=options.sort_keys)
+    report(results, sys.stdout)
 
-    print (yaml)
+    if any(result['error'] is not None for result in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -3,13 +3,6 @@ __metaclass__ = type
 
 from vagrantplaybook.compat import compat_text_type, to_str
 
-#TODO: remove dependencies from ansible (use default json library + ninja2)
-from ansible.parsing.dataloader import DataLoader
-from ansible.template import Templar
-
-ansible_tempar = Templar
-ansible_loader = DataLoader
-
 
 def ansible_unwrap(value):
     ''' utility function for unwrapping values generated
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import stat
+import tempfile
+from contextlib import contextmanager
+
+def get_file_mode(path):
+    ''' Gets the mode a file should be written with: the mode of the existing file, or the default mode for new files
+    (0666 without the bits of the process umask), as if the file was created by open.
+
+    Keyword arguments:
+    path            -- The file name (and path)
+    '''
+
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0666 & ~umask
+
+@contextmanager
+def atomic_open(path):
+    ''' Opens a temporary file in the directory of a file, that replaces the file - atomically - when the block ends without errors
+    (the temporary file is removed otherwise); the file keeps its mode, or gets the default mode for new files (temporary files
+    are created with mode 0600).
+
+    Keyword arguments:
+    path            -- The file name (and path)
+    '''
+
+    f = tempfile.NamedTemporaryFile(dir = os.path.dirname(path) or '.', prefix = os.path.basename(path), suffix = '.tmp', delete = False)
+    try:
+        with f:
+            yield f
+        os.chmod(f.name, get_file_mode(path))
+        os.rename(f.name, path)
+    except:
+        if os.path.exists(f.name):
+            os.remove(f.name)
+        raise
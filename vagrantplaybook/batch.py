@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import glob
+import timeit
+import traceback
+
+from vagrantplaybook.atomicfile import atomic_open
+from vagrantplaybook.errors import ComposeError
+from vagrantplaybook.templating.backend import DEFAULT_TEMPLATING_BACKEND
+
+# The extensions of playbook files, when playbooks are searched in a directory
+PLAYBOOK_EXTENSIONS = ('.yml', '.yaml')
+
+# The suffix of composed clusters written next to their playbook, for each output format (composed clusters are never considered playbooks)
+OUTPUT_SUFFIXES = dict(yaml = '.composed.yml', json = '.composed.json')
+
+# The executor of a worker process (each worker has its own templating backend and cache of compiled templates)
+_executor = None
+
+def find_playbooks(paths):
+    ''' Gets the playbooks to be composed, sorted by path and without duplicates.
+
+    Keyword arguments:
+    paths           -- A list of playbook files, directories (playbooks are searched recursively, skipping hidden directories
+                       like .vagrant) or glob patterns
+    '''
+
+    playbooks = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, directories, files in os.walk(path):
+                directories[:] = [d for d in directories if not d.startswith('.')]
+                playbooks.update(os.path.join(directory, f) for f in files if _is_playbook(f))
+        elif os.path.isfile(path):
+            playbooks.add(path)
+        else:
+            playbooks.update(f for f in glob.glob(path) if os.path.isfile(f) and _is_playbook(f))
+
+    return sorted(os.path.normpath(playbook) for playbook in playbooks)
+
+def get_outputs(playbooks, output_dir = None, output_format = 'yaml'):
+    ''' Gets the file each composed cluster should be written to: next to the playbook, or in the output directory, with the same path
+    of the playbook relative to the common directory of all the playbooks; the extension is always replaced by the .composed.yml suffix
+    (or .composed.json), so composed clusters are never considered playbooks in the following batches.
+    Playbooks that would be written to the same file (e.g. env.yml and env.yaml) raise ValueError.
+
+    Keyword arguments:
+    playbooks       -- The list of playbook files
+    output_dir      -- The output directory, or None
+    output_format   -- The format of composed clusters ('yaml' or 'json')
+    '''
+
+    if output_dir is None:
+        outputs = [os.path.splitext(playbook)[0] + OUTPUT_SUFFIXES[output_format] for playbook in playbooks]
+    else:
+        # NB. the common directory is computed on path components, because commonprefix works on characters
+        directories = [os.path.dirname(os.path.abspath(playbook)).split(os.sep) for playbook in playbooks]
+        base = os.sep.join(os.path.commonprefix(directories)) or os.sep
+
+        outputs = [os.path.splitext(os.path.join(output_dir, os.path.relpath(os.path.abspath(playbook), base)))[0] + OUTPUT_SUFFIXES[output_format] for playbook in playbooks]
+
+    composed = {}
+    for playbook, output in zip(playbooks, outputs):
+        if output in composed:
+            raise ValueError("Invalid playbooks: %s and %s would be both composed to %s" % (composed[output], playbook, output))
+        composed[output] = playbook
+
+    return outputs
+
+def run_batch(playbooks, outputs, jobs = 1, templating = DEFAULT_TEMPLATING_BACKEND, cache = True, output_format = 'yaml', compact = False, sort_keys = False):
+    ''' Composes a list of playbooks, each one in one of the worker processes (or in this process, if jobs is 1),
+    and returns the list of results in playbooks order; each result is a dictionary with the playbook, the output file,
+    the time spent composing the playbook, in seconds, and the error message, if the playbook can't be composed.
+    Errors do not stop the batch.
+
+    Keyword arguments:
+    playbooks       -- The list of playbook files
+    outputs         -- The list of files the composed clusters should be written to (see get_outputs)
+    jobs            -- The number of worker processes
+    templating      -- The name of the templating backend
+    cache           -- True for using the cache of composed clusters (.vagrant/playbook-cache)
+    output_format   -- The format of composed clusters ('yaml' or 'json')
+    compact         -- True for writing json documents without whitespaces
+    sort_keys       -- True for writing keys of vars and attributes in json documents in sorted order
+    '''
+
+    tasks = zip(playbooks, outputs)
+    initargs = (templating, cache, output_format, compact, sort_keys)
+
+    if jobs <= 1 or len(tasks) <= 1:
+        _initialize_worker(*initargs)
+        return [_compose(task) for task in tasks]
+
+    # multiprocessing is imported only when a pool of worker processes is required
+    import multiprocessing
+
+    pool = multiprocessing.Pool(min(jobs, len(tasks)), initializer = _initialize_worker, initargs = initargs)
+    try:
+        results = pool.map(_compose, tasks, chunksize = 1)
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+
+    pool.close()
+    pool.join()
+    return results
+
+def report(results, stream):
+    ''' Writes a summary of the batch, with the time spent composing each playbook and errors.
+
+    Keyword arguments:
+    results         -- The results of the batch (see run_batch)
+    stream          -- The file-like object the summary will be written to
+    '''
+
+    errors = [result for result in results if result['error'] is not None]
+
+    stream.write('%-8s %12s  %s\n' % ('status', 'time (ms)', 'playbook'))
+    for result in results:
+        stream.write('%-8s %12.1f  %s\n' % ('ERROR' if result['error'] is not None else 'OK', result['time'] * 1000, result['playbook']))
+
+    for result in errors:
+        stream.write('\n%s:\n  %s\n' % (result['playbook'], result['error'].rstrip('\n').replace('\n', '\n  ')))
+
+    stream.write('\nComposed %i of %i playbooks, %i errors (total time %.1f ms)\n' % (len(results) - len(errors), len(results), len(errors), sum(result['time'] for result in results) * 1000))
+
+def _is_playbook(name):
+    return name.endswith(PLAYBOOK_EXTENSIONS) and not name.endswith(OUTPUT_SUFFIXES['yaml'])
+
+def _initialize_worker(templating, cache, output_format = 'yaml', compact = False, sort_keys = False):
+    ''' utility function for initializing a worker process, with an executor shared by all the playbooks composed by the worker
+
+    Keyword arguments:
+    templating      --  The name of the templating backend
+    cache           --  True for using the cache of composed clusters
+    output_format   --  The format of composed clusters
+    compact         --  True for writing json documents without whitespaces
+    sort_keys       --  True for writing keys in json documents in sorted order
+    '''
+
+    from vagrantplaybook.playbook.executor import Executor
+    from vagrantplaybook.playbook.cache import ComposeCache
+    from vagrantplaybook.compose.templatecache import TemplateCache
+    from vagrantplaybook.templating.backend import create_templating_backend
+
+    global _executor
+    _executor = Executor(cache = ComposeCache() if cache else None, templates = TemplateCache(create_templating_backend(templating)),
+        output_format = output_format, compact = compact, sort_keys = sort_keys)
+
+def _compose(task):
+    ''' utility function for composing a playbook, and writing the composed cluster to the output file atomically
+
+    Keyword arguments:
+    task            --  The tuple with the playbook file and the output file
+    '''
+
+    playbook, output = task
+    result = dict(playbook = playbook, output = output, error = None)
+
+    start = timeit.default_timer()
+    try:
+        directory = os.path.dirname(output)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with atomic_open(output) as f:
+            _executor.execute(playbook, None, out = f)
+    except Exception, e:
+        result['error'] = e.message if isinstance(e, ComposeError) else traceback.format_exc()
+
+    result['time'] = timeit.default_timer() - start
+    return result
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import sys
+import json
+import platform
+import subprocess
+from optparse import OptionParser
+
+import vagrantplaybook
+from vagrantplaybook.templating.backend import TEMPLATING_BACKENDS, DEFAULT_TEMPLATING_BACKEND
+
+# The default sizes (number of nodes) of the benchmarked clusters
+DEFAULT_SIZES = [10, 1000, 10000, 100000]
+
+# The complexity of value generators in synthetic playbooks:
+# - default, only the default value generators of nodegroups (names and ips)
+# - simple, value generators with arithmetic and references to other attributes
+# - complex, value generators with filters, conditionals and nested attributes
+COMPLEXITIES = ['default', 'simple', 'complex']
+
+# The phases of Executor.execute, in execution order
+EXECUTOR_PHASES = ['load', 'parse', 'compose', 'emit']
+
+# The phases of Cluster.compose, in execution order
+COMPOSE_PHASES = ['nodes', 'ansible_groups', 'context_vars', 'group_vars', 'host_vars', 'inventory']
+
+# The number of tier ansible groups in synthetic playbooks; each nodegroup is in one tier, and in an ansible group of its own
+TIERS = 4
+
+# The min difference between a timing and its baseline, in seconds, for reporting a regression (smaller differences are noise)
+NOISE_THRESHOLD = 0.01
+
+def generate_playbook(groups, instances, complexity = 'simple', provisioners = 1, remainder = 0):
+    ''' Generates a synthetic playbook, in yaml format (a json document, that is also a valid yaml document).
+
+    Keyword arguments:
+    groups          -- The number of nodegroups
+    instances       -- The number of instances in each nodegroup
+    complexity      -- The complexity of value generators ('default', 'simple' or 'complex')
+    provisioners    -- The number of vars generated by each context/group/host var provisioner
+    remainder       -- The number of nodegroups, among the first ones, with one more instance (default 0)
+    '''
+
+    if complexity not in COMPLEXITIES:
+        raise ValueError("Invalid complexity '%s': expected one of %s" % (complexity, ', '.join(COMPLEXITIES)))
+
+    cluster = dict(box = 'benchmark/box', domain = 'benchmark.local', node_prefix = 'bench')
+
+    for index in range(groups):
+        group = dict(instances = instances + (1 if index < remainder else 0), ansible_groups = ['role%i' % index, 'tier%i' % (index % TIERS)])
+
+        if complexity in ('simple', 'complex'):
+            group['memory'] = '{{ 256 * (group_index % 4 + 1) }}'
+            group['cpus'] = '{{ 1 + node_index % 2 }}'
+            group['aliases'] = ['{{ hostname }}-alias']
+
+        if complexity == 'complex':
+            group['attributes'] = dict(
+                role = '{{ group_name | upper }}',
+                rack = '{% if node_index is even %}rack-a{% else %}rack-b{% endif %}',
+                tags = "{{ [group_name, boxname, ip] | join(',') }}",
+                size = '{{ (memory | int) * (cpus | int) }}'
+            )
+
+        cluster['group%i' % index] = group
+
+    if provisioners > 0:
+        cluster['ansible_context_vars'] = { 'all': {} }
+        cluster['ansible_group_vars'] = {}
+        cluster['ansible_host_vars'] = {}
+        for tier in range(TIERS):
+            cluster['ansible_group_vars']['tier%i' % tier] = {}
+            cluster['ansible_host_vars']['tier%i' % tier] = {}
+
+        for index in range(provisioners):
+            cluster['ansible_context_vars']['all']['count%i' % index] = '{{ nodes | count }}'
+            for tier in range(TIERS):
+                cluster['ansible_group_vars']['tier%i' % tier]['first%i' % index] = '{{ (nodes | first).hostname }}'
+                cluster['ansible_group_vars']['tier%i' % tier]['total%i' % index] = '{{ context.count%i }}' % index
+                cluster['ansible_host_vars']['tier%i' % tier]['id%i' % index] = '{{ node.index + %i }}' % index
+                cluster['ansible_host_vars']['tier%i' % tier]['fqdn%i' % index] = '{{ node.fqdn }}'
+
+    return json.dumps(dict(benchmark = cluster), indent = 2, sort_keys = True)
+
+def get_scenario(nodes, groups = 10, complexity = 'simple', provisioners = 1, templating = DEFAULT_TEMPLATING_BACKEND, jobs = 1):
+    ''' Gets the parameters of a benchmark scenario, splitting the nodes in nodegroups with the same number of instances
+    (the remaining nodes are spread across the first nodegroups, one more instance each).
+
+    Keyword arguments:
+    nodes           -- The number of nodes in the cluster
+    groups          -- The number of nodegroups (if lower than the number of nodes)
+    complexity      -- The complexity of value generators
+    provisioners    -- The number of vars generated by each context/group/host var provisioner
+    templating      -- The name of the templating backend
+    jobs            -- The number of worker processes to be used for composing the cluster
+    '''
+
+    groups = max(1, min(groups, nodes))
+    return dict(nodes = nodes, groups = groups, instances = nodes // groups, remainder = nodes % groups, complexity = complexity,
+        provisioners = provisioners, templating = templating, jobs = jobs)
+
+def run_scenario(scenario):
+    ''' Executes a synthetic playbook, timing each Executor phase and each Cluster.compose phase; the composed cluster is written
+    to the null device, and phases are recorded by a Profiler. The result is a dictionary with the scenario parameters,
+    timings in seconds (compose phases are nested in the compose phase) and the peak memory of the process, in bytes.
+
+    Keyword arguments:
+    scenario        -- The parameters of the scenario (see get_scenario)
+    '''
+
+    from vagrantplaybook.playbook.executor import Executor
+    from vagrantplaybook.profiler import Profiler, peak_memory
+
+    playbook = generate_playbook(scenario['groups'], scenario['instances'], scenario['complexity'], scenario['provisioners'], scenario['remainder'])
+    profiler = Profiler()
+    executor = Executor(templating = scenario['templating'], profiler = profiler)
+
+    # yaml and the template engine are imported before timings, so import times are not included (see --startup-profile)
+    executor._yaml_load('')
+    executor._get_templating()
+
+    with open(os.devnull, 'wb') as stream:
+        executor.execute(None, playbook, jobs = scenario['jobs'], out = stream)
+
+    timings = dict((phase.name, phase.wall) for phase in profiler.phases)
+    timings['total'] = profiler.total
+    composed_nodes = [phase.count for phase in profiler.phases if phase.name == 'nodes'][0]
+
+    return dict(scenario, timings = timings, peak_memory = peak_memory(), composed_nodes = composed_nodes)
+
+def run_benchmark(scenarios, repeat = 1):
+    ''' Executes the benchmark scenarios, each one in a new process, so peak memory is measured for each scenario;
+    when a scenario is repeated, the best timing of each phase and the lowest peak memory are kept.
+
+    Keyword arguments:
+    scenarios       -- The list of scenarios (see get_scenario)
+    repeat          -- The number of executions of each scenario
+    '''
+
+    # worker processes load vagrantplaybook from the same path of this process
+    root = os.path.dirname(os.path.dirname(os.path.abspath(vagrantplaybook.__file__)))
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([root] + filter(None, [os.environ.get('PYTHONPATH')])))
+
+    results = []
+    for scenario in scenarios:
+        best = None
+        for i in range(repeat):
+            process = subprocess.Popen([sys.executable, '-W', 'ignore', '-m', 'vagrantplaybook.benchmark', '--scenario', json.dumps(scenario)],
+                env = env, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+            out, err = process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError('Error executing benchmark scenario %s: %s' % (json.dumps(scenario, sort_keys = True), err.strip()))
+
+            result = json.loads(out)
+            if best is None:
+                best = result
+            else:
+                for phase, timing in result['timings'].iteritems():
+                    best['timings'][phase] = min(best['timings'][phase], timing)
+                if result['peak_memory'] is not None:
+                    best['peak_memory'] = min(best['peak_memory'], result['peak_memory'])
+        results.append(best)
+
+    return dict(
+        version = vagrantplaybook.__version__,
+        python = platform.python_version(),
+        platform = platform.platform(),
+        repeat = repeat,
+        results = results
+    )
+
+def compare(results, baseline, tolerance = 0.2):
+    ''' Compares benchmark results with a baseline, and gets the list of regressions, that is phases slower than the baseline
+    (or using more memory than the baseline) by more than the given tolerance.
+    Each regression is a tuple with the number of nodes, the phase (or 'peak_memory'), the baseline and the current value.
+    Results are compared with the baseline results of the same scenario; scenarios not in the baseline are ignored.
+
+    Keyword arguments:
+    results         -- The benchmark results (see run_benchmark)
+    baseline        -- The baseline benchmark results
+    tolerance       -- The max ratio between a value and its baseline value, minus one (default 0.2, 20% slower)
+    '''
+
+    baselines = dict((_scenario_key(result), result) for result in baseline['results'])
+
+    regressions = []
+    for result in results['results']:
+        base = baselines.get(_scenario_key(result))
+        if base is None:
+            continue
+
+        for phase in EXECUTOR_PHASES + COMPOSE_PHASES + ['total']:
+            value, base_value = result['timings'].get(phase), base['timings'].get(phase)
+            if value is not None and base_value is not None and value > base_value * (1 + tolerance) and value - base_value > NOISE_THRESHOLD:
+                regressions.append((result['nodes'], phase, base_value, value))
+
+        if result['peak_memory'] and base['peak_memory'] and result['peak_memory'] > base['peak_memory'] * (1 + tolerance):
+            regressions.append((result['nodes'], 'peak_memory', base['peak_memory'], result['peak_memory']))
+
+    return regressions
+
+def _scenario_key(result):
+    ''' utility function for getting the parameters identifying a benchmark scenario '''
+    return tuple(result[k] for k in ('nodes', 'groups', 'instances', 'complexity', 'provisioners', 'templating', 'jobs'))
+
+def report(results, stream, baseline = None):
+    ''' Writes benchmark results as a table, with a row for each phase and a column for each scenario;
+    if a baseline is given, the ratio between each timing and its baseline is reported too.
+
+    Keyword arguments:
+    results         -- The benchmark results (see run_benchmark)
+    stream          -- The file-like object the report will be written to
+    baseline        -- The baseline benchmark results, or None
+    '''
+
+    baselines = dict((_scenario_key(result), result) for result in baseline['results']) if baseline is not None else {}
+
+    columns = results['results']
+    stream.write('Benchmark (vagrant-playbook %s, python %s, times in seconds):\n' % (results['version'], results['python']))
+    stream.write('%-18s' % 'nodes' + ''.join('%18i' % result['nodes'] for result in columns) + '\n')
+
+    for phase in EXECUTOR_PHASES[:2] + ['compose'] + COMPOSE_PHASES + EXECUTOR_PHASES[3:] + ['total']:
+        label = '  ' + phase if phase in COMPOSE_PHASES else phase
+        cells = []
+        for result in columns:
+            cell = '%.3f' % result['timings'][phase]
+            base = baselines.get(_scenario_key(result))
+            if base is not None and base['timings'].get(phase):
+                cell += ' (%.2fx)' % (result['timings'][phase] / base['timings'][phase])
+            cells.append('%18s' % cell)
+        stream.write('%-18s' % label + ''.join(cells) + '\n')
+
+    stream.write('%-18s' % 'peak memory (MB)' + ''.join('%18s' % ('%.1f' % (result['peak_memory'] / 1024 / 1024) if result['peak_memory'] else '-') for result in columns) + '\n')
+
+def main(args = None, out = None):
+    """The benchmark routine; the report is written to out (default stdout)."""
+    if args is None:
+        args = sys.argv[1:]
+    if out is None:
+        out = sys.stdout
+
+    parser = OptionParser(usage="python -m vagrantplaybook.benchmark [OPTIONS]",
+    description="Benchmark for vagrant-playbook: executes synthetic playbooks of growing size, and reports the time spent in each phase and peak memory.")
+
+    parser.add_option("-s", "--sizes", dest="sizes", default=','.join(str(size) for size in DEFAULT_SIZES),
+                      help="Comma separated list of cluster sizes - number of nodes - to be benchmarked (default %default)", metavar="SIZES")
+    parser.add_option("-g", "--groups", dest="groups", type="int", default=10,
+                      help="Number of nodegroups in each cluster (default %default)", metavar="N")
+    parser.add_option("-c", "--complexity", dest="complexity", type="choice", choices=COMPLEXITIES, default='simple',
+                      help="Complexity of value generators: default, simple or complex (default %default)", metavar="COMPLEXITY")
+    parser.add_option("-v", "--provisioners", dest="provisioners", type="int", default=1,
+                      help="Number of vars generated by each context/group/host var provisioner (default %default)", metavar="N")
+    parser.add_option("-t", "--templating", dest="templating", type="choice", choices=TEMPLATING_BACKENDS, default=DEFAULT_TEMPLATING_BACKEND,
+                      help="Templating backend to be used for value generators: ansible or native (default %default)", metavar="BACKEND")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                      help="Number of worker processes to be used for composing clusters (default %default)", metavar="N")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=1,
+                      help="Number of executions of each scenario; the best timings are reported (default %default)", metavar="N")
+    parser.add_option("-o", "--output", dest="output",
+                      help="File the benchmark results will be saved to, in json format", metavar="FILE")
+    parser.add_option("-b", "--baseline", dest="baseline",
+                      help="File with baseline benchmark results, in json format; exits with status 1 if there are regressions", metavar="FILE")
+    parser.add_option("--tolerance", dest="tolerance", type="float", default=0.2,
+                      help="Max slowdown with respect to the baseline, as a fraction (default %default)", metavar="RATIO")
+    parser.add_option("--scenario", dest="scenario", help="Executes a single scenario, and writes the result to stdout (used internally)")
+
+    (options, args) = parser.parse_args(args)
+
+    if options.scenario:
+        out.write(json.dumps(run_scenario(json.loads(options.scenario))))
+        return 0
+
+    try:
+        sizes = [int(size) for size in options.sizes.split(',')]
+    except ValueError:
+        parser.error('Invalid sizes: %s' % options.sizes)
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline, 'rb') as f:
+            baseline = json.load(f)
+
+    scenarios = [get_scenario(size, options.groups, options.complexity, options.provisioners, options.templating, options.jobs) for size in sizes]
+    results = run_benchmark(scenarios, options.repeat)
+
+    report(results, out, baseline)
+
+    if options.output:
+        with open(options.output, 'wb') as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, options.tolerance)
+        for nodes, phase, base_value, value in regressions:
+            out.write('Regression: %s at %i nodes, %s (baseline %s)\n' % (phase, nodes, value, base_value))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
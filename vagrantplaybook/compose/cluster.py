@@ -3,14 +3,57 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 import os
+import re
 import sys
 from functools import partial
 
 from vagrantplaybook.compat import compat_string_types
-from vagrantplaybook.ansible import ansible_tempar, ansible_unwrap
+from vagrantplaybook.ansible import ansible_unwrap
 
 from vagrantplaybook.errors import ContextVarGeneratorError, GroupVarGeneratorError, HostVarGeneratorError
 from vagrantplaybook.compose.nodegroup import NodeGroup
+from vagrantplaybook.compose.nodetable import NodeTable
+from vagrantplaybook.compose.state import fingerprint
+from vagrantplaybook.compose.templatecache import TemplateCache
+from vagrantplaybook.compose.generator import ValueGenerator, iter_templates
+from vagrantplaybook.templating.backend import create_templating_backend
+from vagrantplaybook.profiler import NULL_PROFILER
+
+# The syntax of an item in a selection of nodes: a nodegroup, optionally followed by an index or a slice of its nodes
+_SELECTION_ITEM = re.compile(r'^(?P<name>[^\[\]]+?)\s*(?:\[\s*(?:(?P<index>-?\d+)|(?P<start>-?\d*)\s*:\s*(?P<stop>-?\d*))\s*\])?$')
+
+def parse_selection(only):
+    '''Parses a selection of nodes, that is a comma separated list of nodegroups, each one optionally followed by an index or
+    a python-like slice of the nodes in the nodegroup (e.g. 'master', 'master[0]', 'master[0:2]', 'master,slave[-2:]');
+    it returns a list of (nodegroup name, start, stop) tuples, with None for omitted slice bounds.
+
+    Keyword arguments:
+    only            -- The selection, as a string or a list of strings
+    '''
+
+    if isinstance(only, compat_string_types):
+        only = [only]
+
+    selection = []
+    for item in (item.strip() for spec in only for item in spec.split(',')):
+        if not item:
+            continue
+
+        match = _SELECTION_ITEM.match(item)
+        if match is None:
+            raise ValueError("Invalid selection '%s': expected nodegroup, nodegroup[index] or nodegroup[start:stop]" % item)
+
+        name, index, start, stop = match.group('name', 'index', 'start', 'stop')
+        if index is not None:
+            index = int(index)
+            selection.append((name, index, index + 1 if index != -1 else None))
+        else:
+            selection.append((name, int(start) if start else None, int(stop) if stop else None))
+
+    if not selection:
+        raise ValueError('Invalid selection: no nodegroups selected')
+
+    return selection
 
 class Cluster:
     '''
@@ -19,12 +62,14 @@ class Cluster:
     vagrant cluster composed by several machines with different roles.
     '''
 
-    def __init__(self, name, loader):
+    def __init__(self, name, templating = None, templates = None):
         '''Creates a new Cluster.
 
         Keyword arguments:
         name            -- The name of the cluster.
-        loader          -- The ansible dataloader, that will be used for generating an ansible templar manager
+        templating      -- The templating backend, that will be used for executing value generators (default the ansible templating backend)
+        templates       -- The cache of compiled templates to be used by value generators, e.g. shared by all the clusters
+                           composed by a long-lived process (default a new cache, using the templating backend)
         '''
 
         self.name = name
@@ -58,8 +103,13 @@ class Cluster:
         # A dictionary, that will be used to store nodeGroups in the cluster
         self._node_groups = {}
 
-        # Creates the ansible templar
-        self._ansible_templar = ansible_tempar(loader)
+        # The templating backend
+        if templates is not None:
+            templating = templates.backend
+        self._templating = templating if templating is not None else create_templating_backend()
+
+        # Creates the cache of compiled templates, shared by all the value generators in the cluster
+        self._template_cache = templates if templates is not None else TemplateCache(self._templating)
 
     def add_node_group(self, name, instances):
         '''Adds a group of nodes to the cluster.
@@ -88,29 +138,225 @@ class Cluster:
 
         return self._node_groups[name]
 
-    def compose(self):
-        '''Composes the cluster by generating nodes - VM instances - in each group of nodes '''
+    def validate(self):
+        '''Validates the cluster definition, by checking value generators in each group of nodes can be sorted in evaluation order.
+        Raises ValueGeneratorCycleError in case of circular references between value generators.
+        '''
+
+        for key, group in self._node_groups.iteritems():
+            group.plan(self._template_cache)
+
+    def compose(self, jobs = 1, state = None, profiler = None, selection = None):
+        '''Composes the cluster by generating nodes - VM instances - in each group of nodes.
+        If the state of the last compose is given, the cluster is recomposed incrementally: nodes and vars that do not depend
+        on changed definitions are reused, and the state is updated with the slices of the cluster that were recomputed.
+        If a selection is given, only the selected nodes (and their ansible groups and vars) are composed, with the same
+        indexes and values of a full compose (see _compose_selection); the state is not used.
+
+        Keyword arguments:
+        jobs            -- The number of worker processes to be used for composing the cluster (default 1, no worker processes).
+        state           -- The ComposeState of the last compose, or None (default, the whole cluster is composed)
+        profiler        -- The Profiler recording compose phases (and value generators stats, traces), or None (default, phases are not recorded)
+        selection       -- The selected nodes, as a list of (nodegroup name, start, stop) tuples (see parse_selection), or None (default, all the nodes)
+        '''
+
+        profiler = profiler if profiler is not None else NULL_PROFILER
+
+        pool = None
+        if jobs > 1:
+            # multiprocessing is imported only when a pool of worker processes is required
+            from vagrantplaybook.compose.parallel import ComposePool
+            pool = ComposePool(jobs, self._templating.name, profiler.generators, profiler.trace)
+
+        # value generators and traces are recorded only while the cluster is composed
+        self._template_cache.stats = profiler.generators
+        self._template_cache.trace = profiler.trace
+        try:
+            if selection is not None:
+                result = self._compose_selection(pool, selection, profiler)
+            else:
+                result = self._compose(pool, state, profiler)
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            self._template_cache.stats = None
+            self._template_cache.trace = None
+
+        if pool is not None:
+            pool.close()
+
+        return result
+
+    def _compose(self, pool, state = None, profiler = NULL_PROFILER):
+        '''Composes the cluster, using a pool of worker processes (if any).
+
+        Keyword arguments:
+        pool            -- The pool of worker processes, or None
+        state           -- The ComposeState of the last compose, or None
+        profiler        -- The Profiler recording compose phases
+        '''
+
+        if state is not None:
+            state.begin()
+
         ## Phase1: Node creation
-        # All NodeGroups are composed creating a unique list of nodes
-        nodes = self._get_nodes()
+        # All NodeGroups are composed creating a unique list of nodes
+        with profiler.phase('nodes') as phase:
+            nodes = self._get_nodes(pool, state)
+            phase.count = len(nodes)
 
         ## Phase2: Creates inventory for Ansible provisioning
         # Create a list of ansible_groups, with related nodes
-        ansible_groups, extended_ansible_groups = self._get_ansible_groups(nodes)
+        with profiler.phase('ansible_groups') as phase:
+            ansible_groups, extended_ansible_groups = self._get_ansible_groups(nodes)
+            phase.count = len(extended_ansible_groups)
 
         ## Phase3: Creates ansible_group_vars and ansible_host_vars file
         # context_vars are variables shared between all groups/hosts generators.
-        context_vars = self._get_context_vars(extended_ansible_groups)
+        with profiler.phase('context_vars') as phase:
+            context_vars = self._get_context_vars(extended_ansible_groups, state)
+            phase.count = len(context_vars)
         # generate ansible_group_vars
-        ansible_group_vars = self._get_ansible_group_vars(extended_ansible_groups, context_vars)
+        with profiler.phase('group_vars') as phase:
+            ansible_group_vars = self._get_ansible_group_vars(extended_ansible_groups, context_vars, state)
+            phase.count = sum(len(group_vars) for group_vars in ansible_group_vars.itervalues())
         # generate ansible_host_vars
-        ansible_host_vars = self._get_ansible_host_vars(nodes, context_vars)
+        with profiler.phase('host_vars') as phase:
+            ansible_host_vars = self._get_ansible_host_vars(nodes, context_vars, pool, state)
+            phase.count = sum(len(host_vars) for host_vars in ansible_host_vars.itervalues())
 
         ## Phase4: Creates ansible_inventory
-        inventory = self._get_ansible_inventory(ansible_groups)
+        with profiler.phase('inventory') as phase:
+            inventory = self._get_ansible_inventory(ansible_groups)
+            phase.count = sum(len(hosts) for hosts in inventory.itervalues())
+
+        if state is not None:
+            state.end()
+
+        return nodes, inventory, ansible_group_vars, ansible_host_vars
+
+    def _compose_selection(self, pool, selection, profiler = NULL_PROFILER):
+        '''Composes only the selected nodes of the cluster, with their host vars, and the ansible groups they belong to
+        (with their group vars); nodes have the same indexes of a full compose, because offsets are computed from the
+        number of instances of nodegroups.
+        Context vars and group vars depend on all the nodes in an ansible group, so all the nodes are composed (but host vars
+        are generated only for the selected nodes) only if the group vars and host vars of the selected nodes reference
+        context vars, or group vars reference nodes; otherwise context vars are not generated at all.
+
+        Keyword arguments:
+        pool            -- The pool of worker processes, or None
+        selection       -- The selected nodes, as a list of (nodegroup name, start, stop) tuples
+        profiler        -- The Profiler recording compose phases
+        '''
+
+        ranges = self._get_selection_ranges(selection)
+
+        ## Phase1: Node creation
+        # Only selected nodes are composed, unless the vars of their ansible groups depend on all the nodes
+        with profiler.phase('nodes') as phase:
+            nodes = NodeTable()
+            for group, cluster_offset, start, stop in ranges:
+                nodes.extend(group.compose(self._template_cache, self.name, self.node_prefix, self.domain, cluster_offset, start = start, stop = stop))
+
+            selected_ansible_groups = set(ansible_group for node_ansible_groups in nodes.column('ansible_groups') for ansible_group in node_ansible_groups)
+            all_nodes = None
+            if self._selection_depends_on_nodes(selected_ansible_groups):
+                # NB. selected nodes are taken from the table of all the nodes, so vars are generated from the same values
+                all_nodes = self._get_nodes(pool)
+                nodes = NodeTable()
+                for group, cluster_offset, start, stop in ranges:
+                    nodes.extend(all_nodes[cluster_offset + start:cluster_offset + stop])
+            phase.count = len(nodes)
+
+        ## Phase2: Creates inventory for Ansible provisioning
+        with profiler.phase('ansible_groups') as phase:
+            ansible_groups, extended_ansible_groups = self._get_ansible_groups(nodes)
+            phase.count = len(extended_ansible_groups)
+
+        ## Phase3: Creates ansible_group_vars and ansible_host_vars file
+        # context vars and group vars are generated with all the nodes in each ansible group, if required
+        with profiler.phase('context_vars') as phase:
+            context_vars = {}
+            if all_nodes is not None:
+                all_ansible_groups, vars_ansible_groups = self._get_ansible_groups(all_nodes)
+                context_vars = self._get_context_vars(vars_ansible_groups)
+            else:
+                vars_ansible_groups = extended_ansible_groups
+            phase.count = len(context_vars)
+        with profiler.phase('group_vars') as phase:
+            ansible_group_vars = self._get_ansible_group_vars({ ansible_group: vars_ansible_groups[ansible_group] for ansible_group in extended_ansible_groups }, context_vars)
+            phase.count = sum(len(group_vars) for group_vars in ansible_group_vars.itervalues())
+        with profiler.phase('host_vars') as phase:
+            ansible_host_vars = self._get_ansible_host_vars(nodes, context_vars, pool)
+            phase.count = sum(len(host_vars) for host_vars in ansible_host_vars.itervalues())
+
+        ## Phase4: Creates ansible_inventory (with only the selected nodes)
+        with profiler.phase('inventory') as phase:
+            inventory = self._get_ansible_inventory(ansible_groups)
+            phase.count = sum(len(hosts) for hosts in inventory.itervalues())
 
         return nodes, inventory, ansible_group_vars, ansible_host_vars
 
+    def _get_selection_ranges(self, selection):
+        '''Gets the ranges of selected nodes, as a list of (nodegroup, offset of the nodegroup, start, stop) tuples in nodegroups order;
+        overlapping ranges in the same nodegroup are merged, so each node is composed once. Unknown nodegroups, and indexes or slices
+        not selecting any node raise ValueError.
+
+        Keyword arguments:
+        selection       -- The selected nodes, as a list of (nodegroup name, start, stop) tuples
+        '''
+
+        selected = {}
+        for name, start, stop in selection:
+            if name not in self._node_groups:
+                raise ValueError("Invalid selection: nodegroup '%s' does not exist in cluster %s" % (name, self.name))
+            instances = self._node_groups[name].instances
+            selected_start, selected_stop, step = slice(start, stop).indices(instances)
+            if selected_start >= selected_stop:
+                # NB. indexes are parsed as slices of one node
+                if start is not None and (stop == start + 1 or (start == -1 and stop is None)):
+                    bounds = '%i' % start
+                else:
+                    bounds = '%s:%s' % ('' if start is None else start, '' if stop is None else stop)
+                raise ValueError("Invalid selection: %s[%s] does not select any node of nodegroup '%s', with %i instances" % (name, bounds, name, instances))
+            selected.setdefault(name, []).append((selected_start, selected_stop))
+
+        ranges = []
+        cluster_offset = 0
+        for key, group in self._node_groups.iteritems():
+            merged = []
+            for start, stop in sorted(selected.get(key, ())):
+                if merged and start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], stop)
+                else:
+                    merged.append([start, stop])
+            ranges.extend((group, cluster_offset, start, stop) for start, stop in merged)
+            cluster_offset += group.instances
+
+        return ranges
+
+    def _selection_depends_on_nodes(self, ansible_groups):
+        '''Checks if the group vars or host vars of a list of ansible groups depend on all the nodes in the cluster, that is
+        they reference context vars (generated from all the nodes in an ansible group) or group vars reference nodes;
+        volatile var generators are considered dependent, because they can't be analyzed reliably.
+
+        Keyword arguments:
+        ansible_groups  -- The ansible groups of the selected nodes.
+        '''
+
+        for generators, dependencies in ((self._ansible_group_vars_generators, ('context', 'nodes')), (self._ansible_host_vars_generators, ('context',))):
+            for ansible_group in list(ansible_groups) + ['all']:
+                for var_generator in generators.get(ansible_group, {}).itervalues():
+                    if var_generator.literal:
+                        continue
+                    references, volatile = var_generator.analyze(self._template_cache)
+                    if volatile or any(dependency in references for dependency in dependencies):
+                        return True
+
+        return False
+
     def __setattr__(self, name, value):
 
         #TODO: improve/centralize validation
@@ -138,6 +384,9 @@ class Cluster:
                                 raise TypeError("Invalid value for attribute '%s'. Check documentation." % (name))
                             if not isinstance(v1, dict):
                                 raise TypeError("Invalid value for attribute '%s'. Check documentation." % (name))
+
+            # classifies the var generators once, when they are assigned
+            self.__dict__['_%s_generators' % name] = { k1: { ansible_unwrap(k2): ValueGenerator(v2) for k2, v2 in v1.iteritems() } for k1, v1 in value.iteritems() }
         else:
             if name.startswith("_"):
                 self.__dict__[name] = value
@@ -147,12 +396,72 @@ class Cluster:
 
         self.__dict__[name] = value
 
-    def _get_nodes(self):
-        '''Gets the list of nodes by composing all the nodegroups.'''
+    def _get_nodes(self, pool = None, state = None):
+        '''Gets the table of nodes by composing all the nodegroups; nodes are stored in the table as soon as they are composed.
+
+        Keyword arguments:
+        pool            -- The pool of worker processes to be used for composing nodegroups (default None, nodegroups are composed in this process)
+        state           -- The ComposeState of the last compose (default None, all the nodegroups are composed)
+        '''
+
+        if state is not None:
+            return self._get_nodes_incremental(pool, state)
 
-        nodes = []
+        if pool is not None:
+            return pool.compose_node_groups(self._node_groups.values(), self.name, self.node_prefix, self.domain)
+
+        nodes = NodeTable()
         for key, group in self._node_groups.iteritems():
-            nodes.extend(group.compose(self._ansible_templar, self.name, self.node_prefix, self.domain, len(nodes) ))
+            nodes.extend(group.compose(self._template_cache, self.name, self.node_prefix, self.domain, len(nodes) ))
+
+        return nodes
+
+    def _get_nodes_incremental(self, pool, state):
+        '''Gets the table of nodes by reusing the nodes of unchanged nodegroups, and composing only changed nodegroups.
+        A nodegroup is unchanged if its definition, its offset and cluster attributes are the same of the last compose;
+        the ansible groups of its nodes, and a fingerprint of node values are stored in the state for next compose stages.
+
+        Keyword arguments:
+        pool            -- The pool of worker processes to be used for composing nodegroups, or None
+        state           -- The ComposeState of the last compose
+        '''
+
+        # gets the nodes of unchanged nodegroups
+        slices = []
+        changed = []
+        cluster_offset = 0
+        for key, group in self._node_groups.iteritems():
+            definition = group.definition(self._template_cache)
+            group_fingerprint = None if definition is None else fingerprint(definition, cluster_offset, self.name, self.node_prefix, self.domain, self._templating.name)
+
+            value = state.get('node_groups', key, group_fingerprint)
+            if value is None:
+                changed.append((key, group, cluster_offset, group_fingerprint))
+            slices.append((key, value))
+            cluster_offset += group.instances
+
+        # composes changed nodegroups
+        if pool is not None and changed:
+            composed = pool.compose_node_groups([c[1] for c in changed], self.name, self.node_prefix, self.domain, offsets = [c[2] for c in changed])
+            boundaries = [0]
+            for key, group, cluster_offset, group_fingerprint in changed:
+                boundaries.append(boundaries[-1] + group.instances)
+            tables = [composed[start:stop] for start, stop in zip(boundaries, boundaries[1:])]
+        else:
+            tables = [NodeTable(group.compose(self._template_cache, self.name, self.node_prefix, self.domain, cluster_offset)) for key, group, cluster_offset, group_fingerprint in changed]
+
+        values = {}
+        for (key, group, cluster_offset, group_fingerprint), group_nodes in zip(changed, tables):
+            ansible_groups = frozenset(ansible_group for node_ansible_groups in group_nodes.column('ansible_groups') for ansible_group in node_ansible_groups)
+            values[key] = (group_nodes, fingerprint([node.values() for node in group_nodes]), ansible_groups)
+            state.put('node_groups', key, group_fingerprint, values[key])
+
+        # merges nodes in nodegroups order
+        nodes = NodeTable()
+        for key, value in slices:
+            group_nodes, nodes_fingerprint, ansible_groups = value if value is not None else values[key]
+            state.slices.append((key, nodes_fingerprint, ansible_groups, len(nodes), len(nodes) + len(group_nodes)))
+            nodes.extend(group_nodes)
 
         return nodes
 
@@ -161,11 +470,13 @@ class Cluster:
         NB. A node can be in zero, one or more than one ansible groups
 
         Keyword arguments:
-        nodes           -- The list of nodes.
+        nodes           -- The table of nodes.
         '''
 
         ansible_groups = {}
+        all_nodes = []
         for node in nodes:
+            all_nodes.append(node)
             for ansible_group in node.ansible_groups:
                 if ansible_group not in ansible_groups:
                     ansible_groups[ansible_group] = []
@@ -173,12 +484,14 @@ class Cluster:
                 ansible_groups[ansible_group].append(node)
 
         extended_ansible_groups = ansible_groups.copy()
-        extended_ansible_groups['all'] = nodes
+        extended_ansible_groups['all'] = all_nodes
 
         return ansible_groups, extended_ansible_groups
 
     def _get_ansible_inventory(self, ansible_groups):
         '''Gets the ansible to be used when provisioning VMs with vagrant/ansible.
+        NB. Hosts in each ansible_group are the rows of the table of nodes - and not copies of node values -;
+        only boxname and hostname are part of the inventory.
 
         Keyword arguments:
         ansible_groups  -- The list of ansible_groups, each one with its own list of nodes.
@@ -187,15 +500,16 @@ class Cluster:
         inventory = {}
         for ansible_group, ansible_group_nodes in ansible_groups.iteritems():
             if ansible_group not in inventory:
-                inventory[ansible_group] = [dict( boxname=node.boxname, hostname=node.hostname) for node in ansible_group_nodes]
+                inventory[ansible_group] = ansible_group_nodes
 
         return inventory
 
-    def _get_context_vars(self, ansible_groups):
+    def _get_context_vars(self, ansible_groups, state = None):
         '''Gets the context_vars to be used when generating group_vars and host_vars.
 
         Keyword arguments:
         ansible_groups  -- The list of ansible_groups, each one with its own list of nodes.
+        state           -- The ComposeState of the last compose (default None, all the context vars are generated)
         '''
 
         context_vars = {}
@@ -203,34 +517,44 @@ class Cluster:
             # if a context variable provisioner is defined for the group
             if ansible_group in self.ansible_context_vars:
                 # gets the provisioner (a list of var provisioners)
-                provisioners = self.ansible_context_vars[ansible_group]
-                provisioners = ansible_unwrap(provisioners)
-
-                # for each var/var generator
-                for var_name, var_generator in provisioners.iteritems():
+                provisioners = self._ansible_context_vars_generators[ansible_group]
 
-                    # set the variables available within the ninja context for value generation
-                    self._ansible_templar.set_available_variables(dict(
-                        nodes = ansible_group_nodes
-                    ))
+                # context vars of the group are reused if the provisioner and the nodes in the group did not change
+                group_fingerprint = None
+                if state is not None:
+                    group_fingerprint = self._get_ansible_group_fingerprint(state, ansible_group, provisioners)
 
-                    # generates the values (or simple keeps the given value)
-                    try:
-                        value = self._ansible_templar.template(var_generator)
-                    except Exception, e:
-                        raise ContextVarGeneratorError(ansible_group, var_name, e.message), None, sys.exc_info()[2]
+                context_vars.update(self._reuse(state, 'context_vars', ansible_group, group_fingerprint, self._generate_context_vars, ansible_group, ansible_group_nodes, provisioners))
 
-                    # store the generated context var
-                    context_vars[var_name] = ansible_unwrap(value)
+        # group vars and host vars referencing context vars are reused only if context values did not change
+        if state is not None:
+            state.context_fingerprint = fingerprint(sorted(context_vars.iteritems()))
 
         return context_vars
 
-    def _get_ansible_group_vars(self, ansible_groups, context_vars):
+    def _generate_context_vars(self, ansible_group, ansible_group_nodes, provisioners):
+        '''Generates the context_vars of an ansible group.
+
+        Keyword arguments:
+        ansible_group       -- The ansible group.
+        ansible_group_nodes -- The list of nodes in the ansible group.
+        provisioners        -- The context var generators of the ansible group.
+        '''
+
+        # set the variables available within the ninja context for value generation (shared by all the vars in the group)
+        available_variables = dict(
+            nodes = ansible_group_nodes
+        )
+
+        return generate_vars(self._template_cache, 'context', ansible_group, provisioners, available_variables, ContextVarGeneratorError)
+
+    def _get_ansible_group_vars(self, ansible_groups, context_vars, state = None):
         '''Gets the ansible_group_vars for ansible provisioning.
 
         Keyword arguments:
         ansible_groups  -- The list of ansible_groups, each one with its own list of nodes.
         context_vars    -- The list of context_vars
+        state           -- The ComposeState of the last compose (default None, all the group vars are generated)
         '''
         ansible_group_vars = {}
 
@@ -238,64 +562,305 @@ class Cluster:
 
             # if a variable provisioner is defined for the group
             if ansible_group in self.ansible_group_vars:
-                ansible_group_vars[ansible_group] = {}
-
                 # gets the provisioner (a list of var provisioners)
-                provisioners = self.ansible_group_vars[ansible_group]
-                provisioners = ansible_unwrap(provisioners)
-
-                # for each var/var generator
-                for var_name, var_generator in provisioners.iteritems():
-                    # set the variables available within the ninja context for value generation
-                    self._ansible_templar.set_available_variables(dict(
-                        context = context_vars,
-                        nodes = ansible_group_nodes
-                    ))
-
-                    # generates the values (or simple keeps the given value)
-                    try:
-                        value = self._ansible_templar.template(var_generator)
-                    except Exception, e:
-                        raise GroupVarGeneratorError(ansible_group, var_name, e.message), None, sys.exc_info()[2]
-
-                    # store the generated ansible_group_var
-                    ansible_group_vars[ansible_group][var_name] = ansible_unwrap(value)
+                provisioners = self._ansible_group_vars_generators[ansible_group]
+
+                # group vars are reused if the provisioner, the nodes in the group and - if referenced - context vars did not change
+                group_fingerprint = None
+                if state is not None:
+                    group_fingerprint = self._get_ansible_group_fingerprint(state, ansible_group, provisioners)
+
+                ansible_group_vars[ansible_group] = self._reuse(state, 'group_vars', ansible_group, group_fingerprint, self._generate_ansible_group_vars, ansible_group, ansible_group_nodes, provisioners, context_vars)
 
         return ansible_group_vars
 
-    def _get_ansible_host_vars(self, nodes, context_vars):
+    def _generate_ansible_group_vars(self, ansible_group, ansible_group_nodes, provisioners, context_vars):
+        '''Generates the ansible_group_vars of an ansible group.
+
+        Keyword arguments:
+        ansible_group       -- The ansible group.
+        ansible_group_nodes -- The list of nodes in the ansible group.
+        provisioners        -- The group var generators of the ansible group.
+        context_vars        -- The list of context_vars
+        '''
+
+        # set the variables available within the ninja context for value generation (shared by all the vars in the group)
+        available_variables = dict(
+            context = context_vars,
+            nodes = ansible_group_nodes
+        )
+
+        return generate_vars(self._template_cache, 'group', ansible_group, provisioners, available_variables, GroupVarGeneratorError)
+
+    def _get_ansible_host_vars(self, nodes, context_vars, pool = None, state = None):
         '''Gets the ansible_host_vars for ansible provisioning.
 
         Keyword arguments:
-        ansible_groups  -- The list of ansible_groups, each one with its own list of nodes.
+        nodes           -- The table of nodes.
         context_vars    -- The list of context_vars
+        pool            -- The pool of worker processes to be used for generating host vars (default None, host vars are generated in this process)
+        state           -- The ComposeState of the last compose (default None, all the host vars are generated)
         '''
+
+        if state is not None:
+            return self._get_ansible_host_vars_incremental(nodes, context_vars, pool, state)
+
+        if pool is not None:
+            tasks = [(chunk, context_vars, self._ansible_host_vars_generators) for chunk in pool.chunks(nodes)]
+            results = pool.map(get_nodes_host_vars, tasks)
+        else:
+            results = [get_nodes_host_vars(self._template_cache, nodes, context_vars, self._ansible_host_vars_generators)]
+
         ansible_host_vars = {}
+        for result in results:
+            for hostname, host_vars in result:
+                ansible_host_vars[hostname] = host_vars
 
-        for node in nodes:
-            ansible_host_vars[node.hostname] = {}
+        return ansible_host_vars
 
-            for ansible_group in node.ansible_groups:
-                # if a variable provisioner is defined for the group
-                if ansible_group in self.ansible_host_vars:
-                    # gets the provisioner (a list of var provisioners)
-                    provisioners = self.ansible_host_vars[ansible_group]
-                    provisioners = ansible_unwrap(provisioners)
-
-                    for var_name, var_generator in provisioners.iteritems():
-                        # set the variables available within the ninja context for value generation
-                        self._ansible_templar.set_available_variables(dict(
-                            context = context_vars,
-                            node = node
-                        ))
-
-                        # generates the values (or simple keeps the given value)
-                        try:
-                            value = self._ansible_templar.template(var_generator)
-                        except Exception, e:
-                            raise HostVarGeneratorError(node.hostname, var_name, e.message), None, sys.exc_info()[2]
-
-                        # store the generated ansible_host_var
-                        ansible_host_vars[node.hostname][var_name] = ansible_unwrap(value)
+    def _get_ansible_host_vars_incremental(self, nodes, context_vars, pool, state):
+        '''Gets the ansible_host_vars by reusing host vars of unchanged nodegroups, and generating only host vars of changed nodegroups.
+        Host vars of a nodegroup are unchanged if its nodes, the provisioners of their ansible groups and - if referenced - context vars
+        are the same of the last compose.
+
+        Keyword arguments:
+        nodes           -- The table of nodes.
+        context_vars    -- The list of context_vars
+        pool            -- The pool of worker processes to be used for generating host vars, or None
+        state           -- The ComposeState of the last compose
+        '''
+
+        # gets the host vars of unchanged nodegroups
+        results = []
+        changed = []
+        for key, nodes_fingerprint, ansible_groups, start, stop in state.slices:
+            slice_fingerprint = self._get_host_vars_fingerprint(state, nodes_fingerprint, ansible_groups)
+            result = state.get('host_vars', key, slice_fingerprint)
+            if result is None:
+                changed.append((len(results), key, slice_fingerprint, nodes[start:stop]))
+            results.append(result)
+
+        # generates the host vars of changed nodegroups
+        if pool is not None and changed:
+            tasks = []
+            owners = []
+            for position, key, slice_fingerprint, slice_nodes in changed:
+                for chunk in pool.chunks(slice_nodes):
+                    tasks.append((chunk, context_vars, self._ansible_host_vars_generators))
+                    owners.append(position)
+
+            for position, key, slice_fingerprint, slice_nodes in changed:
+                results[position] = []
+            for position, result in zip(owners, pool.map(get_nodes_host_vars, tasks)):
+                results[position].extend(result)
+        else:
+            for position, key, slice_fingerprint, slice_nodes in changed:
+                results[position] = get_nodes_host_vars(self._template_cache, slice_nodes, context_vars, self._ansible_host_vars_generators)
+
+        for position, key, slice_fingerprint, slice_nodes in changed:
+            state.put('host_vars', key, slice_fingerprint, results[position])
+
+        ansible_host_vars = {}
+        for result in results:
+            for hostname, host_vars in result:
+                ansible_host_vars[hostname] = host_vars
 
         return ansible_host_vars
+
+    def _get_provisioners_fingerprint(self, provisioners):
+        '''Gets the fingerprint of the var generators of an ansible group, or None if a var generator is volatile,
+        and the names of the variables referenced by var generators.
+
+        Keyword arguments:
+        provisioners    -- The var generators of an ansible group.
+        '''
+
+        references = set()
+        for var_generator in provisioners.itervalues():
+            if not var_generator.literal:
+                var_references, volatile = var_generator.analyze(self._template_cache)
+                if volatile:
+                    return None, references
+                references.update(var_references)
+
+        return fingerprint(sorted((var_name, var_generator.source) for var_name, var_generator in provisioners.iteritems()), self._templating.name), references
+
+    def _get_ansible_group_fingerprint(self, state, ansible_group, provisioners):
+        '''Gets the fingerprint of the vars of an ansible group, that depend on the var generators and on the nodes in the group
+        (and on context vars, if referenced); it is None if vars of the group should be always generated.
+
+        Keyword arguments:
+        state               -- The ComposeState of the current compose.
+        ansible_group       -- The ansible group.
+        provisioners        -- The var generators of the ansible group.
+        '''
+
+        provisioners_fingerprint, references = self._get_provisioners_fingerprint(provisioners)
+        if provisioners_fingerprint is None:
+            return None
+
+        # NB. context vars are not available when context vars are generated
+        context_fingerprint = state.context_fingerprint if 'context' in references else ''
+
+        # the nodes in the ansible group depend only on the nodes of nodegroups with at least a node in the ansible group
+        members = [nodes_fingerprint for key, nodes_fingerprint, ansible_groups, start, stop in state.slices if ansible_group == 'all' or ansible_group in ansible_groups]
+
+        return fingerprint(ansible_group, provisioners_fingerprint, context_fingerprint, members)
+
+    def _get_host_vars_fingerprint(self, state, nodes_fingerprint, ansible_groups):
+        '''Gets the fingerprint of the host vars of a nodegroup, that depend on the nodes in the nodegroup and on the var generators
+        of their ansible groups (and on context vars, if referenced); it is None if host vars should be always generated.
+
+        Keyword arguments:
+        state               -- The ComposeState of the current compose.
+        nodes_fingerprint   -- The fingerprint of the nodes in the nodegroup.
+        ansible_groups      -- The ansible groups of the nodes in the nodegroup.
+        '''
+
+        provisioners = []
+        context_fingerprint = ''
+        for ansible_group in sorted(ansible_groups):
+            if ansible_group in self._ansible_host_vars_generators:
+                provisioners_fingerprint, references = self._get_provisioners_fingerprint(self._ansible_host_vars_generators[ansible_group])
+                if provisioners_fingerprint is None:
+                    return None
+                if 'context' in references:
+                    context_fingerprint = state.context_fingerprint
+                provisioners.append((ansible_group, provisioners_fingerprint))
+
+        return fingerprint(nodes_fingerprint, provisioners, context_fingerprint)
+
+    def _reuse(self, state, stage, name, slice_fingerprint, generate, *args):
+        '''Gets the result of a compose stage for a slice of the cluster, reusing the result of the last compose if the fingerprint
+        did not change; otherwise the result is generated, and stored in the state.
+
+        Keyword arguments:
+        state             -- The ComposeState of the current compose, or None (the result is always generated)
+        stage             -- The compose stage.
+        name              -- The name of the slice of the cluster.
+        slice_fingerprint -- The fingerprint of everything the result depends on.
+        generate          -- The function generating the result, called with args.
+        '''
+
+        if state is None:
+            return generate(*args)
+
+        result = state.get(stage, name, slice_fingerprint)
+        if result is None:
+            result = generate(*args)
+            state.put(stage, name, slice_fingerprint, result)
+
+        return result
+
+def generate_vars(templates, scope, ansible_group, provisioners, available_variables, error):
+    '''Generates all the vars of an ansible group in one pass, rendering each var generator with the same variables
+    (so the templating backend sets the variables available within the ninja context only once).
+
+    Keyword arguments:
+    templates            -- The cache of compiled templates
+    scope                -- The scope of generated vars ('context' or 'group'), used for identifying generators in generator stats
+    ansible_group        -- The ansible group.
+    provisioners         -- The var generators of the ansible group.
+    available_variables  -- Variables available within the execution context of var generators
+    error                -- The exception to be raised when a var can't be generated
+    '''
+    group_vars = {}
+
+    # for each var/var generator
+    for var_name, var_generator in provisioners.iteritems():
+        # generates the values (or simple copies the given literal value)
+        try:
+            value = var_generator.generate(templates, available_variables, (scope, ansible_group, var_name))
+        except Exception, e:
+            raise error(ansible_group, var_name, e.message), None, sys.exc_info()[2]
+
+        # store the generated var
+        group_vars[var_name] = value
+
+    return group_vars
+
+def get_host_vars_plan(templates, ansible_groups, host_vars_generators):
+    '''Gets the plan for generating the ansible_host_vars of nodes in a list of ansible groups, that is the list of
+    (var name, var generator, ansible group) to be evaluated for each node, with templates already compiled.
+
+    When the same var is defined for more than one group, the var generator of the group that comes last in the list
+    of ansible groups of the node takes precedence (and the other var generators are not evaluated); vars are sorted by name.
+
+    Keyword arguments:
+    templates            -- The cache of compiled templates
+    ansible_groups       -- The list of ansible groups of a node
+    host_vars_generators -- The host var generators, grouped by ansible group
+    '''
+    generators = {}
+
+    for ansible_group in ansible_groups:
+        # if a variable provisioner is defined for the group
+        if ansible_group in host_vars_generators:
+            for var_name, var_generator in host_vars_generators[ansible_group].iteritems():
+                generators[var_name] = (var_name, var_generator, ansible_group)
+
+    plan = [generators[var_name] for var_name in sorted(generators)]
+
+    # templates are compiled once, when the plan is created (errors are raised when the var is generated, for the first node)
+    for var_name, var_generator, ansible_group in plan:
+        for source in iter_templates(var_generator.source):
+            try:
+                templates.compile(source)
+            except Exception:
+                pass
+
+    return plan
+
+def get_nodes_host_vars(templates, nodes, context_vars, host_vars_generators):
+    '''Gets the ansible_host_vars for a list of nodes; it is a function - and not a Cluster method - so it
+    can be executed by worker processes too.
+    Host var generators are planned once for each distinct list of ansible groups (see get_host_vars_plan),
+    and then evaluated for each node with the same variables.
+
+    Keyword arguments:
+    templates            -- The cache of compiled templates
+    nodes                -- The list of nodes.
+    context_vars         -- The list of context_vars
+    host_vars_generators -- The host var generators, grouped by ansible group
+    '''
+    ansible_host_vars = []
+
+    # A dictionary, that will be used to store host var plans, keyed by the list of ansible groups
+    plans = {}
+
+    # when tracing, a span is recorded for the host vars of each node
+    trace = templates.trace
+
+    for node in nodes:
+        if trace is not None:
+            node_start = trace.clock()
+
+        ansible_groups = tuple(node.ansible_groups)
+        plan = plans.get(ansible_groups)
+        if plan is None:
+            plan = plans[ansible_groups] = get_host_vars_plan(templates, ansible_groups, host_vars_generators)
+
+        node_host_vars = {}
+
+        # set the variables available within the ninja context for value generation (shared by all the vars of the node)
+        available_variables = dict(
+            context = context_vars,
+            node = node
+        )
+
+        for var_name, var_generator, ansible_group in plan:
+            # generates the values (or simple copies the given literal value)
+            try:
+                value = var_generator.generate(templates, available_variables, ('host', ansible_group, var_name))
+            except Exception, e:
+                raise HostVarGeneratorError(node.hostname, var_name, e.message), None, sys.exc_info()[2]
+
+            # store the generated ansible_host_var
+            node_host_vars[var_name] = value
+
+        ansible_host_vars.append((node.hostname, node_host_vars))
+
+        if trace is not None:
+            trace.complete(node.hostname, 'host_vars', node_start, trace.clock() - node_start, dict(node_index = node.index))
+
+    return ansible_host_vars
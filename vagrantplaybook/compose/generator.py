@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from vagrantplaybook.ansible import ansible_unwrap
+
+from vagrantplaybook.compose.templatecache import contains_template
+
+def is_literal(value):
+    ''' utility function for checking if a value - including nested lists and dictionaries - contains no template expressions
+
+    Keyword arguments:
+    value           --  The value to be checked
+    '''
+
+    if isinstance(value, (list, tuple)):
+        return all(is_literal(v) for v in value)
+    if isinstance(value, dict):
+        return all(is_literal(v) for v in value.itervalues())
+    return not contains_template(value)
+
+def iter_templates(value):
+    ''' utility function for iterating over the template strings in a value - including nested lists and dictionaries
+
+    Keyword arguments:
+    value           --  The value to be inspected
+    '''
+
+    if isinstance(value, (list, tuple)):
+        for v in value:
+            for t in iter_templates(v):
+                yield t
+    elif isinstance(value, dict):
+        for v in value.itervalues():
+            for t in iter_templates(v):
+                yield t
+    elif contains_template(value):
+        yield value
+
+def copy_literal(value):
+    ''' utility function for copying a literal value, so each generated value is a distinct object
+
+    Keyword arguments:
+    value           --  The literal value to be copied
+    '''
+
+    if isinstance(value, (list, tuple)):
+        return [copy_literal(v) for v in value]
+    if isinstance(value, dict):
+        return { k: copy_literal(v) for k, v in value.iteritems() }
+    return value
+
+class ValueGenerator:
+    '''
+    This class defines a value generator, that is a literal value or a ninja template used for generating values.
+    Value generators are classified when created; literal values are copied into each generated value
+    without using the template engine.
+    '''
+
+    def __init__(self, source):
+        '''Creates a new ValueGenerator.
+
+        Keyword arguments:
+        source          -- The value generator expression (a ninja template; can be also a literal)
+        '''
+
+        self.source = ansible_unwrap(source)
+        self.literal = is_literal(self.source)
+
+    def analyze(self, templates):
+        ''' Gets the names of the variables referenced by the value generator, and whether the value generator is volatile,
+        that is it can generate different values when executed with the same variables.
+
+        Keyword arguments:
+        templates            --  The cache of compiled templates
+        '''
+
+        references = set()
+        volatile = False
+        for source in iter_templates(self.source):
+            source_references, source_volatile = templates.analyze(source)
+            references.update(source_references)
+            volatile = volatile or source_volatile
+
+        return frozenset(references), volatile
+
+    def generate(self, templates, available_variables, key = None):
+        ''' Generates a value; if the cache of compiled templates has generator stats, the cost of the generator is recorded.
+
+        Keyword arguments:
+        templates            --  The cache of compiled templates
+        available_variables  --  Variables available within the execution context of the generator expression
+        key                  --  The (scope, group, var) tuple identifying the generator in generator stats
+        '''
+
+        stats = templates.stats
+        if stats is None or key is None:
+            return self._generate(templates, available_variables)
+
+        start = stats.timer()
+        value = self._generate(templates, available_variables)
+        stats.record(key, start, stats.timer() - start, value, available_variables)
+        return value
+
+    def _generate(self, templates, available_variables):
+        if self.literal:
+            return copy_literal(self.source)
+
+        return ansible_unwrap(templates.template(self.source, available_variables))
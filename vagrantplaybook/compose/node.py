@@ -7,8 +7,14 @@ class Node:
     This class defines a node throught a set of setting to be used when creating vagrant machines in the cluster.
     Settings will be assigned value by cluster.compose method, according with the configuration
     of the group of nodes to which the node belongs.
+    Nodes are slotted - without a per-instance dictionary - so large clusters can be composed with a small memory footprint.
     '''
 
+    # The node attributes (also the only instance attributes, as slots)
+    FIELDS = ('box', 'boxname', 'hostname', 'fqdn', 'aliases', 'ip', 'cpus', 'memory', 'ansible_groups', 'attributes', 'index', 'group_index')
+
+    __slots__ = FIELDS
+
     def __init__(self, box, boxname, hostname, fqdn, aliases, ip, cpus, memory, ansible_groups, attributes, index, group_index):
         '''Creates a new Node.
 
@@ -39,3 +45,14 @@ class Node:
         self.attributes     = attributes
         self.index          = index
         self.group_index    = group_index
+
+    def values(self):
+        ''' Gets the values of node attributes, in FIELDS order. '''
+        return tuple(getattr(self, field) for field in Node.FIELDS)
+
+    def __getstate__(self):
+        return self.values()
+
+    def __setstate__(self, state):
+        for field, value in zip(Node.FIELDS, state):
+            setattr(self, field, value)
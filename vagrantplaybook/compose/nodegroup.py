@@ -6,10 +6,10 @@ import sys
 from types import NoneType
 
 from vagrantplaybook.compat import compat_integer_types
-from vagrantplaybook.ansible import ansible_unwrap
 
-from vagrantplaybook.errors import ValueGeneratorError, ValueGeneratorTypeError
+from vagrantplaybook.errors import ValueGeneratorError, ValueGeneratorTypeError, ValueGeneratorCycleError
 from vagrantplaybook.compose.node import Node
+from vagrantplaybook.compose.generator import ValueGenerator, copy_literal
 
 class NodeGroup:
     '''
@@ -18,6 +18,15 @@ class NodeGroup:
     of the group of node itself.
     '''
 
+    # The node attributes assigned by value/value generators (the order is used when more than one evaluation order is possible)
+    GENERATORS = ['box', 'boxname', 'hostname', 'aliases', 'fqdn', 'ip', 'cpus', 'memory', 'ansible_groups', 'attributes']
+
+    # The expected type for values generated for node attributes (if different from NoneType)
+    TYPES = dict(cpus = compat_integer_types, memory = compat_integer_types)
+
+    # The variables available to value generators that have a different value for each node
+    NODE_VARIABLES = frozenset(['node_index'])
+
     def __init__(self, index, name, instances, box, boxname, hostname, fqdn, aliases, ip, cpus, memory, ansible_groups, attributes):
         '''Creates a new NodeGroup.
 
@@ -37,6 +46,9 @@ class NodeGroup:
         attributes      -- The value/value generator to be used for assigning a dictionary with custom attributes - Hash(String, obj) - to each node in this group.
         '''
 
+        # A dictionary, that will be used to store value generators, classified when attributes are assigned
+        self._generators    = {}
+
         self.index          = index
         self.name           = name
         self.instances      = instances
@@ -51,7 +63,7 @@ class NodeGroup:
         self.ansible_groups = ansible_groups
         self.attributes     = attributes
 
-    def compose(self, templar, cluster_name, cluster_node_prefix, cluster_domain, cluster_offset):
+    def compose(self, templates, cluster_name, cluster_node_prefix, cluster_domain, cluster_offset, emit = None, start = 0, stop = None):
         ''' Composes the group of nodes, by creating the required number of nodes in accordance with values/value generators.
 
         Additionally:
@@ -62,14 +74,33 @@ class NodeGroup:
           * fqdn (hostname + cluster_domain, if defined)
 
         Keyword arguments:
+        templates           -- The cache of compiled templates, used for generating values
         cluster_name        -- The name of the cluster
         cluster_node_prefix -- A prefix to be added before each node name / box name
         cluster_domain      -- The domain to which the cluster belongs
         cluster_offset      -- The offset - the initial group_index - to be used for nodes in the nodegroup
+        emit                -- The list of attributes to be assigned to nodes (default all); other attributes are left empty
+        start               -- The index of the first node to be composed (default 0)
+        stop                -- The index after the last node to be composed (default instances)
         '''
 
-        node_index = 0
-        while node_index < self.instances:
+        # value generators are executed in dependency order; value generators that do not depend on the node
+        # are executed only once, and values are shared by all nodes
+        plan = self.plan(templates, emit)
+        invariant_values = {}
+
+        stop = self.instances if stop is None else min(stop, self.instances)
+
+        # when tracing, a span is recorded for the group and for each node
+        trace = templates.trace
+        if trace is not None:
+            group_start = trace.clock()
+
+        node_index = start
+        while node_index < stop:
+
+          if trace is not None:
+            node_start = trace.clock()
 
           available_variables = dict(
             cluster_name = cluster_name,
@@ -80,42 +111,135 @@ class NodeGroup:
             node_index = node_index 
           )
 
-          box, available_variables            = self._generate(templar, 'box', self.box, available_variables)
-          boxname, available_variables        = self._generate(templar, 'boxname', self.boxname, available_variables)
-          hostname, available_variables       = self._generate(templar, 'hostname', self.hostname, available_variables)
-          aliases, available_variables        = self._generate(templar, 'aliases', self.aliases, available_variables)
-          fqdn, available_variables           = self._generate(templar, 'fqdn', self.fqdn, available_variables) 
-          ip, available_variables             = self._generate(templar, 'ip', self.ip, available_variables)
-          cpus, available_variables           = self._generate(templar, 'cpus', self.cpus, available_variables, type = compat_integer_types)
-          memory, available_variables         = self._generate(templar, 'memory', self.memory, available_variables, type = compat_integer_types)
-          ansible_groups, available_variables = self._generate(templar, 'ansible_groups', self.ansible_groups, available_variables)
-          attributes, available_variables     = self._generate(templar, 'attributes', self.attributes, available_variables)
+          values = dict.fromkeys(NodeGroup.GENERATORS)
+          for var, invariant in plan:
+            if var in invariant_values:
+              values[var] = available_variables[var] = copy_literal(invariant_values[var])
+            else:
+              values[var], available_variables = self._generate(templates, var, self._generators[var], available_variables, type = NodeGroup.TYPES.get(var, NoneType))
+              if invariant:
+                invariant_values[var] = values[var]
+
+          node = Node(index = cluster_offset + node_index, group_index = node_index, **values)
+          if trace is not None:
+            trace.complete(node.hostname or str(node_index), 'node', node_start, trace.clock() - node_start, dict(group = self.name, node_index = node_index))
 
-          yield Node(box, boxname, hostname, fqdn, aliases, ip, cpus, memory, ansible_groups, attributes, cluster_offset + node_index, node_index)
+          yield node
 
           node_index += 1
 
+        if trace is not None:
+          trace.complete('NodeGroup.compose', 'nodegroup', group_start, trace.clock() - group_start, dict(group = self.name, start = start, stop = stop))
+
     def __setattr__(self, name, value):
         #TODO: attribute type validation
         self.__dict__[name] = value
 
-    def _generate(self, ansible_templar, var, generator, available_variables, type = NoneType):
+        # classifies the value generator once, when it is assigned
+        if name in NodeGroup.GENERATORS:
+            self._generators[name] = ValueGenerator(value)
+
+    def definition(self, templates):
+        ''' Gets the definition of the group of nodes, that is a tuple with the group index, name, number of instances and
+        the sources of all the value generators; it is None if a value generator is volatile, and nodes can be
+        different each time the group is composed.
+
+        Keyword arguments:
+        templates            --  The cache of compiled templates
+        '''
+
+        for var in NodeGroup.GENERATORS:
+            if not self._generators[var].literal and self._generators[var].analyze(templates)[1]:
+                return None
+
+        return (self.index, self.name, self.instances) + tuple(self._generators[var].source for var in NodeGroup.GENERATORS)
+
+    def plan(self, templates, emit = None):
+        ''' Gets the evaluation plan for value generators, that is the list of attributes to be generated - each one with
+        a flag that is True if the value does not depend on the node, directly or through other attributes, and can be therefore
+        generated once for all the nodes in the group.
+        Attributes are sorted so each value generator is executed after the value generators of the attributes it references;
+        attributes that are not emitted and are not referenced by emitted attributes are not included in the plan.
+
+        Keyword arguments:
+        templates            --  The cache of compiled templates
+        emit                 --  The list of attributes to be assigned to nodes (default all)
+        '''
+
+        # gets the dependency graph between attributes
+        analysis = {}
+        dependencies = {}
+        for var in NodeGroup.GENERATORS:
+            analysis[var] = self._generators[var].analyze(templates)
+            dependencies[var] = analysis[var][0].intersection(NodeGroup.GENERATORS)
+
+        # gets the attributes required for generating emitted attributes
+        required = set()
+        pending = list(NodeGroup.GENERATORS if emit is None else emit)
+        while pending:
+            var = pending.pop()
+            if var not in required:
+                required.add(var)
+                pending.extend(dependencies[var])
+
+        # sorts attributes in dependency order
+        plan = []
+        resolved = set()
+        variants = set(NodeGroup.NODE_VARIABLES)
+        while len(resolved) < len(required):
+            unresolved = [var for var in NodeGroup.GENERATORS if var in required and var not in resolved]
+            ready = [var for var in unresolved if dependencies[var] <= resolved]
+            if not ready:
+                raise ValueGeneratorCycleError(self.name, self._get_cycle(unresolved[0], dependencies, resolved))
+
+            var = ready[0]
+            resolved.add(var)
+
+            references, volatile = analysis[var]
+            invariant = False
+            if not self._generators[var].literal:
+                if volatile or references & variants:
+                    variants.add(var)
+                else:
+                    invariant = True
+
+            plan.append((var, invariant))
+
+        return plan
+
+    def _get_cycle(self, var, dependencies, resolved):
+        ''' utility function for getting a circular reference between attributes, starting from an unresolved attribute
+
+        Keyword arguments:
+        var                  --  An attribute that can't be resolved
+        dependencies         --  The dependency graph between attributes
+        resolved             --  The attributes already resolved
+        '''
+
+        path = []
+        while var not in path:
+            path.append(var)
+            var = [d for d in NodeGroup.GENERATORS if d in dependencies[var] and d not in resolved][0]
+
+        return path[path.index(var):] + [var]
+
+    def _generate(self, templates, var, generator, available_variables, type = NoneType):
         ''' utility function for resolving value/value generators
 
         Keyword arguments:
-        ansible_templar      --  The ansible templar engine
+        templates            --  The cache of compiled templates
         var                  --  The name of the var to be generated
-        generator            --  The value generator expression (a ninja template managed by ansible; can be also a literal)
+        generator            --  The value generator (or a value generator expression, a ninja template managed by ansible; can be also a literal)
         available_variables  --  Variables available within the execution context of the generator expression
         type                 --  The expected type for the generated value
         '''
 
-        # set the variables available within the ninja context for value generation
-        ansible_templar.set_available_variables(available_variables)
+        if not isinstance(generator, ValueGenerator):
+            generator = ValueGenerator(generator)
 
-        # generates the values (or simple keeps the given value)
+        # generates the values (or simple copies the given literal value)
         try:
-            value = ansible_templar.template(generator)
+            value = generator.generate(templates, available_variables, ('node', self.name, var))
         except Exception, e:
             raise ValueGeneratorError(self.name, available_variables['node_index'], var, e.message), None, sys.exc_info()[2]
 
@@ -126,7 +250,6 @@ class NodeGroup:
         except Exception, e:
             raise ValueGeneratorTypeError(self.name, available_variables['node_index'], var, e.message)
 
-        value = ansible_unwrap(value)
         available_variables[var] = value
 
         return value, available_variables
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from array import array
+
+from vagrantplaybook.compat import compat_string_types
+from vagrantplaybook.compose.node import Node
+
+# The node attributes stored in typed arrays (with a fallback to lists, e.g. for None values)
+INTEGER_FIELDS = frozenset(['cpus', 'memory', 'index', 'group_index'])
+
+# The node attributes with values usually repeated in many nodes, that are stored as interned strings
+INTERNED_FIELDS = frozenset(['box', 'ansible_groups'])
+
+class NodeRow:
+    '''
+    This class defines a view on a row of a NodeTable, exposing the same attributes of a Node;
+    values are read from the table columns, so rows do not hold copies of node values.
+    Node attributes can be accessed also by key (e.g. row['hostname']).
+    '''
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        '''Creates a new NodeRow.
+
+        Keyword arguments:
+        table           -- The NodeTable
+        row             -- The position of the node in the table
+        '''
+
+        self._table = table
+        self._row = row
+
+    def values(self):
+        ''' Gets the values of node attributes, in Node.FIELDS order. '''
+        return tuple(self._table._columns[field][self._row] for field in Node.FIELDS)
+
+    def __getitem__(self, field):
+        if field not in Node.FIELDS:
+            raise KeyError(field)
+        return self._table._columns[field][self._row]
+
+    def __eq__(self, other):
+        return isinstance(other, (NodeRow, Node)) and self.values() == other.values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        # consistent with __eq__ (rows with the same values have the same index and hostname), e.g. for sets and the unique filter
+        return hash((self.index, self.hostname))
+
+    def __reduce__(self):
+        # rows are pickled as nodes, without the whole table
+        return (_restore_node, (self.values(),))
+
+def _restore_node(values):
+    ''' utility function for restoring a node pickled from a NodeRow '''
+    node = Node.__new__(Node)
+    node.__setstate__(values)
+    return node
+
+def _column_property(field):
+    ''' utility function for creating a NodeRow property reading a column of the NodeTable '''
+    return property(lambda self: self._table._columns[field][self._row], doc = 'The node %s.' % field)
+
+for _field in Node.FIELDS:
+    setattr(NodeRow, _field, _column_property(_field))
+
+class NodeTable:
+    '''
+    This class defines a columnar representation of a list of nodes, with a column - a parallel array - for each node attribute.
+    Integer attributes are stored in typed arrays, and values repeated in many nodes (e.g. box and ansible group names) are interned,
+    so all the nodes share the same string objects. Nodes are accessed as NodeRow views, exposing the same attributes of a Node.
+    '''
+
+    def __init__(self, nodes = ()):
+        '''Creates a new NodeTable.
+
+        Keyword arguments:
+        nodes           -- The nodes to be added to the table (Nodes or NodeRows)
+        '''
+
+        # A dictionary, that will be used to store columns, keyed by node attribute
+        self._columns = { field: array('l') if field in INTEGER_FIELDS else [] for field in Node.FIELDS }
+
+        # A dictionary, that will be used to store interned strings
+        self._strings = {}
+
+        self.extend(nodes)
+
+    def append(self, node):
+        ''' Adds a node to the table.
+
+        Keyword arguments:
+        node            -- The node to be added (a Node or a NodeRow)
+        '''
+
+        for field, value in zip(Node.FIELDS, node.values()):
+            if field in INTERNED_FIELDS:
+                value = self._intern(value)
+
+            column = self._columns[field]
+            try:
+                column.append(value)
+            except (TypeError, OverflowError):
+                # the value can't be stored in a typed array, so the column is converted to a list
+                column = self._columns[field] = column.tolist()
+                column.append(value)
+
+    def extend(self, nodes):
+        ''' Adds a list of nodes to the table.
+
+        Keyword arguments:
+        nodes           -- The nodes to be added (Nodes or NodeRows, e.g. another NodeTable)
+        '''
+
+        if isinstance(nodes, NodeTable):
+            # tables are merged column by column, without creating rows
+            for field, values in nodes._columns.iteritems():
+                if field in INTERNED_FIELDS:
+                    values = [self._intern(value) for value in values]
+                self._extend_column(field, values)
+            return
+
+        for node in nodes:
+            self.append(node)
+
+    def column(self, field):
+        ''' Gets the values of a node attribute for all the nodes in the table.
+
+        Keyword arguments:
+        field           -- The node attribute
+        '''
+
+        return self._columns[field]
+
+    def __len__(self):
+        return len(self._columns['index'])
+
+    def __iter__(self):
+        for row in xrange(len(self)):
+            yield NodeRow(self, row)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            table = NodeTable()
+            table._columns = { field: column[key] for field, column in self._columns.iteritems() }
+            table._strings = self._strings
+            return table
+
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('NodeTable index out of range')
+        return NodeRow(self, key)
+
+    def __getstate__(self):
+        return self._columns
+
+    def __setstate__(self, state):
+        self._columns = state
+        self._strings = {}
+
+        # interned strings are shared also after unpickling, so they are collected again for next appends
+        for field in INTERNED_FIELDS:
+            for value in self._columns[field]:
+                self._intern(value)
+
+    def _extend_column(self, field, values):
+        column = self._columns[field]
+        if isinstance(column, array) and not isinstance(values, array):
+            try:
+                values = array(column.typecode, values)
+            except (TypeError, OverflowError):
+                # the values can't be stored in a typed array, so the column is converted to a list
+                column = self._columns[field] = column.tolist()
+        column.extend(values)
+
+    def _intern(self, value):
+        if isinstance(value, compat_string_types):
+            return self._strings.setdefault(value, value)
+        if isinstance(value, list):
+            return [self._intern(v) for v in value]
+        return value
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import multiprocessing
+
+from vagrantplaybook.templating.backend import DEFAULT_TEMPLATING_BACKEND, create_templating_backend
+from vagrantplaybook.compose.templatecache import TemplateCache
+from vagrantplaybook.compose.nodetable import NodeTable
+from vagrantplaybook.profiler import GeneratorStats, TraceRecorder
+
+# The number of tasks to be created for each worker, so work is balanced when nodes have different costs
+TASKS_PER_JOB = 4
+
+# The cache of compiled templates of a worker process (each worker has its own templating backend)
+_templates = None
+
+def _initialize_worker(templating, stats, trace):
+    ''' utility function for initializing a worker process
+
+    Keyword arguments:
+    templating      --  The name of the templating backend to be used by the worker
+    stats           --  True if the worker should record value generators stats
+    trace           --  True if the worker should record a trace (events are tagged with the worker pid)
+    '''
+
+    global _templates
+    _templates = TemplateCache(create_templating_backend(templating))
+    if trace:
+        _templates.trace = TraceRecorder()
+    if stats:
+        _templates.stats = GeneratorStats()
+
+def _execute(task):
+    ''' utility function for executing a task in a worker process
+
+    Keyword arguments:
+    task            --  The tuple with the function to be executed and its arguments (the worker cache of compiled templates is added as first argument)
+    '''
+
+    function, args = task
+    if _templates.stats is None:
+        return function(_templates, *args)
+
+    # value generators stats and trace events are returned with the result of each task, so they can be merged in the main process
+    trace = _templates.trace
+    if trace is not None:
+        trace.events = []
+        _templates.stats = GeneratorStats(trace.clock, trace)
+    else:
+        _templates.stats = GeneratorStats()
+    return function(_templates, *args), _templates.stats.generators, trace.events if trace is not None else None
+
+def _compose_node_group(templates, group, cluster_name, cluster_node_prefix, cluster_domain, cluster_offset, start, stop):
+    ''' utility function for composing a group of nodes - or a chunk of nodes in the group - in a worker process '''
+
+    return NodeTable(group.compose(templates, cluster_name, cluster_node_prefix, cluster_domain, cluster_offset, start = start, stop = stop))
+
+class ComposePool:
+    '''
+    This class defines a pool of worker processes, to be used for composing a cluster in parallel.
+    Tasks are executed in parallel, but results are always merged in tasks order, so they are the same of a serial execution.
+    '''
+
+    def __init__(self, jobs, templating = DEFAULT_TEMPLATING_BACKEND, stats = None, trace = None):
+        '''Creates a new ComposePool.
+
+        Keyword arguments:
+        jobs            -- The number of worker processes.
+        templating      -- The name of the templating backend to be used by worker processes.
+        stats           -- The GeneratorStats value generators stats recorded by worker processes are merged into, or None
+        trace           -- The TraceRecorder trace events recorded by worker processes are merged into, or None (requires stats)
+        '''
+
+        self.jobs = jobs
+        self._stats = stats
+        self._trace = trace
+        self._pool = multiprocessing.Pool(jobs, initializer = _initialize_worker, initargs = (templating, stats is not None, trace is not None))
+
+    def compose_node_groups(self, node_groups, cluster_name, cluster_node_prefix, cluster_domain, offsets = None):
+        ''' Composes groups of nodes, by splitting large groups in chunks; nodes are returned in a single table, in groups order.
+
+        Keyword arguments:
+        node_groups         -- The list of groups of nodes, in compose order
+        cluster_name        -- The name of the cluster
+        cluster_node_prefix -- A prefix to be added before each node name / box name
+        cluster_domain      -- The domain to which the cluster belongs
+        offsets             -- The offsets of groups of nodes (default computed from instances, when all the groups in the cluster are composed)
+        '''
+
+        chunk = self._chunk_size(sum(group.instances for group in node_groups))
+
+        if offsets is None:
+            offsets = []
+            cluster_offset = 0
+            for group in node_groups:
+                offsets.append(cluster_offset)
+                cluster_offset += group.instances
+
+        tasks = []
+        for group, cluster_offset in zip(node_groups, offsets):
+            for start in xrange(0, group.instances, chunk):
+                tasks.append((group, cluster_name, cluster_node_prefix, cluster_domain, cluster_offset, start, start + chunk))
+
+        nodes = NodeTable()
+        for chunk_nodes in self.map(_compose_node_group, tasks):
+            nodes.extend(chunk_nodes)
+
+        return nodes
+
+    def chunks(self, items):
+        ''' Splits a list of items in chunks, so items can be processed in parallel.
+
+        Keyword arguments:
+        items               -- The list of items (or any sequence supporting slices, e.g. a NodeTable)
+        '''
+
+        chunk = self._chunk_size(len(items))
+        return [items[i:i + chunk] for i in xrange(0, len(items), chunk)]
+
+    def map(self, function, tasks):
+        ''' Executes a function for each task in the worker processes, and returns results in tasks order.
+        The function should be a module level function, accepting the cache of compiled templates
+        of the worker as first argument, followed by task arguments.
+
+        Keyword arguments:
+        function            -- The function to be executed
+        tasks               -- The list of tuples with arguments for each function call
+        '''
+
+        results = self._pool.map(_execute, [(function, args) for args in tasks])
+        if self._stats is None:
+            return results
+
+        for result, generators, events in results:
+            self._stats.merge(generators)
+            if self._trace is not None:
+                self._trace.merge(events)
+        return [result for result, generators, events in results]
+
+    def close(self):
+        ''' Stops the worker processes, waiting for pending tasks. '''
+
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        ''' Stops the worker processes immediately. '''
+
+        self._pool.terminate()
+        self._pool.join()
+
+    def _chunk_size(self, total):
+        return max(1, -(-total // (self.jobs * TASKS_PER_JOB)))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import hashlib
+import tempfile
+import cPickle
+
+import vagrantplaybook
+
+def fingerprint(*parts):
+    ''' utility function for getting the fingerprint of a set of values (lists, dictionaries, strings, numbers...)
+
+    Keyword arguments:
+    parts           --  The values to be fingerprinted
+    '''
+
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+class ComposeState:
+    '''
+    This class defines the state of a composed cluster, that can be used for recomposing the cluster incrementally.
+    The result of each compose stage is stored for each slice of the cluster (a group of nodes, an ansible group), together with
+    a fingerprint of everything it depends on; when the cluster is recomposed, results with an unchanged fingerprint are reused,
+    and only the slices affected by a change are recomputed. Results generated by volatile value generators (e.g. random
+    filters, lookups) have no fingerprint, and are always recomputed.
+    '''
+
+    # The compose stages, in compose order
+    STAGES = ('node_groups', 'context_vars', 'group_vars', 'host_vars')
+
+    # The default path of the state file, relative to the current directory (the vagrant project)
+    DEFAULT_PATH = os.path.join('.vagrant', 'playbook-state')
+
+    def __init__(self):
+        '''Creates a new, empty ComposeState. '''
+
+        # The version of vagrant-playbook that stored the state; states stored by other versions are discarded
+        self.version = vagrantplaybook.__version__
+
+        # A dictionary, that will be used to store the results of the last compose, keyed by stage and slice name
+        self._entries = { stage: {} for stage in ComposeState.STAGES }
+
+        # A dictionary, that will be used to store the results of the previous compose, while the cluster is recomposed
+        self._previous = { stage: {} for stage in ComposeState.STAGES }
+
+        # The names of slices recomputed/reused by the last compose, grouped by stage
+        self.recomputed = { stage: [] for stage in ComposeState.STAGES }
+        self.reused = { stage: [] for stage in ComposeState.STAGES }
+
+        # The groups of nodes composed by the last compose, in compose order; each one is a tuple with the name of the group,
+        # the fingerprint of composed nodes, the ansible groups of composed nodes, and the range of rows in the table of nodes
+        self.slices = []
+
+        # The fingerprint of context vars generated by the last compose
+        self.context_fingerprint = None
+
+    @classmethod
+    def load(cls, path = None):
+        ''' Loads the state stored by the last compose, or creates a new, empty ComposeState
+        if there is no stored state (or the stored state can't be read).
+
+        Keyword arguments:
+        path            -- The state file (default .vagrant/playbook-state)
+        '''
+
+        path = path if path is not None else ComposeState.DEFAULT_PATH
+        try:
+            with open(path, 'rb') as f:
+                state = cPickle.load(f)
+        except Exception:
+            return cls()
+
+        if not isinstance(state, ComposeState) or state.version != vagrantplaybook.__version__:
+            return cls()
+
+        return state
+
+    def save(self, path = None):
+        ''' Stores the state, replacing the state file atomically.
+
+        Keyword arguments:
+        path            -- The state file (default .vagrant/playbook-state)
+        '''
+
+        path = path if path is not None else ComposeState.DEFAULT_PATH
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        f = tempfile.NamedTemporaryFile(dir = directory or '.', prefix = os.path.basename(path), suffix = '.tmp', delete = False)
+        try:
+            with f:
+                cPickle.dump(self, f, 2)
+            os.rename(f.name, path)
+        except:
+            os.remove(f.name)
+            raise
+
+    def begin(self):
+        ''' Starts recomposing the cluster; results of the last compose are moved aside, so results not reused are dropped. '''
+
+        for stage in ComposeState.STAGES:
+            self._previous[stage].update(self._entries[stage])
+            self._entries[stage] = {}
+            self.recomputed[stage] = []
+            self.reused[stage] = []
+
+        self.slices = []
+        self.context_fingerprint = None
+
+    def end(self):
+        ''' Ends recomposing the cluster. '''
+
+        self._previous = { stage: {} for stage in ComposeState.STAGES }
+
+    def get(self, stage, name, fingerprint):
+        ''' Gets the result stored by the last compose for a slice of the cluster, or None if the slice should be recomputed.
+
+        Keyword arguments:
+        stage           -- The compose stage
+        name            -- The name of the slice
+        fingerprint     -- The fingerprint of everything the result depends on (None if the result should always be recomputed)
+        '''
+
+        if fingerprint is None:
+            return None
+
+        entry = self._previous[stage].get(name)
+        if entry is None or entry[0] != fingerprint:
+            return None
+
+        self._entries[stage][name] = entry
+        self.reused[stage].append(name)
+        return entry[1]
+
+    def put(self, stage, name, fingerprint, value):
+        ''' Stores the result of a slice of the cluster recomputed by this compose.
+
+        Keyword arguments:
+        stage           -- The compose stage
+        name            -- The name of the slice
+        fingerprint     -- The fingerprint of everything the result depends on (None if the result should always be recomputed)
+        value           -- The result
+        '''
+
+        if fingerprint is not None:
+            self._entries[stage][name] = (fingerprint, value)
+        self.recomputed[stage].append(name)
+
+    def report(self):
+        ''' Gets a report of the slices of the cluster recomputed by the last compose, for each stage. '''
+
+        lines = ['Recompose report']
+        for stage in ComposeState.STAGES:
+            recomputed = self.recomputed[stage]
+            line = '  %-14s %i/%i recomputed' % (stage.replace('_', ' '), len(recomputed), len(recomputed) + len(self.reused[stage]))
+            if recomputed:
+                line += ': ' + ', '.join(recomputed)
+            lines.append(line)
+
+        return '\n'.join(lines) + '\n'
+
+    def __getstate__(self):
+        # only the results of the last compose are stored
+        return dict(version = self.version, entries = self._entries)
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.version = state['version']
+        self._entries = state['entries']
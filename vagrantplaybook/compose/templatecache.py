@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from vagrantplaybook.compat import compat_string_types
+
+TEMPLATE_MARKERS = ('{{', '{%', '{#')
+
+# Functions and filters that can generate a different value each time a template is rendered
+VOLATILE_FUNCTIONS = frozenset(['lookup', 'query', 'q', 'now'])
+VOLATILE_FILTERS = frozenset(['random', 'shuffle'])
+
+def contains_template(value):
+    ''' utility function for checking if a string contains a template expression
+
+    Keyword arguments:
+    value           --  The value to be checked
+    '''
+
+    if isinstance(value, compat_string_types):
+        for marker in TEMPLATE_MARKERS:
+            if marker in value:
+                return True
+    return False
+
+class TemplateCache:
+    '''
+    This class defines a cache of compiled templates, keyed by generator source.
+    Each distinct value generator is compiled once, and then only rendered each time a value is generated;
+    generated values are the same returned by the ansible templar.
+    '''
+
+    def __init__(self, backend):
+        '''Creates a new TemplateCache.
+
+        Keyword arguments:
+        backend         -- The templating backend, that will be used for compiling and rendering templates
+        '''
+
+        self.backend = backend
+
+        # The GeneratorStats recording the cost of each value generator, or None (default, value generators are not recorded)
+        self.stats = None
+
+        # The TraceRecorder recording spans for nodegroups and nodes, or None (default, spans are not recorded)
+        self.trace = None
+
+        # Number of times a compiled template was found in the cache / was compiled
+        self.hits = 0
+        self.misses = 0
+
+        # A dictionary, that will be used to store compiled templates, keyed by source
+        self._templates = {}
+
+        # A dictionary, that will be used to store the result of templates analysis, keyed by source
+        self._analysis = {}
+
+    def template(self, generator, available_variables):
+        ''' Generates a value from a value generator, walking lists and dictionaries.
+
+        Keyword arguments:
+        generator            --  The value generator expression (a ninja template; can be also a literal)
+        available_variables  --  Variables available within the execution context of the generator expression
+        '''
+
+        return self._template(generator, available_variables)
+
+    def compile(self, source):
+        ''' Gets the compiled template for a template string, compiling it only the first time.
+
+        Keyword arguments:
+        source          --  The template string
+        '''
+
+        try:
+            template = self._templates[source]
+            self.hits += 1
+        except KeyError:
+            template = self._templates[source] = self.backend.compile(source)
+            self.misses += 1
+
+        return template
+
+    def analyze(self, source):
+        ''' Gets the names of the variables referenced by a template string, and whether the template is volatile,
+        that is it can generate different values when rendered with the same variables (e.g. lookups, random filters).
+        Analysis is based on the template abstract syntax tree; templates that can't be parsed are considered volatile.
+
+        Keyword arguments:
+        source          --  The template string
+        '''
+
+        try:
+            return self._analysis[source]
+        except KeyError:
+            pass
+
+        # jinja2 is imported only when templates are analyzed, so it is not loaded at startup
+        from jinja2 import meta, nodes
+
+        environment = self.backend.environment
+        try:
+            ast = environment.parse(source)
+        except Exception:
+            analysis = (frozenset(), True)
+        else:
+            volatile = any(f.name in VOLATILE_FILTERS for f in ast.find_all(nodes.Filter)) or \
+                any(isinstance(c.node, nodes.Name) and c.node.name in VOLATILE_FUNCTIONS for c in ast.find_all(nodes.Call))
+            analysis = (frozenset(meta.find_undeclared_variables(ast)).difference(environment.globals, VOLATILE_FUNCTIONS), volatile)
+
+        self._analysis[source] = analysis
+        return analysis
+
+    def clear(self):
+        ''' Removes all the compiled templates from the cache, and resets counters. '''
+
+        self._templates = {}
+        self._analysis = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._templates)
+
+    def _template(self, generator, available_variables):
+        if isinstance(generator, compat_string_types):
+            if not contains_template(generator):
+                return generator
+            return self.backend.render(self.compile(generator), generator, available_variables)
+        if isinstance(generator, (list, tuple)):
+            return [self._template(v, available_variables) for v in generator]
+        if isinstance(generator, dict):
+            return { k: self._template(v, available_variables) for k, v in generator.iteritems() }
+        return generator
@@ -1,6 +1,12 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type 
 
+def _restore_error(cls, message):
+    ''' utility function for restoring an error, e.g. when it is raised by a worker process and pickled into the main process '''
+    error = Exception.__new__(cls)
+    error.message = message
+    return error
+
 class ComposeError(Exception):
     ''' Base class for exceptions in this module. '''
     def __str__(self):
@@ -9,6 +15,9 @@ class ComposeError(Exception):
     def __repr__(self):
         return self.message
 
+    def __reduce__(self):
+        return (_restore_error, (self.__class__, self.message))
+
 class ValueGeneratorError(ComposeError):
     ''' Class for handling errors raised by value generators in NodeGroup compose. '''
 
@@ -21,6 +30,12 @@ class ValueGeneratorTypeError(ComposeError):
     def __init__(self, group_name, node_index, var, message):
         self.message = 'Invalid value for "%s" in Node number %i, NodeGroup "%s" : %s' % (var, node_index, group_name, message)
 
+class ValueGeneratorCycleError(ComposeError):
+    ''' Class for handling circular references between value generators in NodeGroup compose. '''
+
+    def __init__(self, group_name, cycle):
+        self.message = 'Circular reference between value generators in NodeGroup "%s" : %s' % (group_name, ' -> '.join(cycle))
+
 class ContextVarGeneratorError(ComposeError):
     ''' Class for handling errors raised by context var generators in Cluster compose. '''
 
@@ -57,3 +72,9 @@ class PlaybookCompileError(ComposeError):
 
     def __init__(self, cluster, message):
         self.message = 'Error compiling cluster "%s": %s ' % (cluster, message)
+
+class ServerError(ComposeError):
+    ''' Class for handling errors raised by the compose server (or by a request to the compose server). '''
+
+    def __init__(self, message):
+        self.message = 'Error executing playbook in the compose server: %s' % (message)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import sys
+import timeit
+import __builtin__
+
+class ImportProfiler:
+    '''
+    This class defines a profiler for module imports, that measures the time spent importing each module
+    by replacing the builtin __import__ function while installed.
+    For each module both the cumulative time (including nested imports) and the self time (excluding nested imports)
+    are recorded; imports of modules already loaded are not recorded.
+    '''
+
+    def __init__(self, timer = timeit.default_timer):
+        '''Creates a new ImportProfiler.
+
+        Keyword arguments:
+        timer           -- The function used for getting the current time, in seconds
+        '''
+
+        self._timer = timer
+
+        # The builtin __import__ function, replaced while the profiler is installed
+        self._original_import = None
+
+        # A stack with the time spent in nested imports, for each import in progress
+        self._stack = []
+
+        # A dictionary, that will be used to store [self time, cumulative time] for each imported module
+        self.modules = {}
+
+    def install(self):
+        ''' Starts profiling imports. '''
+
+        if self._original_import is None:
+            self._original_import = __builtin__.__import__
+            __builtin__.__import__ = self._import
+
+    def uninstall(self):
+        ''' Stops profiling imports. '''
+
+        if self._original_import is not None:
+            __builtin__.__import__ = self._original_import
+            self._original_import = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
+
+    @property
+    def total(self):
+        ''' The total time spent importing modules, in seconds. '''
+        return sum(self_time for self_time, cumulative_time in self.modules.itervalues())
+
+    def report(self, stream, limit = None):
+        ''' Writes the import times, sorted by cumulative time.
+
+        Keyword arguments:
+        stream          -- The file-like object the report will be written to
+        limit           -- The max number of modules to be reported (default all)
+        '''
+
+        modules = sorted(self.modules.iteritems(), key = lambda item: (-item[1][1], item[0]))
+        if limit is not None:
+            modules = modules[:limit]
+
+        stream.write('Startup profile (import times in ms):\n')
+        stream.write('%12s %12s  %s\n' % ('cumulative', 'self', 'module'))
+        for name, (self_time, cumulative_time) in modules:
+            stream.write('%12.1f %12.1f  %s\n' % (cumulative_time * 1000, self_time * 1000, name))
+        stream.write('Total import time: %.1f ms (%i modules)\n' % (self.total * 1000, len(self.modules)))
+
+    def _import(self, name, globals = None, locals = None, fromlist = None, level = -1):
+        candidates = self._candidates(name, globals, level)
+        loaded = any(sys.modules.get(candidate) is not None for candidate in candidates)
+
+        self._stack.append(0.0)
+        start = self._timer()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = self._timer() - start
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+
+            # records the import only if the module was loaded by this import
+            if not loaded:
+                for candidate in candidates:
+                    if sys.modules.get(candidate) is not None:
+                        times = self.modules.setdefault(candidate, [0.0, 0.0])
+                        times[0] += elapsed - nested
+                        times[1] += elapsed
+                        break
+
+    def _candidates(self, name, globals, level):
+        ''' utility function for getting the full names an imported module can have, resolving relative imports '''
+
+        if level != 0 and globals and '__name__' in globals:
+            package = globals.get('__package__') or (globals['__name__'] if '__path__' in globals else globals['__name__'].rpartition('.')[0])
+            if level > 1:
+                package = package.rsplit('.', level - 1)[0]
+            if package:
+                relative = '%s.%s' % (package, name) if name else package
+                return [relative] if level > 0 else [relative, name]
+
+        return [name]
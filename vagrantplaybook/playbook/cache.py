@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import re
+import hashlib
+import tempfile
+
+import vagrantplaybook
+from vagrantplaybook.compat import compat_text_type
+
+# A regex for finding the start of lookup calls in a playbook
+LOOKUP_CALL = re.compile(r'''\b(?:lookup|query|q)\s*\(''')
+
+# A regex for parsing an argument of a lookup call: an optional keyword, then a literal string or another expression, then a separator
+LOOKUP_ARGUMENT = re.compile(r'''\s*(?P<keyword>\w+\s*=\s*)?(?:(?P<quote>['"])(?P<literal>.*?)(?P=quote)|(?P<other>[^,)'"]*))\s*(?P<end>[,)]|$)''')
+
+# A regex for finding template tags that load other templates (included templates are not part of the cache key)
+TEMPLATE_REFERENCE = re.compile(r'''\{%[-+]?\s*(?:include|import|from|extends)\b''')
+
+# A regex for finding filters and functions that generate different values each time a playbook is composed
+VOLATILE = re.compile(r'''\|\s*(?:random|shuffle)\b|\bnow\s*\(''')
+
+# The lookups that can be cached, because the key depends on looked up values (files and environment variables)
+CACHEABLE_LOOKUPS = frozenset(['file', 'env'])
+
+def find_lookups(playbook):
+    ''' Gets the lookups in a playbook, as a list of (plugin name, arguments) tuples; the plugin name is None if it is not
+    a literal string, and arguments are None if an argument is not a literal string (keyword arguments are ignored).
+
+    Keyword arguments:
+    playbook        -- The playbook (the bytes of the yaml document)
+    '''
+
+    lookups = []
+    for match in LOOKUP_CALL.finditer(playbook):
+        values = []
+        position = match.end()
+        while True:
+            argument = LOOKUP_ARGUMENT.match(playbook, position)
+            if argument is None:
+                values = None
+                break
+
+            if argument.group('keyword') is None:
+                if argument.group('literal') is not None:
+                    values.append(argument.group('literal'))
+                elif argument.group('other').strip():
+                    values = None
+                    break
+
+            if argument.group('end') != ',':
+                break
+            position = argument.end()
+
+        if not values:
+            lookups.append((None, None))
+        else:
+            lookups.append((values[0], values[1:]))
+
+    return lookups
+
+class ComposeCache:
+    '''
+    This class defines a persistent, content-addressed cache of composed clusters.
+    Each composed cluster is stored in a file named after a hash of everything the composed cluster depends on:
+    the playbook, the tool version, the templating backend version, the current directory and the files/environment variables
+    referenced by lookups. Playbooks that generate different values each time they are composed (e.g. using random filters or
+    other lookups) or that include other templates are never cached.
+    When the size of the cache exceeds the max size, least recently used entries are evicted.
+    '''
+
+    # The default cache directory, relative to the current directory (the vagrant project)
+    DEFAULT_PATH = os.path.join('.vagrant', 'playbook-cache')
+
+    # The default max size of the cache, in bytes
+    DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+    # The extension of cache entries
+    EXTENSION = '.yml'
+
+    def __init__(self, path = None, max_size = DEFAULT_MAX_SIZE):
+        '''Creates a new ComposeCache.
+
+        Keyword arguments:
+        path            -- The cache directory (default .vagrant/playbook-cache); it is created when the first entry is stored
+        max_size        -- The max size of the cache, in bytes
+        '''
+
+        self.path = path if path is not None else ComposeCache.DEFAULT_PATH
+        self.max_size = max_size
+
+    def key(self, playbook, *parts):
+        ''' Gets the cache key for a playbook, or None if the playbook can't be cached.
+
+        Keyword arguments:
+        playbook        -- The playbook (the bytes of the yaml document)
+        parts           -- Other values the composed cluster depends on (e.g. the templating backend version)
+        '''
+
+        if VOLATILE.search(playbook) or TEMPLATE_REFERENCE.search(playbook):
+            return None
+
+        digest = hashlib.sha256()
+        for part in ('vagrant-playbook-%s' % vagrantplaybook.__version__, os.getcwd()) + parts:
+            self._update(digest, part)
+        self._update(digest, playbook)
+
+        for plugin, arguments in find_lookups(playbook):
+            if plugin not in CACHEABLE_LOOKUPS or not arguments:
+                return None
+
+            for argument in arguments:
+                self._update(digest, '%s:%s' % (plugin, argument))
+                if plugin == 'env':
+                    self._update(digest, os.environ.get(argument, ''))
+                else:
+                    # looked up files are searched in the current directory or in the files directory
+                    for path in (argument, os.path.join('files', argument)):
+                        try:
+                            with open(path, 'rb') as f:
+                                self._update(digest, hashlib.sha256(f.read()).hexdigest())
+                        except IOError:
+                            self._update(digest, '')
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        ''' Gets the composed cluster stored for a key, or None.
+
+        Keyword arguments:
+        key             -- The cache key
+        '''
+
+        path = self._entry(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # the access time is tracked by mtime, for evicting least recently used entries
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+
+        return data
+
+    def writer(self, key):
+        ''' Gets a temporary file for writing the composed cluster for a key; the entry is stored by commit.
+
+        Keyword arguments:
+        key             -- The cache key
+        '''
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        return tempfile.NamedTemporaryFile(dir = self.path, prefix = key, suffix = '.tmp', delete = False)
+
+    def commit(self, key, writer):
+        ''' Stores the composed cluster written to a temporary file, replacing the entry atomically; then evicts entries if required.
+
+        Keyword arguments:
+        key             -- The cache key
+        writer          -- The temporary file created by writer
+        '''
+
+        writer.close()
+        os.rename(writer.name, self._entry(key))
+        self.evict()
+
+    def discard(self, writer):
+        ''' Removes a temporary file created by writer, e.g. when composing fails.
+
+        Keyword arguments:
+        writer          -- The temporary file created by writer
+        '''
+
+        writer.close()
+        try:
+            os.remove(writer.name)
+        except OSError:
+            pass
+
+    def put(self, key, data):
+        ''' Stores a composed cluster.
+
+        Keyword arguments:
+        key             -- The cache key
+        data            -- The composed cluster
+        '''
+
+        writer = self.writer(key)
+        try:
+            writer.write(data)
+        except:
+            self.discard(writer)
+            raise
+        self.commit(key, writer)
+
+    def evict(self):
+        ''' Removes least recently used entries, until the size of the cache is lower than the max size. '''
+
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith(ComposeCache.EXTENSION):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            size -= entry_size
+
+    def clear(self):
+        ''' Removes all the entries in the cache. '''
+
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.endswith(ComposeCache.EXTENSION):
+                    os.remove(os.path.join(self.path, name))
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + ComposeCache.EXTENSION)
+
+    def _update(self, digest, part):
+        # each part is prefixed by its length, so different parts can't generate the same key
+        if isinstance(part, compat_text_type):
+            part = part.encode('utf-8')
+        digest.update('%i:' % len(part))
+        digest.update(part)
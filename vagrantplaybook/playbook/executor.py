@@ -3,13 +3,39 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 import sys
-import yaml
 import types
+from cStringIO import StringIO
 
-from vagrantplaybook.ansible import ansible_unwrap, ansible_loader
+from vagrantplaybook.ansible import ansible_unwrap
+from vagrantplaybook.compat import to_str
 
 from vagrantplaybook.errors import PlaybookLoadError, PlaybookParseError, PlaybookCompileError
-from vagrantplaybook.compose.cluster import Cluster
+from vagrantplaybook.compose.cluster import Cluster, parse_selection
+from vagrantplaybook.compose.node import Node
+from vagrantplaybook.templating.backend import DEFAULT_TEMPLATING_BACKEND, check_templating_backend, create_templating_backend, get_templating_backend_version
+from vagrantplaybook.profiler import NULL_PROFILER
+
+# Node attributes, in the order they are written (yaml mappings are written in sorted order)
+NODE_FIELDS = sorted(Node.FIELDS)
+
+# The formats composed clusters can be written in
+OUTPUT_FORMATS = ['yaml', 'json']
+DEFAULT_OUTPUT_FORMAT = 'yaml'
+
+class _TeeStream:
+    ''' utility class for writing the composed cluster to more than one file-like object at a time '''
+
+    def __init__(self, *streams):
+        self._streams = streams
+
+    def write(self, data):
+        for stream in self._streams:
+            stream.write(data)
+
+    def flush(self):
+        for stream in self._streams:
+            if hasattr(stream, 'flush'):
+                stream.flush()
 
 class Executor:
     '''
@@ -19,21 +45,246 @@ class Executor:
     the nodes/VM in the cluster
     '''
 
-    def __init__(self):
-        self._loader = ansible_loader()
+    def __init__(self, templating = DEFAULT_TEMPLATING_BACKEND, cache = None, state = None, profiler = None, templates = None,
+                 output_format = DEFAULT_OUTPUT_FORMAT, compact = False, sort_keys = False, inventory = False, inventory_path = None):
+        '''Creates a new Executor.
+
+        Keyword arguments:
+        templating      -- The name of the templating backend to be used for composing clusters ('ansible' or 'native')
+        cache           -- The ComposeCache for storing composed clusters, or None (default, composed clusters are not cached)
+        state           -- The path of the file storing the state of the last compose, for recomposing clusters incrementally,
+                           or None (default, clusters are always composed from scratch)
+        profiler        -- The Profiler recording wall time, CPU time and generated objects for each execution phase,
+                           or None (default, phases are not recorded)
+        templates       -- The cache of compiled templates to be shared by all the composed clusters (e.g. kept warm by
+                           a compose server), or None (default, each cluster has its own cache); it overrides templating
+        output_format   -- The format composed clusters are written in ('yaml' or 'json'); json documents have the same structure
+        compact         -- True for writing json documents without whitespaces (default False, one item per line)
+        sort_keys       -- True for writing keys of vars and attributes in json documents in sorted order (default False;
+                           yaml documents are always sorted)
+        inventory       -- True for writing an ansible inventory tree (inventory file, group_vars and host_vars files) for each
+                           composed cluster; files are rewritten only if changed (default False)
+        inventory_path  -- The directory of the ansible inventory tree, or None (default, the ansible_playbook_path of the cluster)
+        '''
+
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("Invalid output format '%s': expected one of %s" % (output_format, ', '.join(OUTPUT_FORMATS)))
+
+        # The format composed clusters are written in
+        self.output_format = output_format
+        self.compact = compact
+        self.sort_keys = sort_keys
+
+        if templates is not None:
+            templating = templates.backend.name
+        check_templating_backend(templating)
+
+        # The name of the templating backend, used for executing value generators when composing clusters;
+        # the backend (and the template engine) is created only when the first cluster is parsed
+        self.templating = templating
+        self._templating = templates.backend if templates is not None else None
+
+        # The shared cache of compiled templates, or None
+        self._templates = templates
+
+        # The cache of composed clusters
+        self._cache = cache
+
+        # The path of the state file, and the ComposeState of the last executed playbook (with the recompose report)
+        self._state_path = state
+        self.state = None
+
+        # True for writing the ansible inventory tree, its directory, and the InventoryWriter of the last executed playbook (with the report)
+        self.inventory = inventory
+        self._inventory_path = inventory_path
+        self.inventory_writer = None
+
+        # The profiler (a hook notified of each execution phase, see vagrantplaybook.profiler.Profiler)
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+
+    @property
+    def yaml_backend(self):
+        ''' The yaml implementation used for loading playbooks and writing composed clusters ('libyaml' or 'python'). '''
+
+        from vagrantplaybook.yamlbackend import yaml_backend
+        return yaml_backend
+
+    def execute(self, yamlfile, yamlplaybook, jobs = 1, out = None, only = None):
+        '''Executes a playbook, and returns the composed cluster in yaml format (or in the output format of the executor);
+        if a file-like object is given, the composed cluster is written to it while it is produced, and None is returned.
+        If the executor has a cache, and the playbook was already composed, the cached cluster is returned without
+        parsing/composing the playbook (and without importing the template engine).
+
+        Keyword arguments:
+        yamlfile        -- The yaml file name (and path) containing the playbook, or None
+        yamlplaybook    -- The yaml string containing the playbook (used if yamlfile is None)
+        jobs            -- The number of worker processes to be used for composing the cluster
+        out             -- The file-like object the composed cluster should be written to, or None
+        only            -- The selection of nodes to be composed (e.g. 'master' or 'master[0:2],slave[3]', see
+                           vagrantplaybook.compose.cluster.parse_selection), or None (default, all the nodes); clusters composed
+                           from a selection are not composed incrementally
+        '''
+
+        self.state = None
+        self.inventory_writer = None
+
+        selection = None
+        if only is not None:
+            # NB. the inventory tree of a selection would remove the files of hosts not selected
+            if self.inventory:
+                raise ValueError('The ansible inventory tree can\'t be written when composing a selection of nodes')
+            try:
+                selection = parse_selection(only)
+            except ValueError, e:
+                raise PlaybookParseError(e.message), None, sys.exc_info()[2]
+
+        #return the cached cluster, if any
+        key = self._get_cache_key(yamlfile, yamlplaybook, selection)
+        if key is not None:
+            with self.profiler.phase('cache') as phase:
+                cached = self._cache.get(key)
+                phase.count = 1 if cached is not None else 0
+            if cached is not None:
+                if out is not None:
+                    out.write(cached)
+                    return None
+                return cached
 
-    def execute(self, yamlfile, yamlplaybook):
         #load yaml playbook into a generic data structure
-        playbook = self._load_from_file(yamlfile) if yamlfile else executor.load(yamlplaybook)
+        with self.profiler.phase('load'):
+            playbook = self._load_from_file(yamlfile) if yamlfile else self._load(yamlplaybook)
 
         #parse the playbook into a cluster definition
-        cluster = self._parse(playbook)
+        with self.profiler.phase('parse') as phase:
+            cluster = self._parse(playbook)
+            phase.count = len(cluster._node_groups)
+
+        #compose the cluster, reusing the state of the last compose (if any)
+        with self.profiler.phase('compose') as phase:
+            if selection is not None:
+                nodes, inventory, ansible_group_vars, ansible_host_vars = self._compose(cluster, jobs, selection = selection)
+            else:
+                nodes, inventory, ansible_group_vars, ansible_host_vars = self._compose(cluster, jobs, self._load_state())
+                self._save_state()
+            phase.count = len(nodes)
+
+        #write the ansible inventory tree, if required
+        if self.inventory:
+            with self.profiler.phase('inventory_files') as phase:
+                self._write_inventory(cluster, inventory, ansible_group_vars, ansible_host_vars)
+                phase.count = len(self.inventory_writer.written) + len(self.inventory_writer.removed)
+
+        with self.profiler.phase('emit'):
+            cache_writer = self._get_cache_writer(key)
+            if cache_writer is None:
+                #write the composed cluster in yaml format
+                if out is not None:
+                    self._write(out, cluster, nodes, inventory, ansible_group_vars, ansible_host_vars)
+                    return None
+
+                #return the composed cluster in yaml format
+                return self._yaml(cluster, nodes, inventory, ansible_group_vars, ansible_host_vars)
+
+            #write the composed cluster in yaml format, storing it in the cache at the same time
+            stream = out if out is not None else StringIO()
+            try:
+                self._write(_TeeStream(stream, cache_writer), cluster, nodes, inventory, ansible_group_vars, ansible_host_vars)
+            except:
+                self._cache.discard(cache_writer)
+                raise
+
+        try:
+            self._cache.commit(key, cache_writer)
+        except (IOError, OSError):
+            # errors storing the composed cluster in the cache are ignored
+            self._cache.discard(cache_writer)
+
+        return None if out is not None else stream.getvalue()
+
+    def _get_cache_key(self, yamlfile, yamlplaybook, selection = None):
+        '''Gets the cache key for a playbook, or None if there is no cache or the playbook can't be cached.
+
+        Keyword arguments:
+        yamlfile        -- The yaml file name (and path) containing the playbook, or None
+        yamlplaybook    -- The yaml string containing the playbook (used if yamlfile is None)
+        selection       -- The selection of nodes to be composed, or None
+        '''
+
+        # NB. playbooks are not cached when the inventory tree is written, because cached clusters are not composed
+        if self._cache is None or self.inventory:
+            return None
 
-        #compose the cluster
-        nodes, inventory, ansible_group_vars, ansible_host_vars = self._compose(cluster)
+        if yamlfile:
+            try:
+                with open(yamlfile, 'rb') as stream:
+                    yamlplaybook = stream.read()
+            except IOError:
+                # errors are raised when the playbook is loaded
+                return None
+
+        if yamlplaybook is None:
+            return None
+
+        # NB. json documents are cached separately, because the output is different
+        parts = (get_templating_backend_version(self.templating),)
+        if self.output_format != DEFAULT_OUTPUT_FORMAT:
+            parts += ('%s:compact=%s:sort_keys=%s' % (self.output_format, self.compact, self.sort_keys),)
+        # NB. each selection is cached separately
+        if selection is not None:
+            parts += ('only:%r' % (selection,),)
+
+        return self._cache.key(yamlplaybook, *parts)
+
+    def _get_cache_writer(self, key):
+        '''Gets the temporary file for storing a composed cluster in the cache, or None if there is no cache key
+        or the cache can't be written (e.g. for permissions).
+
+        Keyword arguments:
+        key             -- The cache key, or None
+        '''
+
+        if key is None:
+            return None
+
+        try:
+            return self._cache.writer(key)
+        except (IOError, OSError):
+            return None
 
-        #return the composed cluster in yaml format
-        return self._yaml(cluster, nodes, inventory, ansible_group_vars, ansible_host_vars)
+    def _load_state(self):
+        ''' utility function for loading the state of the last compose, if the executor recomposes clusters incrementally '''
+
+        if self._state_path is not None:
+            from vagrantplaybook.compose.state import ComposeState
+            self.state = ComposeState.load(self._state_path)
+        return self.state
+
+    def _save_state(self):
+        ''' utility function for storing the state of the last compose; errors storing the state are ignored '''
+
+        if self.state is not None:
+            try:
+                self.state.save(self._state_path)
+            except (IOError, OSError):
+                pass
+
+    def _write_inventory(self, cluster, inventory, ansible_group_vars, ansible_host_vars):
+        ''' utility function for writing the ansible inventory tree of the composed cluster '''
+
+        from vagrantplaybook.playbook.inventory import InventoryWriter
+
+        self.inventory_writer = InventoryWriter(self._inventory_path if self._inventory_path is not None else cluster.ansible_playbook_path)
+        try:
+            self.inventory_writer.write(inventory, ansible_group_vars, ansible_host_vars)
+        except (IOError, OSError), e:
+            raise PlaybookCompileError(cluster.name, 'error writing the ansible inventory: %s' % e), None, sys.exc_info()[2]
+
+    def _get_templating(self):
+        ''' utility function for getting the templating backend, creating it on first use '''
+
+        if self._templating is None:
+            self._templating = create_templating_backend(self.templating)
+        return self._templating
 
     def _load_from_file(self, file_name):
         '''Loads a playbook from a yaml file.
@@ -42,9 +293,11 @@ class Executor:
         file_name       -- The yaml file name (and path),
         '''
         try:
-            return self._loader.load_from_file(file_name)
+            with open(file_name, 'rb') as stream:
+                return self._yaml_load(stream)
         except Exception, e:
-            raise PlaybookLoadError(file_name, e.message), None, sys.exc_info()[2]
+            # NB. yaml errors have no message, the problem and its position are in the string representation
+            raise PlaybookLoadError(file_name, to_str(e)), None, sys.exc_info()[2]
 
     def _load(self, yaml_string):
         '''Loads a playbook from a yaml string.
@@ -53,9 +306,16 @@ class Executor:
         yaml_strin       -- The yaml string,
         '''
         try:
-            return self._loader.load(yaml_string, '<string>', show_content=True)
+            return self._yaml_load(yaml_string)
         except Exception, e:
-            raise PlaybookLoadError('<string>', e.message), None, sys.exc_info()[2]
+            raise PlaybookLoadError('<string>', to_str(e)), None, sys.exc_info()[2]
+
+    def _yaml_load(self, stream):
+        # yaml is imported only when a playbook is loaded, so cached clusters are returned without importing it
+        import yaml
+        from vagrantplaybook.yamlbackend import yaml_loader
+
+        return yaml.load(stream, Loader = yaml_loader)
 
     def _parse(self, loaded_data):
         '''Parse a playbook - represented as a AnsibleMapping - into a cluster with its nodegroups.
@@ -72,7 +332,7 @@ class Executor:
         # The first level is the cluster to be composed
         k1 = ansible_unwrap(loaded_data.keys()[0])
         v1 = ansible_unwrap(loaded_data[k1])
-        cluster = Cluster(k1, loader = self._loader)
+        cluster = Cluster(k1, templating = self._get_templating(), templates = self._templates)
 
         if not isinstance(v1, dict):
             raise PlaybookParseError("Invalid cluster definition: please provide attributes for cluster %s." % (v1))
@@ -119,18 +379,27 @@ class Executor:
                         # and checks if the attribute exists
                         nodegroup.__setattr__(k3, v3)
 
+        # Checks value generators in each nodegroup can be executed (e.g. there are no circular references)
+        try:
+            cluster.validate()
+        except Exception, e:
+            raise PlaybookParseError(e.message)
+
         return cluster
 
-    def _compose(self, cluster):
+    def _compose(self, cluster, jobs = 1, state = None, selection = None):
         '''Compose a cluster - an object containing a parsed playbook - by generating a set of objects
             representing the composed cluster.
 
         Keyword arguments:
         cluster     -- The object containing a parsed playbook,
+        jobs        -- The number of worker processes to be used for composing the cluster,
+        state       -- The ComposeState of the last compose, or None
+        selection   -- The selection of nodes to be composed, or None
         '''
 
         try:
-            nodesmap, inventory, ansible_group_vars, ansible_host_vars = cluster.compose()
+            nodesmap, inventory, ansible_group_vars, ansible_host_vars = cluster.compose(jobs = jobs, state = state, profiler = self.profiler, selection = selection)
         except Exception, e:
             raise PlaybookCompileError(cluster.name, e.message), None, sys.exc_info()[2]
 
@@ -146,47 +415,117 @@ class Executor:
         ansible_group_vars     -- Ansible group vars - grouped by ansible groups
         ansible_host_vars      -- Ansible host vars - grouped by hosts
         '''
-        
-        nodesmap = []
-        for node in nodes:
-            nodesmap.append ({ node.boxname: {
-                'box'            : node.box,
-                'boxname'        : node.boxname,
-                'hostname'       : node.hostname,
-                'fqdn'           : node.fqdn,
-                'aliases'        : node.aliases,
-                'ip'             : node.ip,
-                'cpus'           : node.cpus,
-                'memory'         : node.memory,
-                'ansible_groups' : node.ansible_groups,
-                'attributes'     : node.attributes,
-                'index'          : node.index,
-                'group_index'    : node.group_index
-            }})
-
-        yamlmap = {
-            cluster.name : {
-                'box' : cluster.box,
-                'domain' : cluster.domain,
-                'ansible_playbook_path' : cluster.ansible_playbook_path,
-                'nodes' : nodesmap
-            }
-        }
 
-        if len(inventory)>0:
-            ansiblemap = {}
+        stream = StringIO()
+        self._write(stream, cluster, nodes, inventory, ansible_group_vars, ansible_host_vars)
+        return stream.getvalue()
+
+    def _write(self, stream, cluster, nodes, inventory, ansible_group_vars, ansible_host_vars):
+        '''Writes a set of objects representing the composed cluster as a yaml cluster specification (or json, depending on the output format);
+        each node and each ansible var is written as soon as it is represented, without building the whole document in memory.
+
+        Keyword arguments:
+        stream                 -- The file-like object the yaml cluster specification will be written to
+        cluster                -- The cluster object
+        nodes                  -- List of nodes in the cluster 
+        inventory              -- Ansible inventory  - linking ansible groups and hosts
+        ansible_group_vars     -- Ansible group vars - grouped by ansible groups
+        ansible_host_vars      -- Ansible host vars - grouped by hosts
+        '''
+
+        writer = self._get_writer(stream)
+        writer.open()
+        writer.start_mapping()
+        writer.add(cluster.name)
 
-            ansiblemap['inventory'] = inventory
+        # NB. cluster attributes are written in sorted order
+        writer.start_mapping()
+
+        if len(inventory)>0:
+            ansiblemap = [('inventory', inventory)]
 
             if len(ansible_group_vars)>0:
-                ansiblemap['group_vars'] = ansible_group_vars
+                ansiblemap.append(('group_vars', ansible_group_vars))
 
             if len(ansible_host_vars)>0:
-                ansiblemap['host_vars'] = ansible_host_vars
+                ansiblemap.append(('host_vars', ansible_host_vars))
+
+            writer.add('ansible')
+            writer.start_mapping()
+            for section, values in sorted(ansiblemap):
+                writer.add(section)
+                writer.start_mapping()
+                for key in sorted(values):
+                    writer.add(key)
+                    if section == 'inventory':
+                        self._write_hosts(writer, values[key])
+                    else:
+                        writer.add(values[key])
+                writer.end_mapping()
+            writer.end_mapping()
+
+        writer.add('ansible_playbook_path')
+        writer.add(cluster.ansible_playbook_path)
+        writer.add('box')
+        writer.add(cluster.box)
+        writer.add('domain')
+        writer.add(cluster.domain)
+
+        writer.add('nodes')
+        writer.start_sequence()
+        for node in nodes:
+            self._write_node(writer, node)
+        writer.end_sequence()
+
+        writer.end_mapping()
+        writer.end_mapping()
+        writer.close()
+
+    def _get_writer(self, stream):
+        ''' utility function for getting the writer for the output format of the executor '''
+
+        if self.output_format == 'json':
+            from vagrantplaybook.playbook.jsonwriter import JsonWriter
+            return JsonWriter(stream, compact = self.compact, sort_keys = self.sort_keys)
 
-            yamlmap[cluster.name]['ansible'] = ansiblemap
+        from vagrantplaybook.playbook.yamlwriter import YamlWriter
+        return YamlWriter(stream)
 
-        return yaml.dump(yamlmap, default_flow_style=False)
+    def _write_node(self, writer, node):
+        '''Writes a node as a mapping with the node boxname as a key, and node attributes as a value;
+        node attributes are written one at a time, without copying the node into a dictionary.
+
+        Keyword arguments:
+        writer                 -- The yaml writer
+        node                   -- The node (or a row in the table of nodes)
+        '''
+
+        writer.start_mapping()
+        writer.add(node.boxname)
+        writer.start_mapping()
+        for field in NODE_FIELDS:
+            writer.add(field)
+            writer.add(getattr(node, field))
+        writer.end_mapping()
+        writer.end_mapping()
+
+    def _write_hosts(self, writer, nodes):
+        '''Writes the hosts in an ansible group of the inventory, each one as a mapping with boxname and hostname.
+
+        Keyword arguments:
+        writer                 -- The yaml writer
+        nodes                  -- The nodes in the ansible group (or rows in the table of nodes)
+        '''
+
+        writer.start_sequence()
+        for node in nodes:
+            writer.start_mapping()
+            writer.add('boxname')
+            writer.add(node.boxname)
+            writer.add('hostname')
+            writer.add(node.hostname)
+            writer.end_mapping()
+        writer.end_sequence()
 
     def _get_object_attributes(self, instance):
         return [a for a in dir(instance) if not a.startswith('_') and not type(getattr(instance, a)) == types.MethodType]
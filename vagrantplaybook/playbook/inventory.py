@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import hashlib
+from cStringIO import StringIO
+
+from vagrantplaybook.atomicfile import atomic_open
+
+class InventoryWriter:
+    '''
+    This class defines a writer of ansible inventory trees, that is an inventory file (ini format, with a section for each
+    ansible group listing the hostnames of nodes in the group), and a group_vars/<group>.yml and a host_vars/<host>.yml file for
+    each group/host with vars.
+    Each file is rewritten - atomically - only if its content changed, so files of unchanged groups and hosts are not touched
+    (and ansible caches are not invalidated); files written by the last execution and not generated anymore are removed.
+    Written files are tracked in a manifest, so files not written by the writer are never removed.
+    '''
+
+    # The name of the inventory file
+    INVENTORY = 'inventory'
+
+    # The name of the manifest file, listing the files written by the last execution
+    MANIFEST = '.vagrant-playbook-inventory'
+
+    def __init__(self, path):
+        '''Creates a new InventoryWriter.
+
+        Keyword arguments:
+        path            -- The directory of the inventory tree (usually the ansible_playbook_path of the cluster)
+        '''
+
+        self.path = path
+
+        # The files written, unchanged and removed by the last execution, relative to the inventory directory
+        self.written = []
+        self.unchanged = []
+        self.removed = []
+
+    def write(self, inventory, ansible_group_vars, ansible_host_vars):
+        ''' Writes the inventory tree.
+
+        Keyword arguments:
+        inventory              -- Ansible inventory  - linking ansible groups and hosts
+        ansible_group_vars     -- Ansible group vars - grouped by ansible groups
+        ansible_host_vars      -- Ansible host vars - grouped by hosts
+        '''
+
+        self.written = []
+        self.unchanged = []
+        self.removed = []
+
+        files = { InventoryWriter.INVENTORY: self._inventory(inventory) }
+        for directory, values in (('group_vars', ansible_group_vars), ('host_vars', ansible_host_vars)):
+            for name, variables in values.iteritems():
+                if variables:
+                    files[os.path.join(directory, '%s.yml' % name)] = self._yaml(variables)
+
+        for name in sorted(files):
+            if self._update(name, files[name]):
+                self.written.append(name)
+            else:
+                self.unchanged.append(name)
+
+        for name in self._read_manifest():
+            if name not in files:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                    self.removed.append(name)
+                except OSError:
+                    pass
+
+        self._update(InventoryWriter.MANIFEST, ''.join('%s\n' % name for name in sorted(files)))
+
+    def report(self):
+        ''' Gets a report of the number of files written, unchanged and removed by the last execution (with the removed files). '''
+
+        lines = ['Inventory %s: %i written, %i unchanged, %i removed' % (self.path, len(self.written), len(self.unchanged), len(self.removed))]
+        lines.extend('  removed %s' % name for name in self.removed)
+        return '\n'.join(lines) + '\n'
+
+    def _inventory(self, inventory):
+        ''' utility function for getting the content of the inventory file '''
+
+        lines = ['# generated by vagrant-playbook']
+        for ansible_group in sorted(inventory):
+            lines.append('')
+            lines.append('[%s]' % ansible_group)
+            lines.extend(node.hostname for node in inventory[ansible_group])
+
+        return '\n'.join(lines) + '\n'
+
+    def _yaml(self, variables):
+        ''' utility function for getting the content of a vars file '''
+
+        from vagrantplaybook.playbook.yamlwriter import YamlWriter
+
+        stream = StringIO()
+        writer = YamlWriter(stream)
+        writer.open()
+        writer.add(variables)
+        writer.close()
+        return stream.getvalue()
+
+    def _update(self, name, content):
+        ''' utility function for writing a file atomically, only if its content changed; returns True if the file was written '''
+
+        path = os.path.join(self.path, name)
+        try:
+            with open(path, 'rb') as f:
+                if hashlib.sha1(f.read()).digest() == hashlib.sha1(content).digest():
+                    return False
+        except IOError:
+            pass
+
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # NB. files keep their mode, or get the default mode for new files
+        with atomic_open(path) as f:
+            f.write(content)
+
+        return True
+
+    def _read_manifest(self):
+        ''' utility function for getting the files written by the last execution '''
+
+        try:
+            with open(os.path.join(self.path, InventoryWriter.MANIFEST), 'rb') as f:
+                return [line for line in f.read().splitlines() if line]
+        except IOError:
+            return []
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+
+class JsonWriter:
+    '''
+    This class defines a streaming json writer, with the same interface of YamlWriter, that writes a json document
+    to a file-like object one piece at a time, so the whole document is never kept in memory.
+    Mappings and sequences opened explicitly are written one item per line (or without whitespaces, in compact mode), while
+    values are encoded in one line, as soon as they are added, using the json encoder (the C-accelerated encoder, if available).
+    NB. on python 2, the C-accelerated encoder is not used when keys are sorted.
+    '''
+
+    def __init__(self, stream, compact = False, sort_keys = False):
+        '''Creates a new JsonWriter.
+
+        Keyword arguments:
+        stream          -- The file-like object the document will be written to
+        compact         -- True for writing the document without whitespaces (default False, one item per line)
+        sort_keys       -- True for writing the keys of mappings in values in sorted order (default False)
+        '''
+
+        self._stream = stream
+        self._compact = compact
+        self._encoder = json.JSONEncoder(separators = (',', ':') if compact else (', ', ': '), sort_keys = sort_keys)
+
+        # A stack with [is mapping, number of items added] for each mapping/sequence opened and not yet closed
+        self._stack = []
+
+    def open(self):
+        ''' Starts the json document. '''
+
+        self._stack = []
+
+    def close(self):
+        ''' Ends the json document, and flushes the stream. '''
+
+        if not self._compact:
+            self._stream.write('\n')
+        if hasattr(self._stream, 'flush'):
+            self._stream.flush()
+
+    def start_mapping(self):
+        ''' Starts a mapping; keys and values should be added using add. '''
+
+        self._start('{', True)
+
+    def end_mapping(self):
+        ''' Ends the current mapping. '''
+
+        self._end('}')
+
+    def start_sequence(self):
+        ''' Starts a sequence; items should be added using add. '''
+
+        self._start('[', False)
+
+    def end_sequence(self):
+        ''' Ends the current sequence. '''
+
+        self._end(']')
+
+    def add(self, value):
+        ''' Encodes and writes a value (a mapping key, a mapping value or a sequence item); mapping keys should be strings.
+
+        Keyword arguments:
+        value           -- The value to be written
+        '''
+
+        key = self._item()
+        self._stream.write(self._encoder.encode(value))
+        if key:
+            self._stream.write(self._encoder.key_separator)
+
+    def _start(self, marker, mapping):
+        self._item()
+        self._stream.write(marker)
+        self._stack.append([mapping, 0])
+
+    def _end(self, marker):
+        mapping, count = self._stack.pop()
+        if count and not self._compact:
+            self._stream.write('\n' + '  ' * len(self._stack))
+        self._stream.write(marker)
+
+    def _item(self):
+        ''' utility function for writing the separator before an item; returns True if the item is a mapping key '''
+
+        if not self._stack:
+            return False
+
+        position = self._stack[-1]
+        mapping, count = position
+        position[1] += 1
+
+        # values in mappings follow their key on the same line
+        if mapping and count % 2 == 1:
+            return False
+
+        if count:
+            self._stream.write(',')
+        if not self._compact:
+            self._stream.write('\n' + '  ' * len(self._stack))
+        return mapping
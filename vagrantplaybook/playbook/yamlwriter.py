@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from yaml.events import DocumentStartEvent, DocumentEndEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent, MappingStartEvent, MappingEndEvent
+from yaml.nodes import ScalarNode, SequenceNode, MappingNode
+
+from vagrantplaybook.yamlbackend import yaml_dumper
+
+class YamlWriter:
+    '''
+    This class defines a streaming yaml writer, that writes a yaml document to a file-like object one piece at a time,
+    so the whole document is never kept in memory.
+    Mappings and sequences are opened and closed explicitly, while values are represented and written as soon
+    as they are added; the output is the same generated by yaml.dump(default_flow_style=False) with the same dumper, with the
+    only difference that objects shared between values are written again instead of using aliases.
+    NB. keys of mappings opened with start_mapping should be added in sorted order, as yaml.dump does.
+    '''
+
+    def __init__(self, stream, dumper = yaml_dumper, encoding = 'utf-8'):
+        '''Creates a new YamlWriter.
+
+        Keyword arguments:
+        stream          -- The file-like object the document will be written to
+        dumper          -- The yaml dumper class, that will be used for representing and emitting values (default the LibYAML safe dumper, if available)
+        encoding        -- The encoding for the document (as in yaml.dump)
+        '''
+
+        self._dumper = dumper(stream, default_flow_style = False, encoding = encoding)
+
+    def open(self):
+        ''' Starts the yaml document. '''
+
+        self._dumper.open()
+        self._dumper.emit(DocumentStartEvent(explicit = False))
+
+    def close(self):
+        ''' Ends the yaml document, and flushes the stream. '''
+
+        self._dumper.emit(DocumentEndEvent(explicit = False))
+        self._dumper.close()
+        self._dumper.dispose()
+
+    def start_mapping(self):
+        ''' Starts a mapping; keys and values should be added using add. '''
+
+        self._dumper.emit(MappingStartEvent(None, None, True, flow_style = False))
+
+    def end_mapping(self):
+        ''' Ends the current mapping. '''
+
+        self._dumper.emit(MappingEndEvent())
+
+    def start_sequence(self):
+        ''' Starts a sequence; items should be added using add. '''
+
+        self._dumper.emit(SequenceStartEvent(None, None, True, flow_style = False))
+
+    def end_sequence(self):
+        ''' Ends the current sequence. '''
+
+        self._dumper.emit(SequenceEndEvent())
+
+    def add(self, value):
+        ''' Represents and writes a value (a mapping key, a mapping value or a sequence item).
+
+        Keyword arguments:
+        value           -- The value to be written
+        '''
+
+        self._serialize(self._dumper.represent_data(value))
+
+        self._dumper.represented_objects = {}
+        self._dumper.object_keeper = []
+        self._dumper.alias_key = None
+
+    def _serialize(self, node):
+        dumper = self._dumper
+        if isinstance(node, ScalarNode):
+            detected_tag = dumper.resolve(ScalarNode, node.value, (True, False))
+            default_tag = dumper.resolve(ScalarNode, node.value, (False, True))
+            implicit = (node.tag == detected_tag), (node.tag == default_tag)
+            dumper.emit(ScalarEvent(None, node.tag, implicit, node.value, style = node.style))
+        elif isinstance(node, SequenceNode):
+            implicit = (node.tag == dumper.resolve(SequenceNode, node.value, True))
+            dumper.emit(SequenceStartEvent(None, node.tag, implicit, flow_style = node.flow_style))
+            for item in node.value:
+                self._serialize(item)
+            dumper.emit(SequenceEndEvent())
+        elif isinstance(node, MappingNode):
+            implicit = (node.tag == dumper.resolve(MappingNode, node.value, True))
+            dumper.emit(MappingStartEvent(None, node.tag, implicit, flow_style = node.flow_style))
+            for key, value in node.value:
+                self._serialize(key)
+                self._serialize(value)
+            dumper.emit(MappingEndEvent())
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import gc
+import sys
+import json
+import time
+import timeit
+
+from vagrantplaybook.compat import compat_string_types
+
+try:
+    import tracemalloc
+except ImportError:
+    # NB. tracemalloc is not available on python 2 (unless the pytracemalloc backport is installed)
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def cpu_time():
+    ''' utility function for getting the CPU time (user + system) of the current process, in seconds '''
+    times = os.times()
+    return times[0] + times[1]
+
+def peak_memory():
+    ''' Gets the peak memory (max resident set size) of the current process, in bytes, or None if it is not available. '''
+
+    if resource is None:
+        return None
+
+    # NB. ru_maxrss is in kilobytes on linux, in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+def resident_memory():
+    ''' Gets the memory (resident set size) of the current process, in bytes, or None if it is not available (e.g. not linux). '''
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+class Phase:
+    '''
+    This class defines a phase recorded by a Profiler, e.g. loading the playbook or generating host vars.
+    Phases are used as context managers; the code in the phase can set the number of objects generated by the phase
+    (e.g. nodes, vars) by assigning count.
+    '''
+
+    __slots__ = ('name', 'depth', 'start', 'wall', 'cpu', 'count', 'net', 'peak', 'objects', '_profiler', '_cpu_start', '_trace_start')
+
+    def __init__(self, profiler, name, depth):
+        '''Creates a new Phase.
+
+        Keyword arguments:
+        profiler        -- The Profiler recording the phase
+        name            -- The name of the phase
+        depth           -- The nesting level of the phase (0 for top level phases)
+        '''
+
+        self.name = name
+        self.depth = depth
+        self.start = None
+        self.wall = None
+        self.cpu = None
+        self.count = None
+        self.net = None
+        self.peak = None
+        self.objects = None
+        self._profiler = profiler
+        self._cpu_start = None
+        self._trace_start = None
+
+    def __enter__(self):
+        # phases are listed in start order, so nested phases follow their parent
+        self._profiler.phases.append(self)
+        self._profiler._stack.append(self)
+        if self._profiler.memory is not None:
+            self._profiler.memory.enter()
+        self.start = self._profiler._timer()
+        self._cpu_start = self._profiler._clock()
+        if self._profiler.trace is not None:
+            self._trace_start = self._profiler.trace.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall = self._profiler._timer() - self.start
+        self.cpu = self._profiler._clock() - self._cpu_start
+        self._profiler._stack.pop()
+        if self._profiler.memory is not None:
+            self.net, self.peak, self.objects = self._profiler.memory.exit()
+
+        trace = self._profiler.trace
+        if trace is not None:
+            trace.complete(self.name, 'phase', self._trace_start, trace.clock() - self._trace_start, dict(count = self.count))
+
+        self._profiler.on_phase(self)
+
+class Profiler:
+    '''
+    This class defines a lightweight profiler, that records wall time, CPU time and the number of generated objects
+    for each phase of a playbook execution (load, parse, compose and its nested phases, emit).
+    A profiler can be given to Executor for getting where time is spent; subclasses can override on_phase
+    for being notified when each phase ends (e.g. for logging).
+    Optionally, the profiler can record also the cost of each value generator (see GeneratorStats), a trace
+    with a span for each phase, nodegroup, node and value generator (see TraceRecorder), and the memory allocated
+    by each phase (see MemoryTracker).
+    '''
+
+    def __init__(self, timer = timeit.default_timer, clock = cpu_time, generators = False, trace = False, memory = False):
+        '''Creates a new Profiler.
+
+        Keyword arguments:
+        timer           -- The function used for getting the wall time, in seconds
+        clock           -- The function used for getting the CPU time, in seconds
+        generators      -- True for recording the cost of each value generator (default False)
+        trace           -- True for recording a trace of the execution (default False)
+        memory          -- True for recording the memory allocated by each phase (default False)
+        '''
+
+        self._timer = timer
+        self._clock = clock
+
+        # The MemoryTracker recording memory allocated by phases, or None
+        self.memory = MemoryTracker() if memory else None
+
+        # The TraceRecorder recording spans, or None
+        self.trace = TraceRecorder() if trace else None
+
+        # The GeneratorStats recording the cost of each value generator, or None; when tracing, value generators are
+        # always recorded, and each generated value is added to the trace too
+        self.generators = None
+        if trace:
+            self.generators = GeneratorStats(self.trace.clock, self.trace)
+        elif generators:
+            self.generators = GeneratorStats(timer)
+
+        # The phases in progress, from the outermost
+        self._stack = []
+
+        # The list of recorded phases, in start order
+        self.phases = []
+
+    def phase(self, name):
+        ''' Gets a context manager recording a phase; phases started within another phase are nested into it.
+
+        Keyword arguments:
+        name            -- The name of the phase
+        '''
+
+        return Phase(self, name, len(self._stack))
+
+    def on_phase(self, phase):
+        ''' Hook called when a phase ends; the default implementation does nothing.
+
+        Keyword arguments:
+        phase           -- The completed Phase
+        '''
+
+        pass
+
+    def clear(self):
+        ''' Removes all the recorded phases. '''
+
+        self.phases = []
+
+    @property
+    def total(self):
+        ''' The wall time of top level phases, in seconds. '''
+        return sum(phase.wall for phase in self.phases if phase.depth == 0 and phase.wall is not None)
+
+    def report(self, stream):
+        ''' Writes the recorded phases as a table, with nested phases indented.
+
+        Keyword arguments:
+        stream          -- The file-like object the report will be written to
+        '''
+
+        memory = self.memory is not None
+        stream.write('Profile (times in ms%s):\n' % (', memory in KB' if memory else ''))
+        stream.write('%-24s %12s %12s %12s' % ('phase', 'wall', 'cpu', 'objects'))
+        stream.write(' %12s %12s %12s\n' % ('net', 'peak', 'gc objects') if memory else '\n')
+        for phase in self.phases:
+            if phase.wall is None:
+                continue
+            stream.write('%-24s %12.1f %12.1f %12s' % ('  ' * phase.depth + phase.name, phase.wall * 1000, phase.cpu * 1000, _format(phase.count)))
+            stream.write(' %12s %12s %12s\n' % (_format(phase.net, 1024), _format(phase.peak, 1024), _format(phase.objects)) if memory else '\n')
+        stream.write('Total time: %.1f ms\n' % (self.total * 1000))
+
+class GeneratorStats:
+    '''
+    This class defines the accounting of value generators, recording for each generator - identified by scope
+    ('node', 'context', 'group' or 'host'), group (nodegroup or ansible group) and var - the number of calls,
+    the total and max time spent generating values, and the total size of generated values.
+    '''
+
+    def __init__(self, timer = timeit.default_timer, trace = None):
+        '''Creates a new GeneratorStats.
+
+        Keyword arguments:
+        timer           -- The function used for getting the wall time, in seconds
+        trace           -- The TraceRecorder each generated value should be added to, or None
+        '''
+
+        self.timer = timer
+        self.trace = trace
+
+        # A dictionary, that will be used to store [calls, total time, max time, total size], keyed by (scope, group, var)
+        self.generators = {}
+
+    def record(self, key, start, elapsed, value, available_variables = None):
+        ''' Records a value generated by a generator.
+
+        Keyword arguments:
+        key                  -- The (scope, group, var) tuple identifying the generator
+        start                -- The time the generator started, in seconds
+        elapsed              -- The time spent generating the value, in seconds
+        value                -- The generated value
+        available_variables  -- The variables available to the generator, used for tagging trace spans with the node
+        '''
+
+        if self.trace is not None:
+            self.trace.complete_generator(key, start, elapsed, available_variables)
+
+        stats = self.generators.get(key)
+        if stats is None:
+            stats = self.generators[key] = [0, 0.0, 0.0, 0]
+
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+        stats[3] += len(value) if isinstance(value, compat_string_types) else len(repr(value))
+
+    def merge(self, generators):
+        ''' Adds the accounting recorded by another GeneratorStats (e.g. in a worker process).
+
+        Keyword arguments:
+        generators      -- The generators dictionary of the other GeneratorStats
+        '''
+
+        for key, (calls, total, maximum, size) in generators.iteritems():
+            stats = self.generators.get(key)
+            if stats is None:
+                self.generators[key] = [calls, total, maximum, size]
+            else:
+                stats[0] += calls
+                stats[1] += total
+                stats[2] = max(stats[2], maximum)
+                stats[3] += size
+
+    def top(self, limit = None):
+        ''' Gets the most expensive generators, as a list of (key, [calls, total time, max time, total size]) sorted by total time.
+
+        Keyword arguments:
+        limit           -- The max number of generators (default all)
+        '''
+
+        generators = sorted(self.generators.iteritems(), key = lambda item: (-item[1][1], item[0]))
+        return generators[:limit] if limit is not None else generators
+
+    def report(self, stream, limit = 20):
+        ''' Writes the most expensive generators, sorted by total time.
+
+        Keyword arguments:
+        stream          -- The file-like object the report will be written to
+        limit           -- The max number of generators to be reported (default 20)
+        '''
+
+        stream.write('Generator profile (top %i of %i, times in ms):\n' % (min(limit, len(self.generators)), len(self.generators)))
+        stream.write('%12s %12s %10s %12s  %s\n' % ('total', 'max', 'calls', 'size', 'scope/group/var'))
+        for (scope, group, var), (calls, total, maximum, size) in self.top(limit):
+            stream.write('%12.1f %12.2f %10i %12i  %s/%s/%s\n' % (total * 1000, maximum * 1000, calls, size, scope, group, var))
+
+class MemoryTracker:
+    '''
+    This class defines the accounting of memory allocated by profiled phases, recording for each phase the net
+    allocation (memory at the end of the phase minus memory at the start), the peak allocation above memory at the start
+    of the phase, and the net number of objects tracked by the garbage collector.
+
+    When tracemalloc is available, allocations of python objects are traced, and the source lines allocating most memory
+    can be reported; otherwise, memory is measured as the resident set size of the process (net allocations are available
+    only on linux), and the types with most new objects are reported instead of source lines. When the peak can't be reset
+    at the start of each phase (python < 3.9, or without tracemalloc) peaks are measured as the growth of the high-water mark,
+    so they are zero for phases that do not increase the peak memory of the process.
+    '''
+
+    def __init__(self, frames = 1):
+        '''Creates a new MemoryTracker; tracing starts immediately.
+
+        Keyword arguments:
+        frames          -- The number of frames stored for each allocation, when tracemalloc is available
+        '''
+
+        # True if allocations are traced by tracemalloc
+        self.traced = tracemalloc is not None
+
+        # True if the peak can be reset at the start of each phase (tracemalloc on python 3.9+)
+        self._resettable = self.traced and hasattr(tracemalloc, 'reset_peak')
+
+        # A list, that will be used to store [memory at start, peak, high-water mark at start] for the phases in progress
+        self._stack = []
+
+        if self.traced:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._baseline = tracemalloc.take_snapshot()
+        else:
+            self._baseline = self._count_types()
+
+    def enter(self):
+        ''' Starts recording memory allocated by a phase. '''
+
+        peak = self._peak()
+        if self._resettable:
+            # the peak reached so far is kept by the enclosing phases before resetting it
+            for record in self._stack:
+                record[1] = max(record[1], peak)
+            tracemalloc.reset_peak()
+
+        current = self._current()
+        self._stack.append([current, current if self._resettable else peak, peak, len(gc.get_objects())])
+
+    def exit(self):
+        ''' Ends recording memory allocated by the last phase started, and returns the net allocation, the peak allocation
+        (both in bytes, None if not available) and the net number of objects tracked by the garbage collector. '''
+
+        start, peak, high_water_mark, objects = self._stack.pop()
+        current = self._current()
+        peak = max(peak, self._peak())
+
+        if self._resettable:
+            for record in self._stack:
+                record[1] = max(record[1], peak)
+            peak = peak - start
+        elif peak is not None:
+            peak = peak - high_water_mark
+
+        return current - start if current is not None else None, peak, len(gc.get_objects()) - objects
+
+    def top(self, limit = 10):
+        ''' Gets the top allocations since the tracker was created, as a list of (source line or type, size in bytes
+        - None if not available -, number of objects) sorted by size (or by number of objects, if sizes are not available).
+
+        Keyword arguments:
+        limit           -- The max number of allocations
+        '''
+
+        if self.traced:
+            statistics = [s for s in tracemalloc.take_snapshot().compare_to(self._baseline, 'lineno') if s.size_diff > 0]
+            return [('%s:%i' % (s.traceback[0].filename, s.traceback[0].lineno), s.size_diff, s.count_diff) for s in statistics[:limit]]
+
+        counts = self._count_types()
+        growth = [(name, None, count - self._baseline.get(name, 0)) for name, count in counts.iteritems()]
+        return sorted([item for item in growth if item[2] > 0], key = lambda item: (-item[2], item[0]))[:limit]
+
+    def report(self, stream, limit = 10):
+        ''' Writes the top allocations since the tracker was created.
+
+        Keyword arguments:
+        stream          -- The file-like object the report will be written to
+        limit           -- The max number of allocations to be reported (default 10)
+        '''
+
+        stream.write('Memory profile (top %i %s, memory in KB):\n' % (limit, 'source lines' if self.traced else 'object types, tracemalloc not available'))
+        stream.write('%12s %12s  %s\n' % ('size', 'objects', 'source line' if self.traced else 'type'))
+        for name, size, count in self.top(limit):
+            stream.write('%12s %12i  %s\n' % (_format(size, 1024), count, name))
+
+    def _current(self):
+        return tracemalloc.get_traced_memory()[0] if self.traced else resident_memory()
+
+    def _peak(self):
+        return tracemalloc.get_traced_memory()[1] if self.traced else peak_memory()
+
+    def _count_types(self):
+        counts = {}
+        for obj in gc.get_objects():
+            name = type(obj).__name__
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+def _format(value, unit = 1):
+    ''' utility function for formatting an optional value in a report (- if not available) '''
+
+    if value is None:
+        return '-'
+    return '%.1f' % (value / unit) if unit != 1 else str(value)
+
+class TraceRecorder:
+    '''
+    This class defines a recorder of trace events in the Chrome trace event format, that can be opened with
+    a standard trace viewer (chrome://tracing, Perfetto). Each span is recorded as a complete event, with timestamps
+    taken from the system clock, so events recorded by worker processes can be merged into a single trace.
+    '''
+
+    def __init__(self, clock = time.time):
+        '''Creates a new TraceRecorder.
+
+        Keyword arguments:
+        clock           -- The function used for getting timestamps, in seconds (shared by all the processes)
+        '''
+
+        self.clock = clock
+
+        # The process the events are recorded by
+        self.pid = os.getpid()
+
+        # The list of trace events
+        self.events = []
+
+    def complete(self, name, category, start, elapsed, args = None):
+        ''' Records a span.
+
+        Keyword arguments:
+        name            -- The name of the span
+        category        -- The category of the span (e.g. phase, nodegroup, node, generator)
+        start           -- The time the span started, in seconds
+        elapsed         -- The duration of the span, in seconds
+        args            -- A dictionary with the tags of the span (e.g. group name, node index, var name)
+        '''
+
+        self.events.append(dict(name = name, cat = category, ph = 'X', ts = start * 1000000, dur = elapsed * 1000000,
+            pid = self.pid, tid = 0, args = args or {}))
+
+    def complete_generator(self, key, start, elapsed, available_variables = None):
+        ''' Records the span of a value generator, tagged with scope, group, var and - if available - the node.
+
+        Keyword arguments:
+        key                  -- The (scope, group, var) tuple identifying the generator
+        start                -- The time the generator started, in seconds
+        elapsed              -- The time spent generating the value, in seconds
+        available_variables  -- The variables available to the generator
+        '''
+
+        scope, group, var = key
+        args = dict(scope = scope, group = group, var = var)
+        if available_variables is not None:
+            if 'node_index' in available_variables:
+                args['node_index'] = available_variables['node_index']
+            elif 'node' in available_variables:
+                args['node_index'] = available_variables['node'].index
+                args['host'] = available_variables['node'].hostname
+
+        self.complete(var, 'generator', start, elapsed, args)
+
+    def merge(self, events):
+        ''' Adds the events recorded by another TraceRecorder (e.g. in a worker process).
+
+        Keyword arguments:
+        events          -- The events of the other TraceRecorder
+        '''
+
+        self.events.extend(events)
+
+    def write(self, stream):
+        ''' Writes the trace in the Chrome trace event format (json), with process names for the main and worker processes.
+
+        Keyword arguments:
+        stream          -- The file-like object the trace will be written to
+        '''
+
+        pids = sorted(set(event['pid'] for event in self.events) - set([self.pid]))
+        metadata = [dict(name = 'process_name', ph = 'M', pid = self.pid, tid = 0, args = dict(name = 'vagrant-playbook'))]
+        metadata.extend(dict(name = 'process_name', ph = 'M', pid = pid, tid = 0, args = dict(name = 'worker %i' % pid)) for pid in pids)
+
+        json.dump(dict(traceEvents = metadata + sorted(self.events, key = lambda event: event['ts']), displayTimeUnit = 'ms'), stream)
+
+    def save(self, path):
+        ''' Saves the trace to a file, in the Chrome trace event format.
+
+        Keyword arguments:
+        path            -- The trace file
+        '''
+
+        with open(path, 'wb') as f:
+            self.write(f)
+
+class _NullPhase:
+    ''' utility class for a phase that is not recorded, used when there is no profiler '''
+
+    count = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+class NullProfiler:
+    '''
+    This class defines a profiler that does not record phases, used when profiling is not enabled.
+    '''
+
+    _phase = _NullPhase()
+
+    # Value generators, traces and memory are not recorded
+    generators = None
+    trace = None
+    memory = None
+
+    def phase(self, name):
+        ''' Gets a context manager that does nothing.
+
+        Keyword arguments:
+        name            -- The name of the phase
+        '''
+
+        return self._phase
+
+# The profiler used when profiling is not enabled
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import json
+import stat
+import errno
+import socket
+import tempfile
+import traceback
+
+import vagrantplaybook
+from vagrantplaybook import errors
+from vagrantplaybook.errors import ServerError
+from vagrantplaybook.compat import to_bytes
+from vagrantplaybook.templating.backend import DEFAULT_TEMPLATING_BACKEND
+
+# NB. this module is imported by the command line client, so only lightweight modules are imported here;
+# the executor (yaml, jinja2, ansible) is imported only by the server
+
+def _get_socket_directory():
+    ''' utility function for getting the private directory of the default server socket: a directory in $XDG_RUNTIME_DIR
+    (if defined), or in the temp directory, one for each user '''
+
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'vagrant-playbook')
+    return os.path.join(tempfile.gettempdir(), 'vagrant-playbook-%s' % (os.getuid() if hasattr(os, 'getuid') else 'default'))
+
+# The default path of the server socket (one server for each user), in a directory accessible only to the user
+SOCKET_DIRECTORY = _get_socket_directory()
+DEFAULT_SOCKET = os.path.join(SOCKET_DIRECTORY, 'compose.sock')
+
+# The max number of compiled templates kept by the server; the cache is cleared before a request when it grows over the limit
+MAX_TEMPLATES = 10000
+
+# The max size of a request, in bytes
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+class ComposeServer:
+    '''
+    This class defines a long-lived compose server, listening on a unix domain socket.
+    The server keeps the templating backends, the caches of compiled templates and the imported modules warm, so each request
+    pays only for the playbook execution; requests are executed one at a time, in the current directory and with the environment
+    of the client, so the compose cache and the compose state are the same used by an in-process execution.
+
+    The protocol is a single request/response for each connection: the client sends a json object terminated by a newline
+    (see request), and the server answers with a json object, then closes the connection.
+    '''
+
+    def __init__(self, path = None, templating = DEFAULT_TEMPLATING_BACKEND):
+        '''Creates a new ComposeServer.
+
+        Keyword arguments:
+        path            -- The path of the unix domain socket (default DEFAULT_SOCKET)
+        templating      -- The name of the templating backend to be created when the server starts (other backends are created on first use)
+        '''
+
+        self.path = path if path is not None else DEFAULT_SOCKET
+        self.templating = templating
+
+        # A dictionary, that will be used to store the cache of compiled templates for each templating backend
+        self._templates = {}
+
+        # The listening socket, while the server is running
+        self._socket = None
+
+        # The number of executed requests
+        self.requests = 0
+
+    def start(self):
+        ''' Starts listening on the socket, creating the default templating backend; a stale socket file
+        (left by a server that is not running anymore) is replaced. '''
+
+        # NB. the default socket is created in a directory accessible only to the user (other users can't connect, or replace the socket)
+        if self.path == DEFAULT_SOCKET and not _check_private_directory(SOCKET_DIRECTORY, create = True):
+            raise ServerError('the socket directory %s is not private (it should be a directory owned by the user, with mode 0700)' % SOCKET_DIRECTORY)
+
+        if ping(self.path):
+            raise ServerError('a server is already listening on %s' % self.path)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        self._get_templates(self.templating)
+
+        # the socket is created accessible only to the user, so there is no window where other users can connect
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0177)
+        try:
+            self._socket.bind(self.path)
+        finally:
+            os.umask(umask)
+        self._socket.listen(16)
+
+    def serve_forever(self):
+        ''' Executes requests until a stop request is received (or the process is interrupted), then removes the socket;
+        errors handling a request are reported to stderr, and the server keeps serving requests. '''
+
+        try:
+            while True:
+                try:
+                    connection, address = self._socket.accept()
+                except socket.error, e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    if not self.handle(connection):
+                        break
+                except Exception:
+                    # errors on a connection (e.g. a client disconnecting before reading the response) do not stop the server
+                    traceback.print_exc()
+                finally:
+                    connection.close()
+        finally:
+            self.close()
+
+    def close(self):
+        ''' Stops listening, and removes the socket. '''
+
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def handle(self, connection):
+        ''' Executes a request received on a connection; returns False if the server should stop.
+
+        Keyword arguments:
+        connection      -- The client connection
+        '''
+
+        try:
+            request = json.loads(_receive_line(connection))
+        except Exception, e:
+            _send(connection, dict(error = 'invalid request: %s' % e, error_type = 'ServerError'))
+            return True
+
+        command = request.get('command', 'execute')
+        if command == 'ping':
+            _send(connection, dict(version = vagrantplaybook.__version__, pid = os.getpid(), requests = self.requests))
+            return True
+        if command == 'stop':
+            _send(connection, dict(stopped = True))
+            return False
+
+        _send(connection, self.execute(request))
+        return True
+
+    def execute(self, request):
+        ''' Executes a playbook, and returns the response with the composed cluster (or the error).
+
+        Keyword arguments:
+        request         -- The request (see vagrantplaybook.server.request)
+        '''
+
+        if request.get('version') != vagrantplaybook.__version__:
+            return dict(error = 'version mismatch (server %s, client %s)' % (vagrantplaybook.__version__, request.get('version')), error_type = 'ServerError')
+
+        self.requests += 1
+
+        # the request is executed in the directory of the client, with the environment variables looked up by the playbook
+        # set as in the client (None for variables not defined in the client)
+        cwd = os.getcwd()
+        environ = dict(os.environ)
+        try:
+            os.chdir(to_bytes(request['cwd']))
+            for name, value in (request.get('env') or {}).iteritems():
+                if value is None:
+                    os.environ.pop(to_bytes(name), None)
+                else:
+                    os.environ[to_bytes(name)] = to_bytes(value)
+            return self._execute(request)
+        except Exception, e:
+            if isinstance(e, errors.ComposeError):
+                return dict(error = e.message, error_type = type(e).__name__)
+            return dict(error = traceback.format_exc(), error_type = 'ServerError')
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            os.chdir(cwd)
+
+    def _execute(self, request):
+        from cStringIO import StringIO
+        from vagrantplaybook.playbook.executor import Executor
+        from vagrantplaybook.playbook.cache import ComposeCache
+        from vagrantplaybook.compose.state import ComposeState
+
+        templates = self._get_templates(request.get('templating') or DEFAULT_TEMPLATING_BACKEND)
+        if len(templates) > MAX_TEMPLATES:
+            templates.clear()
+
+        cache = ComposeCache() if request.get('cache', True) else None
+        state = ComposeState.DEFAULT_PATH if request.get('incremental') else None
+        executor = Executor(cache = cache, state = state, templates = templates,
+            output_format = request.get('output_format', 'yaml'), compact = request.get('compact', False), sort_keys = request.get('sort_keys', False))
+
+        out = StringIO()
+        # NB. json strings are unicode, while playbooks are read as bytes
+        yamlfile = to_bytes(request['file']) if request.get('file') else None
+        yamlplaybook = to_bytes(request['playbook']) if request.get('playbook') is not None else None
+        only = [to_bytes(item) for item in request['only']] if request.get('only') else None
+        executor.execute(yamlfile = yamlfile, yamlplaybook = yamlplaybook, jobs = request.get('jobs', 1), out = out, only = only)
+
+        return dict(output = out.getvalue(), report = executor.state.report() if executor.state is not None else None)
+
+    def _get_templates(self, templating):
+        ''' utility function for getting the cache of compiled templates for a templating backend, creating it on first use '''
+
+        if templating not in self._templates:
+            from vagrantplaybook.templating.backend import create_templating_backend
+            from vagrantplaybook.compose.templatecache import TemplateCache
+            self._templates[templating] = TemplateCache(create_templating_backend(templating))
+
+        return self._templates[templating]
+
+def _receive_line(connection):
+    ''' utility function for receiving a request, that is a line terminated by a newline '''
+
+    chunks = []
+    size = 0
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        newline = chunk.find('\n')
+        if newline >= 0:
+            chunks.append(chunk[:newline])
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > MAX_REQUEST_SIZE:
+            raise ValueError('request too large')
+
+    return ''.join(chunks)
+
+def _receive_all(connection):
+    ''' utility function for receiving a response, that is all the data until the connection is closed '''
+
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+
+    return ''.join(chunks)
+
+def _send(connection, message):
+    connection.sendall(json.dumps(message) + '\n')
+
+def _call(path, message):
+    ''' utility function for sending a message to the server and getting the response, or None if no server is listening
+
+    Keyword arguments:
+    path            -- The path of the unix domain socket
+    message         -- The message
+    '''
+
+    if not hasattr(socket, 'AF_UNIX') or not _check_socket(path):
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            connection.connect(path)
+        except socket.error:
+            # the socket file was left by a server that is not running anymore
+            return None
+        _send(connection, message)
+        return json.loads(_receive_all(connection))
+    finally:
+        connection.close()
+
+def _check_private_directory(directory, create = False):
+    ''' utility function for checking a directory is owned by the user and not accessible to other users, creating it if required
+
+    Keyword arguments:
+    directory       -- The directory
+    create          -- True for creating the directory (with mode 0700), if it does not exist
+    '''
+
+    if create:
+        try:
+            os.mkdir(directory, 0700)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    try:
+        st = os.lstat(directory)
+    except OSError:
+        return False
+
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0077
+
+def _check_socket(path):
+    ''' utility function for checking a socket exists and is owned by the user (e.g. it was not created by another user
+    to receive requests, with the environment of the client, and to return forged clusters)
+
+    Keyword arguments:
+    path            -- The path of the unix domain socket
+    '''
+
+    if path == DEFAULT_SOCKET and not _check_private_directory(SOCKET_DIRECTORY):
+        return False
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+def _get_environment(yamlfile, yamlplaybook):
+    ''' utility function for getting the environment variables looked up by a playbook, with their values in the client
+    (None for variables not defined); it returns None if the playbook looks up variables with names that are not literals
+    (or using plugin names that are not literals).
+
+    Keyword arguments:
+    yamlfile        -- The yaml file name (and path) containing the playbook, or None
+    yamlplaybook    -- The yaml string containing the playbook (used if yamlfile is None)
+    '''
+
+    from vagrantplaybook.playbook.cache import find_lookups
+
+    if yamlfile:
+        try:
+            with open(yamlfile, 'rb') as f:
+                yamlplaybook = f.read()
+        except IOError:
+            # errors are raised when the playbook is loaded
+            return {}
+
+    env = {}
+    for plugin, arguments in find_lookups(yamlplaybook or ''):
+        if plugin is None or plugin == 'env':
+            if arguments is None:
+                return None
+            # NB. a lookup can get many variables at once
+            for argument in arguments:
+                env[argument] = os.environ.get(argument)
+
+    return env
+
+def ping(path = None):
+    ''' Gets the status of the server listening on a socket (version, pid, number of executed requests), or None if no server is listening.
+
+    Keyword arguments:
+    path            -- The path of the unix domain socket (default DEFAULT_SOCKET)
+    '''
+
+    return _call(path if path is not None else DEFAULT_SOCKET, dict(command = 'ping'))
+
+def stop(path = None):
+    ''' Stops the server listening on a socket; returns False if no server is listening.
+
+    Keyword arguments:
+    path            -- The path of the unix domain socket (default DEFAULT_SOCKET)
+    '''
+
+    return _call(path if path is not None else DEFAULT_SOCKET, dict(command = 'stop')) is not None
+
+def request(path = None, yamlfile = None, yamlplaybook = None, jobs = 1, templating = DEFAULT_TEMPLATING_BACKEND, cache = True, incremental = False,
+            output_format = 'yaml', compact = False, sort_keys = False, only = None):
+    ''' Executes a playbook in the server listening on a socket, and returns the composed cluster (in yaml format, by default)
+    and the recompose report (None if the cluster was not composed incrementally); it returns None if no server
+    is listening, or the server is a different version, so the playbook can be executed in-process.
+    Errors raised executing the playbook are raised again in the client.
+    NB. only the environment variables looked up by the playbook are sent to the server; playbooks looking up environment variables
+    with names that are not literals (or using lookups with non literal plugin names) are always executed in-process.
+
+    Keyword arguments:
+    path            -- The path of the unix domain socket (default DEFAULT_SOCKET)
+    yamlfile        -- The yaml file name (and path) containing the playbook, or None
+    yamlplaybook    -- The yaml string containing the playbook (used if yamlfile is None)
+    jobs            -- The number of worker processes to be used for composing the cluster
+    templating      -- The name of the templating backend
+    cache           -- True for using the cache of composed clusters
+    incremental     -- True for recomposing the cluster incrementally
+    output_format   -- The format of the composed cluster ('yaml' or 'json')
+    compact         -- True for writing json documents without whitespaces
+    sort_keys       -- True for writing keys of vars and attributes in json documents in sorted order
+    only            -- The selection of nodes to be composed (a string or a list of strings), or None
+    '''
+
+    env = _get_environment(yamlfile, yamlplaybook)
+    if env is None:
+        return None
+
+    response = _call(path if path is not None else DEFAULT_SOCKET, dict(
+        version = vagrantplaybook.__version__,
+        cwd = os.getcwd(),
+        env = env,
+        file = os.path.abspath(yamlfile) if yamlfile else None,
+        playbook = yamlplaybook,
+        jobs = jobs,
+        templating = templating,
+        cache = cache,
+        incremental = incremental,
+        output_format = output_format,
+        compact = compact,
+        sort_keys = sort_keys,
+        only = [only] if isinstance(only, basestring) else only
+    ))
+
+    if response is None or response.get('error', '').startswith('version mismatch'):
+        return None
+
+    if 'error' in response:
+        error_type = getattr(errors, response['error_type'], None)
+        if not (isinstance(error_type, type) and issubclass(error_type, errors.ComposeError)):
+            error_type = ServerError
+        raise errors._restore_error(error_type, response['error'])
+
+    # NB. json strings are unicode, while the composed cluster is written as bytes
+    return response['output'].encode('utf-8'), response['report']
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from vagrantplaybook.compat import to_str
+from vagrantplaybook.templating.backend import TemplatingBackend
+
+import ansible
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar, NON_TEMPLATED_TYPES
+from ansible.template.safe_eval import safe_eval
+from ansible.errors import AnsibleError, AnsibleUndefinedVariable
+from ansible import constants as C
+
+import jinja2
+from jinja2.exceptions import TemplateSyntaxError, UndefinedError
+from jinja2.utils import concat as j2_concat
+
+# templates are compiled and rendered using internals of the ansible templar (tested with ansible 2.3);
+# if they are not available, templates are rendered with the public Templar.template
+try:
+    from ansible.template import _escape_backslashes, _count_newlines_from_end
+    from ansible.template.vars import AnsibleJ2Vars
+except ImportError:
+    _escape_backslashes = _count_newlines_from_end = AnsibleJ2Vars = None
+
+# The private members of the ansible templar used for compiling and rendering templates
+TEMPLAR_INTERNALS = ('_lookup', '_finalize', '_get_filters', '_get_tests', '_available_variables', '_no_type_regex', '_fail_on_undefined_errors', 'SINGLE_VAR')
+
+class AnsibleBackend(TemplatingBackend):
+    '''
+    This class defines a templating backend based on the ansible templar; templates are compiled
+    and rendered in the same way the ansible templar does.
+    If the internals of the ansible templar are not available (e.g. with an untested ansible version), templates
+    are not compiled, and they are rendered with the public Templar.template (slower, but generating the same values).
+    '''
+
+    name = 'ansible'
+
+    def __init__(self, loader = None, use_internals = True):
+        '''Creates a new AnsibleBackend.
+
+        Keyword arguments:
+        loader          -- The ansible dataloader, that will be used for generating the ansible templar (default a new DataLoader)
+        use_internals   -- True for compiling and rendering templates using internals of the ansible templar, if available (default True);
+                           False for always rendering templates with Templar.template
+        '''
+
+        self.templar = Templar(loader if loader is not None else DataLoader())
+        self._environment = None
+
+        # True if templates are compiled and rendered using internals of the ansible templar
+        self.use_internals = use_internals and AnsibleJ2Vars is not None and all(hasattr(self.templar, name) for name in TEMPLAR_INTERNALS)
+
+    @property
+    def version(self):
+        return 'ansible-%s/jinja2-%s' % (ansible.__version__, jinja2.__version__)
+
+    @property
+    def environment(self):
+        # creates a jinja2 environment with the same settings, filters and tests used by the ansible templar
+        if self._environment is None:
+            self._environment = self.templar.environment.overlay()
+            if self.use_internals:
+                self._environment.filters.update(self.templar._get_filters())
+                self._environment.tests.update(self.templar._get_tests())
+
+        return self._environment
+
+    def compile(self, source):
+        # NB. without internals, the template string is rendered by Templar.template
+        if not self.use_internals:
+            return source
+
+        templar = self.templar
+        environment = self.environment
+
+        try:
+            template = environment.from_string(_escape_backslashes(source, environment))
+        except TemplateSyntaxError, e:
+            raise AnsibleError("template error while templating string: %s. String: %s" % (to_str(e), to_str(source)))
+        except Exception, e:
+            if 'recursion' in to_str(e):
+                raise AnsibleError("recursive loop detected in template string: %s" % to_str(source))
+            return None
+
+        template.globals['lookup'] = templar._lookup
+        template.globals['finalize'] = templar._finalize
+
+        return template
+
+    def render(self, template, source, available_variables):
+        templar = self.templar
+
+        if not self.use_internals:
+            templar.set_available_variables(available_variables)
+            return templar.template(source)
+
+        # set the variables available within the ninja context
+        if templar._available_variables is not available_variables:
+            templar.set_available_variables(available_variables)
+
+        # if the template is just referencing a single var, the var is returned without changing its type
+        only_one = templar.SINGLE_VAR.match(source)
+        if only_one and only_one.group(1) in available_variables:
+            resolved_val = available_variables[only_one.group(1)]
+            if isinstance(resolved_val, NON_TEMPLATED_TYPES):
+                return resolved_val
+            elif resolved_val is None:
+                return C.DEFAULT_NULL_REPRESENTATION
+
+        if template is None:
+            return source
+
+        try:
+            templar.cur_context = context = template.new_context(AnsibleJ2Vars(templar, template.globals), shared=True)
+            try:
+                result = j2_concat(template.root_render_func(context))
+            except TypeError, e:
+                if 'StrictUndefined' in to_str(e):
+                    raise AnsibleUndefinedVariable("Unable to look up a name or access an attribute in template string (%s).\n"
+                        "Make sure your variable name does not contain invalid characters like '-': %s" % (to_str(source), to_str(e)))
+                raise AnsibleError("Unexpected templating type error occurred on (%s): %s" % (to_str(source), to_str(e)))
+        except (UndefinedError, AnsibleUndefinedVariable), e:
+            if templar._fail_on_undefined_errors:
+                raise AnsibleUndefinedVariable(e)
+            return source
+
+        # preserves the number of newlines at the end of the template string
+        source_newlines = _count_newlines_from_end(source)
+        result_newlines = _count_newlines_from_end(result)
+        if source_newlines > result_newlines:
+            result += '\n' * (source_newlines - result_newlines)
+
+        # if the result looks like a dictionary or a list, converts it to such
+        if not templar._no_type_regex.match(source):
+            if (result.startswith("{") and not result.startswith(templar.variable_start)) or result.startswith("[") or result in ("True", "False"):
+                value, error = safe_eval(result, locals=available_variables, include_exceptions=True)
+                if error is None:
+                    result = value
+
+        return result
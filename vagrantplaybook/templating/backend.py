@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import re
+import imp
+
+# The available templating backends
+TEMPLATING_BACKENDS = ['ansible', 'native']
+
+# The templating backend used when not specified
+DEFAULT_TEMPLATING_BACKEND = 'ansible'
+
+class TemplatingBackend:
+    '''
+    Base class for templating backends, that is the engines used for compiling and rendering value generators (ninja templates).
+    Values generated by all the backends should be the same generated by the ansible templar.
+    '''
+
+    # The name of the templating backend
+    name = None
+
+    @property
+    def version(self):
+        ''' The version of the templating backend (including versions of the underlying libraries). '''
+        raise NotImplementedError()
+
+    @property
+    def environment(self):
+        ''' The jinja2 environment used for compiling templates (also used for template analysis). '''
+        raise NotImplementedError()
+
+    def compile(self, source):
+        ''' Compiles a template string; returns None if the string should be kept as a literal.
+
+        Keyword arguments:
+        source               --  The template string
+        '''
+        raise NotImplementedError()
+
+    def render(self, template, source, available_variables):
+        ''' Renders a compiled template.
+
+        Keyword arguments:
+        template             --  The compiled template (or None, if the template string should be kept as a literal)
+        source               --  The template string
+        available_variables  --  Variables available within the execution context of the template
+        '''
+        raise NotImplementedError()
+
+def check_templating_backend(name):
+    ''' utility function for checking the name of a templating backend, without importing the backend module.
+
+    Keyword arguments:
+    name            --  The name of the templating backend
+    '''
+
+    if name not in TEMPLATING_BACKENDS:
+        raise ValueError("Invalid templating backend '%s'. Valid backends are: %s" % (name, ', '.join(TEMPLATING_BACKENDS)))
+
+def get_templating_backend_version(name):
+    ''' utility function for getting the version of a templating backend (the same of TemplatingBackend.version),
+    without importing the template engine; versions are read from the source of the underlying libraries.
+
+    Keyword arguments:
+    name            --  The name of the templating backend
+    '''
+
+    check_templating_backend(name)
+
+    if name == 'ansible':
+        return 'ansible-%s/jinja2-%s' % (_get_package_version('ansible', 'release'), _get_package_version('jinja2'))
+    return 'jinja2-%s' % _get_package_version('jinja2')
+
+def _get_package_version(package, module = '__init__'):
+    ''' utility function for reading the __version__ of a package, without importing it (falls back to import, e.g. for zipped packages) '''
+
+    try:
+        path = imp.find_module(package)[1]
+        with open(os.path.join(path, module + '.py'), 'rb') as f:
+            return re.search(r'''^__version__\s*=\s*['"]([^'"]+)['"]''', f.read(), re.M).group(1)
+    except (ImportError, IOError, AttributeError):
+        return __import__('%s.%s' % (package, module) if module != '__init__' else package, fromlist = ['__version__']).__version__
+
+def create_templating_backend(name = DEFAULT_TEMPLATING_BACKEND):
+    ''' utility function for creating a templating backend; backend modules are imported only when required.
+
+    Keyword arguments:
+    name            --  The name of the templating backend (one of TEMPLATING_BACKENDS)
+    '''
+
+    check_templating_backend(name)
+
+    if name == 'ansible':
+        from vagrantplaybook.templating.ansible import AnsibleBackend
+        return AnsibleBackend()
+    if name == 'native':
+        from vagrantplaybook.templating.native import NativeBackend
+        return NativeBackend()
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import re
+import ast
+import json
+import math
+import base64
+import random
+import hashlib
+import itertools
+from numbers import Number
+from pipes import quote
+
+import yaml
+import jinja2
+from jinja2 import Environment, BaseLoader, FileSystemLoader, StrictUndefined
+from jinja2.runtime import Undefined
+from jinja2.utils import concat as j2_concat
+
+from vagrantplaybook.compat import compat_string_types, compat_text_type, to_str
+from vagrantplaybook.templating.backend import TemplatingBackend
+
+# Primitive types returned as they are when a template is just referencing a single var
+NON_TEMPLATED_TYPES = (bool, Number)
+
+# A regex for checking if a template is just referencing a single var
+SINGLE_VAR = re.compile(r"^{{\s*(\w*)\s*}}$")
+
+# A regex for checking if a template ends with a filter generating a string, that should not be converted to a list/dictionary
+NO_TYPE = re.compile(r".*\|\s*(?:string|to_json|to_nice_json|to_yaml|ppretty|json)\s*(?:}})?$")
+
+# Nodes allowed when converting rendered templates to lists/dictionaries (the same allowed by ansible)
+SAFE_NODES = frozenset([ast.Add, ast.BinOp, ast.Compare, ast.Dict, ast.Div, ast.Expression, ast.List, ast.Load, ast.Mult,
+    ast.Num, ast.Name, ast.Str, ast.Sub, ast.USub, ast.Tuple, ast.UnaryOp, ast.Set])
+
+# JSON names allowed when converting rendered templates to lists/dictionaries
+JSON_TYPES = dict(false = False, null = None, true = True)
+
+class NativeFilterError(Exception):
+    ''' Class for handling errors raised by native filters and lookups. '''
+    pass
+
+def _count_newlines_from_end(value):
+    return len(value) - len(value.rstrip('\n'))
+
+def _escape_backslashes(source, environment):
+    ''' utility function for doubling backslashes in strings inside jinja2 expressions, as ansible does '''
+
+    if '\\' in source and '{{' in source:
+        tokens = []
+        in_var = False
+        for lineno, token_type, value in environment.lex(environment.preprocess(source)):
+            if token_type == 'variable_begin':
+                in_var = True
+            elif token_type == 'variable_end':
+                in_var = False
+            elif in_var and token_type == 'string':
+                value = value.replace('\\', '\\\\')
+            tokens.append(value)
+        source = ''.join(tokens)
+
+    return source
+
+def _safe_eval(value, available_variables):
+    ''' utility function for converting a rendered template that looks like a list or a dictionary, as ansible does;
+    returns the value as it is if it can't be converted '''
+
+    try:
+        tree = ast.parse(value, mode='eval')
+        for node in ast.walk(tree):
+            if type(node) not in SAFE_NODES:
+                return value
+        return eval(compile(tree, value, 'eval'), dict(JSON_TYPES), dict(available_variables))
+    except Exception:
+        return value
+
+## ansible compatible filters
+
+def _to_json(value, *args, **kwargs):
+    return json.dumps(value, *args, **kwargs)
+
+def _to_nice_json(value, indent = 4, *args, **kwargs):
+    return json.dumps(value, indent = indent, sort_keys = True, *args, **kwargs)
+
+def _to_yaml(value, *args, **kwargs):
+    return compat_text_type(yaml.safe_dump(value, allow_unicode = True, **kwargs), 'utf-8')
+
+def _to_nice_yaml(value, indent = 4, *args, **kwargs):
+    return compat_text_type(yaml.safe_dump(value, indent = indent, allow_unicode = True, default_flow_style = False, **kwargs), 'utf-8')
+
+def _from_yaml(value):
+    return yaml.safe_load(value) if isinstance(value, compat_string_types) else value
+
+def _to_bool(value):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, compat_string_types):
+        value = value.lower()
+    return value in ['yes', 'on', '1', 'true', 1]
+
+def _regex_replace(value = '', pattern = '', replacement = '', ignorecase = False):
+    return re.sub(pattern if not ignorecase else re.compile(pattern, re.I), replacement, compat_text_type(value))
+
+def _regex_findall(value, regex, multiline = False, ignorecase = False):
+    return re.findall(regex, value, (re.I if ignorecase else 0) | (re.M if multiline else 0))
+
+def _regex_search(value, regex, *args, **kwargs):
+    groups = []
+    for arg in args:
+        if arg.startswith('\\g'):
+            groups.append(re.match(r'\\g<(\S+)>', arg).group(1))
+        elif arg.startswith('\\'):
+            groups.append(int(re.match(r'\\(\d+)', arg).group(1)))
+        else:
+            raise NativeFilterError('Unknown argument')
+
+    match = re.search(regex, value, (re.I if kwargs.get('ignorecase') else 0) | (re.M if kwargs.get('multiline') else 0))
+    if match:
+        return [match.group(g) for g in groups] if groups else match.group()
+
+def _ternary(value, true_val, false_val):
+    return true_val if value else false_val
+
+def _mandatory(value):
+    if isinstance(value, Undefined):
+        raise NativeFilterError('Mandatory variable not defined.')
+    return value
+
+def _merge_hash(a, b):
+    result = a.copy()
+    for k, v in b.iteritems():
+        if k in result and isinstance(result[k], dict) and isinstance(v, dict):
+            result[k] = _merge_hash(result[k], v)
+        else:
+            result[k] = v
+    return result
+
+def _combine(*terms, **kwargs):
+    for t in terms:
+        if not isinstance(t, dict):
+            raise NativeFilterError("|combine expects dictionaries, got " + repr(t))
+    if kwargs.get('recursive', False):
+        return reduce(_merge_hash, terms)
+    return dict(itertools.chain(*[t.iteritems() for t in terms]))
+
+def _unique(a):
+    result = []
+    for x in a:
+        if x not in result:
+            result.append(x)
+    return result
+
+def _is_hashable(value):
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+def _intersect(a, b):
+    return set(a) & set(b) if _is_hashable(a) and _is_hashable(b) else _unique([x for x in a if x in b])
+
+def _difference(a, b):
+    return set(a) - set(b) if _is_hashable(a) and _is_hashable(b) else _unique([x for x in a if x not in b])
+
+def _union(a, b):
+    return set(a) | set(b) if _is_hashable(a) and _is_hashable(b) else _unique(a + b)
+
+def _symmetric_difference(a, b):
+    if _is_hashable(a) and _is_hashable(b):
+        return set(a) ^ set(b)
+    common = _intersect(a, b)
+    return _unique([x for x in _union(a, b) if x not in common])
+
+def _log(x, base = math.e):
+    return math.log10(x) if base == 10 else math.log(x, base)
+
+def _root(x, base = 2):
+    return math.sqrt(x) if base == 2 else math.pow(x, 1.0 / float(base))
+
+NATIVE_FILTERS = {
+    'b64decode': lambda value: base64.b64decode(to_str(value)),
+    'b64encode': lambda value: base64.b64encode(to_str(value)),
+    'to_json': _to_json,
+    'to_nice_json': _to_nice_json,
+    'from_json': json.loads,
+    'to_yaml': _to_yaml,
+    'to_nice_yaml': _to_nice_yaml,
+    'from_yaml': _from_yaml,
+    'basename': os.path.basename,
+    'dirname': os.path.dirname,
+    'expanduser': os.path.expanduser,
+    'realpath': os.path.realpath,
+    'splitext': os.path.splitext,
+    'bool': _to_bool,
+    'quote': quote,
+    'md5': lambda value: hashlib.md5(to_str(value)).hexdigest(),
+    'sha1': lambda value: hashlib.sha1(to_str(value)).hexdigest(),
+    'hash': lambda value, hashtype = 'sha1': hashlib.new(hashtype, to_str(value)).hexdigest(),
+    'regex_replace': _regex_replace,
+    'regex_escape': re.escape,
+    'regex_search': _regex_search,
+    'regex_findall': _regex_findall,
+    'ternary': _ternary,
+    'mandatory': _mandatory,
+    'combine': _combine,
+    'type_debug': lambda value: value.__class__.__name__,
+    'min': min,
+    'max': max,
+    'log': _log,
+    'pow': math.pow,
+    'root': _root,
+    'unique': _unique,
+    'intersect': _intersect,
+    'difference': _difference,
+    'symmetric_difference': _symmetric_difference,
+    'union': _union,
+    'zip': zip,
+    'zip_longest': itertools.izip_longest,
+    'permutations': itertools.permutations,
+    'combinations': itertools.combinations,
+    'shuffle': lambda value: random.sample(list(value), len(value)),
+}
+
+def _lookup(name, *args, **kwargs):
+    ''' ansible compatible lookup function; only env and file lookups are supported '''
+
+    if name == 'env':
+        values = [os.environ.get(arg, '') for arg in args]
+    elif name == 'file':
+        values = []
+        for arg in args:
+            with open(arg, 'rb') as f:
+                values.append(f.read().rstrip())
+    else:
+        raise NativeFilterError("lookup plugin (%s) not supported by the native templating backend" % name)
+
+    return ','.join(values) if kwargs.get('wantlist') is not True else values
+
+def _finalize(value):
+    return value if value is not None else ''
+
+class CurrentDirectoryLoader(BaseLoader):
+    '''
+    This class defines a jinja2 loader searching templates in the current directory at load time, so templates
+    are loaded from the directory of the playbook being composed (e.g. when a long-lived process composes playbooks
+    of different projects); templates loaded from another directory are never up to date, so the jinja2 template
+    cache does not return them.
+    '''
+
+    def get_source(self, environment, template):
+        cwd = os.getcwd()
+        source, filename, uptodate = FileSystemLoader(cwd).get_source(environment, template)
+        return source, filename, lambda: os.getcwd() == cwd and uptodate()
+
+    def list_templates(self):
+        return FileSystemLoader(os.getcwd()).list_templates()
+
+class NativeBackend(TemplatingBackend):
+    '''
+    This class defines a templating backend built directly on jinja2, without dependencies from ansible.
+    All the native backends share the same jinja2 environment, with filters compatible with the ansible ones
+    most used in value generators; templates are rendered following the same rules of the ansible templar.
+    '''
+
+    name = 'native'
+
+    # The jinja2 environment shared by all the native backends
+    _shared_environment = None
+
+    @property
+    def version(self):
+        return 'jinja2-%s' % jinja2.__version__
+
+    @property
+    def environment(self):
+        if NativeBackend._shared_environment is None:
+            environment = Environment(
+                trim_blocks = True,
+                undefined = StrictUndefined,
+                finalize = _finalize,
+                loader = CurrentDirectoryLoader()
+            )
+            environment.filters.update(NATIVE_FILTERS)
+            environment.globals['lookup'] = _lookup
+            NativeBackend._shared_environment = environment
+
+        return NativeBackend._shared_environment
+
+    def compile(self, source):
+        environment = self.environment
+        return environment.from_string(_escape_backslashes(source, environment))
+
+    def render(self, template, source, available_variables):
+        # if the template is just referencing a single var, the var is returned without changing its type
+        only_one = SINGLE_VAR.match(source)
+        if only_one and only_one.group(1) in available_variables:
+            resolved_val = available_variables[only_one.group(1)]
+            if isinstance(resolved_val, NON_TEMPLATED_TYPES):
+                return resolved_val
+            elif resolved_val is None:
+                return None
+
+        result = j2_concat(template.root_render_func(template.new_context(available_variables)))
+
+        # preserves the number of newlines at the end of the template string
+        source_newlines = _count_newlines_from_end(source)
+        result_newlines = _count_newlines_from_end(result)
+        if source_newlines > result_newlines:
+            result += '\n' * (source_newlines - result_newlines)
+
+        # if the result looks like a dictionary or a list, converts it to such
+        if not NO_TYPE.match(source):
+            if (result.startswith("{") and not result.startswith("{{")) or result.startswith("[") or result in ("True", "False"):
+                result = _safe_eval(result, available_variables)
+
+        return result
@@ -5,17 +5,17 @@ __metaclass__ = type
 import json
 from unittest import TestCase
 
-from vagrantplaybook.ansible import ansible_loader
-
-from vagrantplaybook.compose.cluster import Cluster
+from vagrantplaybook.errors import ValueGeneratorError, HostVarGeneratorError
+from vagrantplaybook.compose.cluster import Cluster, get_host_vars_plan, parse_selection
+from vagrantplaybook.compose.parallel import ComposePool
+from vagrantplaybook.compose.state import ComposeState
 
 setup_done = False
 
 class TestCluster(TestCase):
 
     def setUp(self):
-        dataloader = ansible_loader()
-        self.myCluster = Cluster("myCluster", loader = dataloader)
+        self.myCluster = Cluster("myCluster")
         self.myCluster.node_prefix = "myCluster"
 
         g1 = self.myCluster.add_node_group("nodegroup_1", 1)
@@ -181,6 +181,28 @@ class TestCluster(TestCase):
         self.assertEqual(group_vars["ansiblegroup_B"]["var2"], "3")
         self.assertEqual(group_vars["ansiblegroup_B"]["var3"], "literal")
 
+    def test_get_ansible_group_vars_batched(self):
+        '''all the vars of an ansible group are rendered with the same variables'''
+
+        self.myCluster.ansible_group_vars = {
+            "ansiblegroup_B" : {
+                "var1" : "{{ nodes | count }}",
+                "var2" : "{{ context.var0 }}-{{ nodes | count }}",
+                "var3" : "{{ context.var0 }}"
+            }
+        }
+
+        # records the variables each template is rendered with
+        rendered = []
+        template = self.myCluster._template_cache.template
+        self.myCluster._template_cache.template = lambda generator, available_variables: rendered.append(available_variables) or template(generator, available_variables)
+
+        group_vars = self.myCluster._get_ansible_group_vars(self.extended_ansible_groups, {"var0": "x"})
+
+        self.assertEqual(group_vars["ansiblegroup_B"], {"var1": "3", "var2": "x-3", "var3": "x"})
+        self.assertEqual(len(rendered), 3)
+        self.assertEqual(len(set(id(available_variables) for available_variables in rendered)), 1)
+
 
     def test_get_ansible_host_vars(self):
         '''_get_ansible_host_vars computes host vars'''
@@ -210,6 +232,28 @@ class TestCluster(TestCase):
         self.assertEqual(len(host_vars["myCluster-nodegroup_22"]), 1)
         self.assertEqual(host_vars["myCluster-nodegroup_22"]["var2"], "172.31.1.102")
 
+    def test_get_ansible_host_vars_precedence(self):
+        '''host vars defined for more than one group are generated by the last group of the node'''
+
+        # defines the same var for both groups of nodegroup_1; the generator of ansiblegroup_A is never evaluated
+        self.myCluster.ansible_host_vars = {
+            "ansiblegroup_A" : {
+                "var1" : "{{ undefined_var }}",
+                "var2" : "A"
+            },
+            "ansiblegroup_B" : {
+                "var1" : "{{ node.ip }}"
+            }
+        }
+
+        plan = get_host_vars_plan(self.myCluster._template_cache, ["ansiblegroup_A", "ansiblegroup_B"], self.myCluster._ansible_host_vars_generators)
+        self.assertEqual([(var_name, ansible_group) for var_name, var_generator, ansible_group in plan], [("var1", "ansiblegroup_B"), ("var2", "ansiblegroup_A")])
+
+        host_vars = self.myCluster._get_ansible_host_vars(self.nodes, {})
+
+        self.assertEqual(host_vars["myCluster-nodegroup_11"], {"var1": "172.31.0.101", "var2": "A"})
+        self.assertEqual(host_vars["myCluster-nodegroup_21"], {"var1": "172.31.1.101"})
+
     def test_execute(self):
         '''compose generate the cluster'''
 
@@ -242,3 +286,142 @@ class TestCluster(TestCase):
         self.assertEqual(len(ansible_group_vars), 2)
         # assert expected ansible_host_vars are available
         self.assertEqual(len(ansible_host_vars), 3) # one for each node
+
+    def test_compose_parallel(self):
+        '''compose with a pool of worker processes generate the same nodes of a serial compose'''
+
+        self.myCluster.add_node_group("nodegroup_3", 7).ansible_groups = ["ansiblegroup_C"]
+
+        serial = self.myCluster.compose()
+        parallel = self.myCluster.compose(jobs = 2)
+
+        self.assertEqual([n.values() for n in parallel[0]], [n.values() for n in serial[0]])
+        self.assertEqual(parallel[1:], serial[1:])
+
+        # errors in worker processes are raised
+        self.myCluster._node_groups["nodegroup_3"].ip = "{{ unknown_var }}"
+        self.assertRaises(ValueGeneratorError, self.myCluster.compose, jobs = 2)
+
+    def test_parse_selection(self):
+        '''selections are parsed into (nodegroup, start, stop) tuples'''
+
+        self.assertEqual(parse_selection("nodegroup_1"), [("nodegroup_1", None, None)])
+        self.assertEqual(parse_selection(["nodegroup_1[0:2], nodegroup_2[1]", "nodegroup_2[-1]"]),
+            [("nodegroup_1", 0, 2), ("nodegroup_2", 1, 2), ("nodegroup_2", -1, None)])
+        self.assertEqual(parse_selection("nodegroup_2[1:]"), [("nodegroup_2", 1, None)])
+        self.assertRaises(ValueError, parse_selection, "nodegroup_1[0")
+        self.assertRaises(ValueError, parse_selection, " , ")
+
+    def test_compose_selection(self):
+        '''compose with a selection generates only the selected nodes, with the same values of a full compose'''
+
+        self.myCluster.add_node_group("nodegroup_3", 7).ansible_groups = ["ansiblegroup_C"]
+        self.myCluster.ansible_group_vars = { "ansiblegroup_B" : { "var1" : "{{ nodes | count }}" } }
+        self.myCluster.ansible_host_vars = { "ansiblegroup_B" : { "var2" : "{{ node.ip }}" }, "ansiblegroup_C" : { "var3" : "{{ node.index }}" } }
+
+        full = self.myCluster.compose()
+        full_nodes = dict((n.hostname, n.values()) for n in full[0])
+
+        nodes, inventory, ansible_group_vars, ansible_host_vars = self.myCluster.compose(selection = parse_selection("nodegroup_3[2:4],nodegroup_3[3:5],nodegroup_2[-1]"))
+        self.assertEqual(sorted(n.hostname for n in nodes), ["myCluster-nodegroup_22", "myCluster-nodegroup_33", "myCluster-nodegroup_34", "myCluster-nodegroup_35"])
+        for node in nodes:
+            self.assertEqual(node.values(), full_nodes[node.hostname])
+            self.assertEqual(ansible_host_vars[node.hostname], full[3][node.hostname])
+
+        # group vars depend on all the nodes in the group, so they are the same of a full compose
+        self.assertEqual(ansible_group_vars, {"ansiblegroup_B": full[2]["ansiblegroup_B"]})
+        self.assertEqual(sorted(inventory), ["ansiblegroup_B", "ansiblegroup_C"])
+        self.assertEqual(len(inventory["ansiblegroup_C"]), 3)
+
+        # nodegroups must exist, and indexes/slices should select at least a node
+        self.assertRaises(ValueError, self.myCluster.compose, selection = parse_selection("unknown"))
+        for selection in ["nodegroup_2[5]", "nodegroup_2[-3]", "nodegroup_2[2:]", "nodegroup_3[4:2]"]:
+            with self.assertRaises(ValueError) as context:
+                self.myCluster.compose(selection = parse_selection(selection))
+            self.assertIn("with %i instances" % self.myCluster._node_groups[selection.split("[")[0]].instances, context.exception.message)
+
+    def test_compose_selection_independent(self):
+        '''compose with a selection does not compose other nodes, if vars of the selected nodes do not depend on them'''
+
+        self.myCluster.ansible_context_vars = { "ansiblegroup_A" : { "var0" : "{{ nodes | count }}" } }
+        self.myCluster.ansible_host_vars = { "ansiblegroup_B" : { "var2" : "{{ node.ip }}" } }
+
+        # a value generator that fails for nodes not selected
+        self.myCluster._node_groups["nodegroup_2"].ip = "{% if node_index == 0 %}{{ unknown_var }}{% endif %}172.31.1.{{ 101 + node_index }}"
+        self.assertRaises(ValueGeneratorError, self.myCluster.compose)
+
+        nodes, inventory, ansible_group_vars, ansible_host_vars = self.myCluster.compose(selection = parse_selection("nodegroup_2[1]"))
+        self.assertEqual([n.hostname for n in nodes], ["myCluster-nodegroup_22"])
+        self.assertEqual(ansible_host_vars, {"myCluster-nodegroup_22": {"var2": "172.31.1.102"}})
+
+        # when host vars reference context vars, all the nodes are composed
+        self.myCluster.ansible_host_vars = { "ansiblegroup_B" : { "var2" : "{{ context.var0 }}" } }
+        self.assertRaises(ValueGeneratorError, self.myCluster.compose, selection = parse_selection("nodegroup_2[1]"))
+
+    def test_compose_incremental(self):
+        '''compose with the state of the last compose recomputes only the slices affected by changes'''
+
+        self.myCluster.ansible_context_vars = { "ansiblegroup_A" : { "var0" : "{{ nodes | count }}" } }
+        self.myCluster.ansible_group_vars = { "ansiblegroup_B" : { "var1" : "{{ nodes | map(attribute='memory') | list }}" } }
+        self.myCluster.ansible_host_vars = { "ansiblegroup_B" : { "var2" : "{{ node.memory }}-{{ context.var0 }}" } }
+
+        state = ComposeState()
+        first = self.myCluster.compose(state = state)
+        self.assertEqual(sorted(state.recomputed['node_groups']), ['nodegroup_1', 'nodegroup_2'])
+
+        # nothing changed
+        second = self.myCluster.compose(state = state)
+        self.assertEqual([n.values() for n in second[0]], [n.values() for n in first[0]])
+        self.assertEqual(second[2:], first[2:])
+        for stage in ComposeState.STAGES:
+            self.assertEqual(state.recomputed[stage], [])
+
+        # a nodegroup changed: only the nodegroup, vars of its ansible groups and its host vars are recomputed
+        self.myCluster._node_groups["nodegroup_2"].memory = 512
+        third = self.myCluster.compose(state = state)
+        self.assertEqual(state.recomputed['node_groups'], ['nodegroup_2'])
+        self.assertEqual(state.recomputed['context_vars'], [])
+        self.assertEqual(state.recomputed['group_vars'], ['ansiblegroup_B'])
+        self.assertEqual(state.recomputed['host_vars'], ['nodegroup_2'])
+
+        expected = self.myCluster.compose()
+        self.assertEqual([n.values() for n in third[0]], [n.values() for n in expected[0]])
+        self.assertEqual(third[2:], expected[2:])
+        self.assertEqual(third[3]["myCluster-nodegroup_21"]["var2"], "512-1")
+
+        # the ansible groups of a nodegroup changed: context vars are recomputed, and so all the vars referencing them
+        self.myCluster._node_groups["nodegroup_2"].ansible_groups = ["ansiblegroup_A", "ansiblegroup_B"]
+        fourth = self.myCluster.compose(jobs = 2, state = state)
+        self.assertEqual(state.recomputed['context_vars'], ['ansiblegroup_A'])
+        self.assertEqual(sorted(state.recomputed['host_vars']), ['nodegroup_1', 'nodegroup_2'])
+        self.assertEqual(fourth[3], self.myCluster.compose()[3])
+
+        # volatile value generators are always recomputed
+        self.myCluster._node_groups["nodegroup_1"].cpus = "{{ [1, 2] | random }}"
+        self.myCluster.compose(state = state)
+        self.myCluster.compose(state = state)
+        self.assertEqual(state.recomputed['node_groups'], ['nodegroup_1'])
+
+    def test_get_ansible_host_vars_parallel(self):
+        '''_get_ansible_host_vars with a pool of worker processes computes the same host vars'''
+
+        self.myCluster.ansible_host_vars = {
+            "ansiblegroup_A" : {
+                "var1" : "{{ node.hostname }}"
+            },
+            "ansiblegroup_B" : {
+                "var2" : "{{ node.ip }}",
+                "var3" : "{{ context.var0 }}"
+            }
+        }
+
+        pool = ComposePool(2)
+        try:
+            self.assertEqual(self.myCluster._get_ansible_host_vars(self.nodes, dict(var0 = "x"), pool), self.myCluster._get_ansible_host_vars(self.nodes, dict(var0 = "x")))
+
+            # errors in worker processes are raised with the right hostname
+            with self.assertRaises(HostVarGeneratorError) as cm:
+                self.myCluster._get_ansible_host_vars(self.nodes, dict(), pool)
+            self.assertIn('"var3"', str(cm.exception))
+        finally:
+            pool.terminate()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from unittest import TestCase
+
+from vagrantplaybook.compose.templatecache import TemplateCache
+from vagrantplaybook.compose.generator import ValueGenerator, is_literal, copy_literal
+from vagrantplaybook.templating.ansible import AnsibleBackend
+
+class TestValueGenerator(TestCase):
+
+    def setUp(self):
+        self.templates = TemplateCache(AnsibleBackend())
+
+    def test_is_literal(self):
+        self.assertTrue(is_literal(1))
+        self.assertTrue(is_literal("fp/centos7"))
+        self.assertTrue(is_literal(["a1", "a2"]))
+        self.assertTrue(is_literal({"a": ["b", {"c": 1}]}))
+
+        self.assertFalse(is_literal("{{ node_index }}"))
+        self.assertFalse(is_literal(["a1", "{% if a %}a{% endif %}"]))
+        self.assertFalse(is_literal({"a": ["b", {"c": "{{ group_name }}"}]}))
+
+    def test_copy_literal(self):
+        value = {"a": ["b", {"c": 1}]}
+        copy = copy_literal(value)
+
+        self.assertEqual(copy, value)
+        self.assertIsNot(copy, value)
+        self.assertIsNot(copy["a"], value["a"])
+        self.assertIsNot(copy["a"][1], value["a"][1])
+
+    def test_generate(self):
+        # literals are copied without using the template engine
+        generator = ValueGenerator(["a1", {"b": u"c"}])
+        self.assertTrue(generator.literal)
+
+        value = generator.generate(self.templates, dict())
+        self.assertEqual(value, ["a1", {"b": "c"}])
+        self.assertIsNot(value, generator.source)
+        self.assertEqual(len(self.templates), 0)
+
+        # templates are rendered
+        generator = ValueGenerator(["a1", "{{ group_name }}"])
+        self.assertFalse(generator.literal)
+
+        self.assertEqual(generator.generate(self.templates, dict(group_name="mygroup")), ["a1", "mygroup"])
+        self.assertEqual(len(self.templates), 1)
@@ -6,10 +6,11 @@ from nose import tools
 from unittest import TestCase
 
 from vagrantplaybook.compat import compat_integer_types
-from vagrantplaybook.ansible import ansible_loader, ansible_tempar
+from vagrantplaybook.templating.ansible import AnsibleBackend
 
-from vagrantplaybook.errors import ValueGeneratorError, ValueGeneratorTypeError
+from vagrantplaybook.errors import ValueGeneratorError, ValueGeneratorTypeError, ValueGeneratorCycleError
 from vagrantplaybook.compose.nodegroup import NodeGroup
+from vagrantplaybook.compose.templatecache import TemplateCache
 
 class TestNodeGroup(TestCase):
 
@@ -31,9 +32,8 @@ class TestNodeGroup(TestCase):
             attributes = {}
         )
 
-        #creates the ansible templar
-        dataloader = ansible_loader()
-        self.templar = ansible_tempar(dataloader)
+        #creates the ansible templating backend (and the cache of compiled templates)
+        self.templar = TemplateCache(AnsibleBackend())
 
     def test_attributes_validation(self):
         #TODO: test validation
@@ -112,3 +112,56 @@ class TestNodeGroup(TestCase):
         self.assertEqual(nodes[2].attributes, {})
         self.assertEqual(nodes[2].index, 12)
         self.assertEqual(nodes[2].group_index, 2)
+
+    def test_plan(self):
+        # plan sorts attributes in dependency order (ties are resolved using NodeGroup.GENERATORS order)
+        self.ng.box = "{{ hostname }}-box"
+        self.ng.hostname = "{{ cluster_name }}{{ ip }}"
+
+        plan = [var for var, invariant in self.ng.plan(self.templar)]
+        self.assertEqual(plan, ['boxname', 'aliases', 'fqdn', 'ip', 'hostname', 'box', 'cpus', 'memory', 'ansible_groups', 'attributes'])
+
+        # plan skips attributes not emitted and not referenced by emitted attributes
+        plan = [var for var, invariant in self.ng.plan(self.templar, emit = ['box'])]
+        self.assertEqual(plan, ['ip', 'hostname', 'box'])
+
+        # plan raise errors on circular references
+        self.ng.ip = "{{ box }}"
+        self.assertRaises(ValueGeneratorCycleError, self.ng.plan, self.templar)
+
+        self.ng.ip = "{{ ip }}"
+        self.assertRaises(ValueGeneratorCycleError, self.ng.plan, self.templar)
+
+    def test_plan_invariants(self):
+        # only templates that do not depend on node variables (directly or through other attributes) are invariant
+        self.ng.box = "{{ cluster_name }}/box"
+        self.ng.hostname = "{{ boxname }}"
+        self.ng.memory = "{{ 128 * 2 }}"
+        self.ng.ansible_groups = ["{{ group_name }}"]
+        self.ng.attributes = {"r": "{{ 100 | random }}"}
+
+        invariants = set(var for var, invariant in self.ng.plan(self.templar) if invariant)
+        self.assertEqual(invariants, set(['box', 'memory', 'ansible_groups']))
+
+    def test_compose_dependencies(self):
+        # attributes can reference attributes generated later in NodeGroup.GENERATORS order
+        self.ng.boxname = "{{ hostname }}"
+        self.ng.hostname = "host{{ node_index }}"
+
+        nodes = list(self.ng.compose(self.templar, "mycluster", "myprefix", "mydomain", 10))
+        self.assertEqual([n.boxname for n in nodes], ["host0", "host1", "host2"])
+
+        # attributes not emitted are not generated
+        nodes = list(self.ng.compose(self.templar, "mycluster", "myprefix", "mydomain", 10, emit = ['boxname']))
+        self.assertEqual([n.boxname for n in nodes], ["host0", "host1", "host2"])
+        self.assertEqual([n.ip for n in nodes], [None, None, None])
+
+    def test_compose_invariants(self):
+        self.ng.ansible_groups = ["{{ group_name }}", "{{ cluster_name }}"]
+
+        nodes = list(self.ng.compose(self.templar, "mycluster", "myprefix", "mydomain", 10))
+
+        # invariant values are generated once, and copied in each node
+        self.assertEqual([n.ansible_groups for n in nodes], [["mygroup", "mycluster"]] * 3)
+        self.assertIsNot(nodes[0].ansible_groups, nodes[1].ansible_groups)
+        self.assertEqual(self.templar.misses + self.templar.hits, 3 * 4 + 2)
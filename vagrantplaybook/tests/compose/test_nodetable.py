@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import cPickle
+from unittest import TestCase
+
+from vagrantplaybook.compose.node import Node
+from vagrantplaybook.compose.nodetable import NodeTable, NodeRow
+
+class TestNodeTable(TestCase):
+
+    def setUp(self):
+        self.nodes = [Node(
+            box = "my" + "box",
+            boxname = "node%i" % i,
+            hostname = "node%i" % i,
+            fqdn = "node%i.vagrant" % i,
+            aliases = ["a%i" % i],
+            ip = "172.31.0.%i" % (100 + i),
+            cpus = 1,
+            memory = 256 * i,
+            ansible_groups = ["group" + "_A"],
+            attributes = {"k": i},
+            index = i,
+            group_index = i
+        ) for i in range(5)]
+
+        self.table = NodeTable(self.nodes)
+
+    def test_node(self):
+        # nodes are slotted
+        self.assertFalse(hasattr(self.nodes[0], '__dict__'))
+        self.assertEqual(cPickle.loads(cPickle.dumps(self.nodes[0], 0)).values(), self.nodes[0].values())
+
+    def test_rows(self):
+        # rows expose the same attributes of nodes
+        self.assertEqual(len(self.table), 5)
+        for node, row in zip(self.nodes, self.table):
+            self.assertIsInstance(row, NodeRow)
+            self.assertEqual(row.values(), node.values())
+            self.assertEqual(row.hostname, node.hostname)
+            self.assertEqual(row['hostname'], node.hostname)
+            self.assertEqual(row, node)
+
+        self.assertEqual(self.table[-1].index, 4)
+        self.assertRaises(IndexError, self.table.__getitem__, 5)
+        self.assertRaises(KeyError, self.table[0].__getitem__, 'unknown')
+        self.assertRaises(AttributeError, getattr, self.table[0], 'unknown')
+
+    def test_rows_hash(self):
+        # rows that compare equal have the same hash, so they can be used in sets and as keys
+        rows = list(self.table) + list(self.table)
+        self.assertEqual(hash(rows[0]), hash(self.table[0]))
+        self.assertEqual(len(set(rows)), 5)
+        self.assertEqual(len(dict.fromkeys(self.table[1:3])), 2)
+
+    def test_columns(self):
+        # integer values are stored in typed arrays; other values in lists
+        self.assertEqual(self.table.column('memory').typecode, 'l')
+        self.assertEqual(list(self.table.column('memory')), [0, 256, 512, 768, 1024])
+
+        self.table.append(Node(None, "n", "n", None, None, None, None, None, [], {}, 5, 5))
+        self.assertEqual(self.table.column('memory')[5], None)
+        self.assertEqual(self.table[4].memory, 1024)
+
+    def test_interned(self):
+        # repeated values are shared by all the nodes
+        boxes = self.table.column('box')
+        self.assertEqual(len(set(id(box) for box in boxes)), 1)
+        groups = [row.ansible_groups[0] for row in self.table]
+        self.assertEqual(len(set(id(group) for group in groups)), 1)
+
+    def test_slice(self):
+        # slices are tables, that can be pickled
+        chunk = cPickle.loads(cPickle.dumps(self.table[1:3], 2))
+
+        self.assertIsInstance(chunk, NodeTable)
+        self.assertEqual([row.values() for row in chunk], [node.values() for node in self.nodes[1:3]])
+
+        chunk.extend(self.table[3:])
+        self.assertEqual(len(chunk), 4)
+        self.assertEqual(len(set(id(box) for box in chunk.column('box'))), 1)
+
+    def test_extend(self):
+        # tables are merged column by column, converting typed arrays to lists if required
+        table = NodeTable([Node(None, "n", "n", None, None, None, None, None, [], {}, 5, 5)])
+        table.extend(self.table)
+        self.assertEqual([row.values() for row in table][1:], [node.values() for node in self.nodes])
+        self.assertEqual(list(table.column('memory')), [None, 0, 256, 512, 768, 1024])
+
+        self.table.extend(table[:1])
+        self.assertEqual(self.table[5].memory, None)
+        self.assertEqual(self.table[4].memory, 1024)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import vagrantplaybook
+from vagrantplaybook.compose.state import ComposeState, fingerprint
+
+class TestComposeState(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.state = ComposeState()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint('a', [1, 2], {'k': 'v'}), fingerprint('a', [1, 2], {'k': 'v'}))
+        self.assertNotEqual(fingerprint('a', [1, 2]), fingerprint('a', [2, 1]))
+        self.assertNotEqual(fingerprint('1'), fingerprint(1))
+
+    def test_get_put(self):
+        # results are reused only if the fingerprint did not change
+        self.state.begin()
+        self.assertIsNone(self.state.get('node_groups', 'master', 'f1'))
+        self.state.put('node_groups', 'master', 'f1', 'nodes1')
+        self.state.put('node_groups', 'slave', 'f2', 'nodes2')
+        self.state.put('group_vars', 'all', None, 'vars')
+        self.state.end()
+        self.assertEqual(self.state.recomputed['node_groups'], ['master', 'slave'])
+
+        self.state.begin()
+        self.assertEqual(self.state.get('node_groups', 'master', 'f1'), 'nodes1')
+        self.assertIsNone(self.state.get('node_groups', 'slave', 'f3'))
+        self.state.put('node_groups', 'slave', 'f3', 'nodes3')
+
+        # results without fingerprint are never reused
+        self.assertIsNone(self.state.get('group_vars', 'all', None))
+        self.state.put('group_vars', 'all', None, 'vars')
+        self.state.end()
+
+        self.assertEqual(self.state.reused['node_groups'], ['master'])
+        self.assertEqual(self.state.recomputed['node_groups'], ['slave'])
+
+        report = self.state.report()
+        self.assertIn('node groups    1/2 recomputed: slave', report)
+        self.assertIn('group vars     1/1 recomputed: all', report)
+
+        # results not reused by the last compose are dropped
+        self.state.begin()
+        self.assertIsNone(self.state.get('node_groups', 'slave', 'f2'))
+
+    def test_load_save(self):
+        path = os.path.join(self.path, '.vagrant', 'playbook-state')
+
+        # a new state is created if there is no stored state
+        self.assertIsInstance(ComposeState.load(path), ComposeState)
+
+        self.state.begin()
+        self.state.put('host_vars', 'master', 'f1', [('host1', {'var': 1})])
+        self.state.end()
+        self.state.save(path)
+
+        state = ComposeState.load(path)
+        state.begin()
+        self.assertEqual(state.get('host_vars', 'master', 'f1'), [('host1', {'var': 1})])
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['playbook-state'])
+
+        # states stored by other versions, or that can't be read are discarded
+        self.state.version = '0.0.0'
+        self.state.save(path)
+        state = ComposeState.load(path)
+        self.assertEqual(state.version, vagrantplaybook.__version__)
+        state.begin()
+        self.assertIsNone(state.get('host_vars', 'master', 'f1'))
+
+        with open(path, 'wb') as f:
+            f.write('invalid')
+        self.assertIsInstance(ComposeState.load(path), ComposeState)
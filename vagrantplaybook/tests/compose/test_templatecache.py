@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from vagrantplaybook.compose.templatecache import TemplateCache, contains_template
+from vagrantplaybook.templating.ansible import AnsibleBackend
+from vagrantplaybook.templating.native import NativeBackend
+
+class TestTemplateCache(TestCase):
+
+    def setUp(self):
+        self.backend = AnsibleBackend()
+        self.templar = self.backend.templar
+        self.templates = TemplateCache(self.backend)
+        self.native_templates = TemplateCache(NativeBackend())
+
+    def _ansible_template(self, generator, available_variables):
+        self.templar.set_available_variables(available_variables)
+        return self.templar.template(generator)
+
+    def test_contains_template(self):
+        self.assertTrue(contains_template("{{ a }}"))
+        self.assertTrue(contains_template("{% if a %}a{% endif %}"))
+        self.assertTrue(contains_template("{# comment #}"))
+        self.assertFalse(contains_template("literal"))
+        self.assertFalse(contains_template(1))
+        self.assertFalse(contains_template(["{{ a }}"]))
+
+    def test_template(self):
+        # template generates the same values generated by the ansible templar
+        generators = [
+            (1, dict()),
+            ("s", dict()),
+            ([], dict()),
+            ({}, dict()),
+            ("{{group_index}}", dict(group_index=1)),
+            ("{{group_name}}{{node_index + 1}}", dict(group_name="mygroup", node_index=0)),
+            ("{{ 1024 + 256 }}", dict()),
+            ("{{ [a, a] }}", dict(a=1)),
+            ("{{ nodes | count }}", dict(nodes=[1, 2, 3])),
+            (["{{a}}", "b", {"c": "{{a}}-c"}], dict(a="x")),
+            ("{{ a | regex_replace('^(.*)$', '\\\\1!') }}", dict(a="x")),
+            ("{{ a }}\n\n", dict(a="x")),
+        ]
+
+        for generator, available_variables in generators:
+            self.assertEqual(self.templates.template(generator, available_variables), self._ansible_template(generator, available_variables))
+
+    def test_template_public(self):
+        # without internals of the ansible templar, templates are rendered by Templar.template
+        backend = AnsibleBackend(use_internals = False)
+        self.assertFalse(backend.use_internals)
+        self.assertTrue(self.backend.use_internals)
+
+        templates = TemplateCache(backend)
+        generators = [
+            ("{{group_name}}{{node_index + 1}}", dict(group_name="mygroup", node_index=0)),
+            ("{{ [a, a] }}", dict(a=1)),
+            ("{{ nodes | count }}", dict(nodes=[1, 2, 3])),
+            ("{{ a | regex_replace('^(.*)$', '\\\\1!') }}", dict(a="x")),
+            ("{{ a }}\n\n", dict(a="x")),
+        ]
+
+        for generator, available_variables in generators:
+            self.assertEqual(templates.template(generator, available_variables), self.templates.template(generator, available_variables))
+
+        self.assertEqual(templates.analyze("{{ a + b }}"), self.templates.analyze("{{ a + b }}"))
+
+    def test_template_native_current_directory(self):
+        # the native backend loads included templates from the current directory at render time
+        cwd = os.getcwd()
+        path = tempfile.mkdtemp()
+        try:
+            for project in ('a', 'b'):
+                os.makedirs(os.path.join(path, project, 'inc'))
+                with open(os.path.join(path, project, 'inc', 'part.j2'), 'wb') as f:
+                    f.write(project)
+                # the same mtime, so a template loaded from the other project would look up to date
+                os.utime(os.path.join(path, project, 'inc', 'part.j2'), (1000000000, 1000000000))
+
+            for project in ('a', 'b', 'a'):
+                os.chdir(os.path.join(path, project))
+                self.assertEqual(TemplateCache(NativeBackend()).template("{% include 'inc/part.j2' %}", dict()), project)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(path)
+
+    def test_template_native(self):
+        # the native backend generates the same values generated by the ansible templar
+        generators = [
+            (1, dict()),
+            ("s", dict()),
+            (["{{a}}", "b", {"c": "{{a}}-c"}], dict(a="x")),
+            ("{{group_index}}", dict(group_index=1)),
+            ("{{ a }}", dict(a=None)),
+            ("{{group_name}}{{node_index + 1}}", dict(group_name="mygroup", node_index=0)),
+            ("{% if cluster_node_prefix %}{{cluster_node_prefix}}-{% endif %}{{group_name}}", dict(cluster_node_prefix="", group_name="g")),
+            ("{{ 1024 + 256 }}", dict()),
+            ("{{ [a, a] }}", dict(a=1)),
+            ("{{ {'k': a} }}", dict(a="v")),
+            ("{{ a is defined }}", dict(a=1)),
+            ("{{ nodes | count }}", dict(nodes=[1, 2, 3])),
+            ("{{ a | regex_replace('^(.*)$', '\\\\1!') }}", dict(a="x")),
+            ("{{ a | to_json }}", dict(a=dict(b=[1, 2]))),
+            ("{{ a | to_nice_yaml }}", dict(a=dict(b=[1, 2]))),
+            ("{{ a | combine(b) }}", dict(a=dict(x=1), b=dict(y=2))),
+            ("{{ a | union(b) | unique | list }}", dict(a=[1, 2], b=[2, 3])),
+            ("{{ a | bool | ternary('y', 'n') }}", dict(a="yes")),
+            ("{{ a | basename }}", dict(a="/a/b.txt")),
+            ("{{ a | b64encode | b64decode }}", dict(a="x")),
+            ("{{ a }}\n\n", dict(a="x")),
+        ]
+
+        for generator, available_variables in generators:
+            self.assertEqual(self.native_templates.template(generator, available_variables), self._ansible_template(generator, available_variables))
+
+        # undefined variables, syntax errors and unsupported lookups are raised
+        self.assertRaises(Exception, self.native_templates.template, "{{unknown_var}}", dict())
+        self.assertRaises(Exception, self.native_templates.template, "{{ a", dict(a=1))
+        self.assertRaises(Exception, self.native_templates.template, "{{ lookup('pipe', 'date') }}", dict())
+
+    def test_cache(self):
+        # each distinct generator is compiled once
+        for i in range(3):
+            self.assertEqual(self.templates.template("{{ node_index + 1 }}", dict(node_index=i)), "%i" % (i + 1))
+            self.templates.template(["{{ node_index }}", "literal"], dict(node_index=i))
+
+        self.assertEqual(self.templates.misses, 2)
+        self.assertEqual(self.templates.hits, 4)
+        self.assertEqual(len(self.templates), 2)
+
+        # literals are never compiled
+        self.templates.template("literal", dict())
+        self.assertEqual(len(self.templates), 2)
+
+        self.templates.clear()
+        self.assertEqual(len(self.templates), 0)
+        self.assertEqual(self.templates.hits, 0)
+        self.assertEqual(self.templates.misses, 0)
+
+    def test_errors(self):
+        # undefined variables and syntax errors are raised
+        self.assertRaises(Exception, self.templates.template, "{{unknown_var}}", dict())
+        self.assertRaises(Exception, self.templates.template, "{{ a", dict(a=1))
+
+    def test_analyze(self):
+        # analyze gets referenced variables
+        self.assertEqual(self.templates.analyze("{{ a + b.c }}{% for x in d %}{{ x }}{% endfor %}"), (frozenset(['a', 'b', 'd']), False))
+
+        # analyze detects volatile templates
+        self.assertEqual(self.templates.analyze("{{ a | random }}"), (frozenset(['a']), True))
+        self.assertEqual(self.templates.analyze("{{ lookup('pipe', 'date') }}"), (frozenset(), True))
+
+        # templates with errors are volatile
+        self.assertEqual(self.templates.analyze("{{ a"), (frozenset(), True))
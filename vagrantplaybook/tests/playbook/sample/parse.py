@@ -28,3 +28,11 @@ mesos:
     zookeeper:
         instances: 3
 '''
+
+sample_execute_nodegroup_with_cycle = '''
+---
+mesos:
+    zookeeper:
+        boxname: "{{ hostname }}"
+        hostname: "{{ boxname }}"
+'''
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+
+from vagrantplaybook.playbook.cache import ComposeCache
+from vagrantplaybook.playbook.executor import Executor
+
+class TestComposeCache(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = ComposeCache(os.path.join(self.path, 'cache'), max_size = 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_key(self):
+        # keys depend on the playbook and on all the given parts
+        key = self.cache.key('mycluster: {}', 'ansible-2.3')
+        self.assertEqual(key, self.cache.key('mycluster: {}', 'ansible-2.3'))
+        self.assertNotEqual(key, self.cache.key('mycluster: {x: 1}', 'ansible-2.3'))
+        self.assertNotEqual(key, self.cache.key('mycluster: {}', 'jinja2-2.10'))
+
+        # volatile playbooks and lookups other than files/environment variables can't be cached
+        self.assertIsNone(self.cache.key("ip: '{{ [1, 2] | random }}'"))
+        self.assertIsNone(self.cache.key("ip: \"{{ lookup('pipe', 'date') }}\""))
+        self.assertIsNone(self.cache.key("ip: \"{{ lookup('env', var) }}\""))
+        self.assertIsNone(self.cache.key("ip: \"{{ lookup('env', 'VAGRANTPLAYBOOK_TEST_IP', var) }}\""))
+
+        # playbooks loading other templates can't be cached
+        self.assertIsNone(self.cache.key("ip: \"{% include 'ip.j2' %}\""))
+        self.assertIsNone(self.cache.key("ip: \"{%- from 'ips.j2' import ip %}{{ ip }}\""))
+
+    def test_key_lookups(self):
+        # keys depend on the content of looked up files and on looked up environment variables
+        path = os.path.join(self.path, 'ip.txt')
+        playbook = "ip: \"{{ lookup('file', '%s') }}\"" % path
+
+        with open(path, 'wb') as f:
+            f.write('172.31.0.1')
+        key = self.cache.key(playbook)
+        self.assertEqual(key, self.cache.key(playbook))
+
+        with open(path, 'wb') as f:
+            f.write('172.31.0.2')
+        self.assertNotEqual(key, self.cache.key(playbook))
+
+        playbook = "ip: \"{{ lookup('env', 'VAGRANTPLAYBOOK_TEST_IP') }}\""
+        os.environ['VAGRANTPLAYBOOK_TEST_IP'] = '172.31.0.1'
+        try:
+            key = self.cache.key(playbook)
+            os.environ['VAGRANTPLAYBOOK_TEST_IP'] = '172.31.0.2'
+            self.assertNotEqual(key, self.cache.key(playbook))
+        finally:
+            del os.environ['VAGRANTPLAYBOOK_TEST_IP']
+
+    def test_key_lookups_arguments(self):
+        # keys depend on all the arguments of lookups, not only on the first one
+        paths = [os.path.join(self.path, name) for name in ('ip1.txt', 'ip2.txt')]
+        playbook = "ips: \"{{ lookup('file', '%s', '%s') }}\"" % tuple(paths)
+
+        for path in paths:
+            with open(path, 'wb') as f:
+                f.write('172.31.0.1')
+        key = self.cache.key(playbook)
+
+        with open(paths[1], 'wb') as f:
+            f.write('172.31.0.2')
+        self.assertNotEqual(key, self.cache.key(playbook))
+
+        playbook = "ips: \"{{ lookup('env', 'VAGRANTPLAYBOOK_TEST_IP1', 'VAGRANTPLAYBOOK_TEST_IP2') }}\""
+        os.environ['VAGRANTPLAYBOOK_TEST_IP1'] = '172.31.0.1'
+        os.environ['VAGRANTPLAYBOOK_TEST_IP2'] = '172.31.0.1'
+        try:
+            key = self.cache.key(playbook)
+            os.environ['VAGRANTPLAYBOOK_TEST_IP2'] = '172.31.0.2'
+            self.assertNotEqual(key, self.cache.key(playbook))
+        finally:
+            del os.environ['VAGRANTPLAYBOOK_TEST_IP1']
+            del os.environ['VAGRANTPLAYBOOK_TEST_IP2']
+
+    def test_included_templates(self):
+        # clusters are composed again when a template included by the playbook changes
+        playbook = "mycluster:\n    master:\n        box: \"{% include 'box.j2' %}\"\n"
+        cache = ComposeCache(os.path.join(self.path, 'cache'))
+        cwd = os.getcwd()
+        os.chdir(self.path)
+        try:
+            with open('box.j2', 'wb') as f:
+                f.write('box1')
+            self.assertIn('box1', Executor(templating = 'native', cache = cache).execute(None, playbook))
+
+            with open('box.j2', 'wb') as f:
+                f.write('box2')
+            self.assertIn('box2', Executor(templating = 'native', cache = cache).execute(None, playbook))
+        finally:
+            os.chdir(cwd)
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get('k1'))
+
+        self.cache.put('k1', 'cluster1')
+        self.assertEqual(self.cache.get('k1'), 'cluster1')
+
+        # failed writes do not store entries
+        writer = self.cache.writer('k2')
+        writer.write('partial')
+        self.cache.discard(writer)
+        self.assertIsNone(self.cache.get('k2'))
+        self.assertEqual(os.listdir(self.cache.path), ['k1.yml'])
+
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('k1'))
+
+    def test_evict(self):
+        # least recently used entries are removed when the cache exceeds the max size
+        self.cache.put('k1', 'x' * 40)
+        self.cache.put('k2', 'x' * 40)
+        os.utime(self.cache._entry('k1'), (time.time() - 10, time.time() - 10))
+        os.utime(self.cache._entry('k2'), (time.time() - 5, time.time() - 5))
+
+        self.assertIsNotNone(self.cache.get('k1'))
+        self.cache.put('k3', 'x' * 40)
+
+        self.assertIsNotNone(self.cache.get('k1'))
+        self.assertIsNone(self.cache.get('k2'))
+        self.assertIsNotNone(self.cache.get('k3'))
@@ -2,11 +2,18 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
+import os
+import json
+import yaml
+import shutil
+import tempfile
+from cStringIO import StringIO
 from nose import tools
 from unittest import TestCase
 
 from vagrantplaybook.errors import PlaybookLoadError, PlaybookParseError
 from vagrantplaybook.playbook.executor import Executor
+from vagrantplaybook.playbook.cache import ComposeCache
 
 from vagrantplaybook.tests.playbook.sample.load import sample_load
 from vagrantplaybook.tests.playbook.sample.load import sample_load_witherrors
@@ -15,6 +22,7 @@ from vagrantplaybook.tests.playbook.sample.parse import sample_execute_cluster_e
 from vagrantplaybook.tests.playbook.sample.parse import sample_execute_cluster_not_object
 from vagrantplaybook.tests.playbook.sample.parse import sample_execute_nodegroup_empty
 from vagrantplaybook.tests.playbook.sample.parse import sample_execute_nodegroup_with_attributes
+from vagrantplaybook.tests.playbook.sample.parse import sample_execute_nodegroup_with_cycle
 from vagrantplaybook.tests.playbook.sample.yaml import sample_yaml
 
 class TestExecutor(TestCase):
@@ -49,6 +57,18 @@ class TestExecutor(TestCase):
         # load_from_file handles errors
         self.assertRaises(PlaybookLoadError, self._executor._load, sample_load_witherrors)
 
+    def test_load_error_message(self):
+        # load errors report the yaml problem and its position
+        with self.assertRaises(PlaybookLoadError) as context:
+            self._executor._load(sample_load_witherrors)
+        self.assertIn('Error loading playbook data from "<string>": ', context.exception.message)
+        self.assertIn('mapping values are not allowed', context.exception.message)
+        self.assertIn('line 6, column 10', context.exception.message)
+
+        with self.assertRaises(PlaybookLoadError) as context:
+            self._executor._load_from_file('vagrantplaybook/tests/playbook/sample/load_from_file_witherrors.yml')
+        self.assertIn('load_from_file_witherrors.yml", line ', context.exception.message)
+
     def _test_parse(self, data):
         return self._executor._parse(self._executor._load(data))
 
@@ -70,6 +90,9 @@ class TestExecutor(TestCase):
         self.assertEqual(len(cluster._node_groups), 1)
         self.assertEqual(cluster._node_groups["zookeeper"].instances, 3)
 
+        # execute with circular references between value generators gives errors
+        self.assertRaises(PlaybookParseError, self._test_parse, sample_execute_nodegroup_with_cycle)
+
     def _test_compose(self, data):
         cluster = self._test_parse(data)
         nodes, inventory, ansible_group_vars, ansible_host_vars = self._executor._compose(cluster)
@@ -82,7 +105,133 @@ class TestExecutor(TestCase):
         cluster, nodes, inventory, ansible_group_vars, ansible_host_vars = self._test_compose(data)
         return self._executor._yaml(cluster, nodes, inventory, ansible_group_vars, ansible_host_vars)
 
-    #def test_yaml(self):
-    #    yaml =  self._test_yaml(sample_yaml)
-
-    #    print(yaml)
+    def test_yaml(self):
+        # yaml generates the same document generated by yaml.dump
+        cluster, nodes, inventory, ansible_group_vars, ansible_host_vars = self._test_compose(sample_yaml)
+
+        expected = yaml.dump({ cluster.name: {
+            'box' : cluster.box,
+            'domain' : cluster.domain,
+            'ansible_playbook_path' : cluster.ansible_playbook_path,
+            'nodes' : [{ node.boxname: {
+                'box'            : node.box,
+                'boxname'        : node.boxname,
+                'hostname'       : node.hostname,
+                'fqdn'           : node.fqdn,
+                'aliases'        : node.aliases,
+                'ip'             : node.ip,
+                'cpus'           : node.cpus,
+                'memory'         : node.memory,
+                'ansible_groups' : node.ansible_groups,
+                'attributes'     : node.attributes,
+                'index'          : node.index,
+                'group_index'    : node.group_index
+            }} for node in nodes],
+            'ansible' : {
+                'inventory' : { group: [dict(boxname = node.boxname, hostname = node.hostname) for node in hosts] for group, hosts in inventory.iteritems() },
+                'group_vars' : ansible_group_vars,
+                'host_vars' : ansible_host_vars
+            }
+        }}, Dumper=yaml.SafeDumper, default_flow_style=False)
+
+        self.assertEqual(self._executor._yaml(cluster, nodes, inventory, ansible_group_vars, ansible_host_vars), expected)
+
+    def test_json(self):
+        # json and yaml documents contain the same data, in each json mode
+        expected = yaml.safe_load(self._executor.execute(None, sample_yaml))
+        for compact in (False, True):
+            for sort_keys in (False, True):
+                document = Executor(output_format = 'json', compact = compact, sort_keys = sort_keys).execute(None, sample_yaml)
+                self.assertEqual(json.loads(document), expected)
+                self.assertEqual('\n' in document, not compact)
+
+        self.assertRaises(ValueError, Executor, output_format = 'xml')
+
+    def test_json_cache(self):
+        # json and yaml documents are cached separately
+        path = tempfile.mkdtemp()
+        try:
+            cache = ComposeCache(path)
+            yaml_document = Executor(cache = cache).execute(None, sample_yaml)
+            json_document = Executor(cache = cache, output_format = 'json').execute(None, sample_yaml)
+
+            self.assertEqual(Executor(cache = cache).execute(None, sample_yaml), yaml_document)
+            self.assertEqual(Executor(cache = cache, output_format = 'json').execute(None, sample_yaml), json_document)
+            self.assertEqual(len(os.listdir(path)), 2)
+        finally:
+            shutil.rmtree(path)
+
+    def test_inventory(self):
+        # the ansible inventory tree is written when the cluster is composed, also if the playbook was cached
+        path = tempfile.mkdtemp()
+        try:
+            cache = ComposeCache(os.path.join(path, 'cache'))
+            Executor(cache = cache).execute(None, sample_yaml)
+
+            executor = Executor(cache = cache, inventory = True, inventory_path = os.path.join(path, 'provisioning'))
+            executor.execute(None, sample_yaml)
+            self.assertIn('inventory', executor.inventory_writer.written)
+            self.assertTrue(os.path.isfile(os.path.join(path, 'provisioning', 'inventory')))
+
+            executor.execute(None, sample_yaml)
+            self.assertEqual(executor.inventory_writer.written, [])
+        finally:
+            shutil.rmtree(path)
+
+    def test_only(self):
+        # only the selected nodes are composed, and each selection is cached separately
+        path = tempfile.mkdtemp()
+        try:
+            cache = ComposeCache(path)
+            full = Executor(cache = cache).execute(None, sample_yaml)
+            first = Executor(cache = cache).execute(None, sample_yaml, only = 'nodegroup1[0]')
+
+            self.assertNotEqual(first, full)
+            self.assertEqual(Executor(cache = cache).execute(None, sample_yaml, only = 'nodegroup1[0]'), first)
+            self.assertEqual(len(os.listdir(path)), 2)
+
+            self.assertRaises(PlaybookParseError, Executor().execute, None, sample_yaml, only = 'nodegroup1[')
+            self.assertRaises(ValueError, Executor(inventory = True).execute, None, sample_yaml, only = 'nodegroup1')
+        finally:
+            shutil.rmtree(path)
+
+    def test_execute(self):
+        # execute writes the composed cluster to a stream, if given
+        stream = StringIO()
+        self.assertIsNone(self._executor.execute(None, sample_yaml, out = stream))
+        self.assertEqual(stream.getvalue(), self._executor.execute(None, sample_yaml))
+
+    def test_execute_cache(self):
+        # execute stores composed clusters in the cache, and returns cached clusters without parsing playbooks
+        path = tempfile.mkdtemp()
+        try:
+            cache = ComposeCache(path)
+            executor = Executor(cache = cache)
+            expected = self._executor.execute(None, sample_yaml)
+
+            stream = StringIO()
+            self.assertIsNone(executor.execute(None, sample_yaml, out = stream))
+            self.assertEqual(stream.getvalue(), expected)
+            self.assertEqual(len(os.listdir(path)), 1)
+
+            executor._parse = None
+            self.assertEqual(executor.execute(None, sample_yaml), expected)
+        finally:
+            shutil.rmtree(path)
+
+    def test_execute_incremental(self):
+        # execute stores the state of the last compose, and recomposes clusters incrementally
+        path = tempfile.mkdtemp()
+        try:
+            executor = Executor(state = os.path.join(path, 'state'))
+            expected = self._executor.execute(None, sample_yaml)
+
+            self.assertEqual(executor.execute(None, sample_yaml), expected)
+            self.assertTrue(os.path.isfile(os.path.join(path, 'state')))
+            self.assertNotEqual(executor.state.recomputed['node_groups'], [])
+
+            self.assertEqual(Executor(state = os.path.join(path, 'state')).execute(None, sample_yaml), expected)
+            self.assertEqual(executor.execute(None, sample_yaml), expected)
+            self.assertEqual(executor.state.recomputed['node_groups'], [])
+        finally:
+            shutil.rmtree(path)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import stat
+import shutil
+import tempfile
+from collections import namedtuple
+from unittest import TestCase
+
+import yaml
+
+from vagrantplaybook.playbook.inventory import InventoryWriter
+
+Host = namedtuple('Host', ['boxname', 'hostname'])
+
+class TestInventoryWriter(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.writer = InventoryWriter(os.path.join(self.path, 'provisioning'))
+
+        self.inventory = dict(
+            zookeeper = [Host('zookeeper1', 'test-zookeeper1'), Host('zookeeper2', 'test-zookeeper2')],
+            kafka = [Host('kafka1', 'test-kafka1')]
+        )
+        self.group_vars = dict(zookeeper = dict(port = 2181), kafka = dict())
+        self.host_vars = {'test-zookeeper1': dict(id = 1), 'test-zookeeper2': dict(id = 2), 'test-kafka1': dict()}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _read(self, name):
+        with open(os.path.join(self.writer.path, name), 'rb') as f:
+            return f.read()
+
+    def test_write(self):
+        # the inventory file, and a vars file for each group/host with vars are written
+        self.writer.write(self.inventory, self.group_vars, self.host_vars)
+
+        self.assertEqual(self.writer.written, ['group_vars/zookeeper.yml', 'host_vars/test-zookeeper1.yml', 'host_vars/test-zookeeper2.yml', 'inventory'])
+        self.assertEqual(self._read('inventory'), '# generated by vagrant-playbook\n\n[kafka]\ntest-kafka1\n\n[zookeeper]\ntest-zookeeper1\ntest-zookeeper2\n')
+        self.assertEqual(yaml.safe_load(self._read('group_vars/zookeeper.yml')), dict(port = 2181))
+        self.assertEqual(yaml.safe_load(self._read('host_vars/test-zookeeper2.yml')), dict(id = 2))
+
+    def test_write_unchanged(self):
+        # files with the same content are not rewritten
+        self.writer.write(self.inventory, self.group_vars, self.host_vars)
+        inode = os.stat(os.path.join(self.writer.path, 'host_vars/test-zookeeper1.yml')).st_ino
+
+        self.host_vars['test-zookeeper2'] = dict(id = 3)
+        self.writer.write(self.inventory, self.group_vars, self.host_vars)
+
+        self.assertEqual(self.writer.written, ['host_vars/test-zookeeper2.yml'])
+        self.assertEqual(self.writer.unchanged, ['group_vars/zookeeper.yml', 'host_vars/test-zookeeper1.yml', 'inventory'])
+        self.assertEqual(os.stat(os.path.join(self.writer.path, 'host_vars/test-zookeeper1.yml')).st_ino, inode)
+        self.assertEqual(yaml.safe_load(self._read('host_vars/test-zookeeper2.yml')), dict(id = 3))
+
+    def test_write_mode(self):
+        # files are written with the default mode for new files, and rewritten files keep their mode
+        umask = os.umask(0)
+        os.umask(umask)
+
+        self.writer.write(self.inventory, self.group_vars, self.host_vars)
+        for name in ['inventory', 'group_vars/zookeeper.yml', InventoryWriter.MANIFEST]:
+            self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.writer.path, name)).st_mode), 0666 & ~umask)
+
+        os.chmod(os.path.join(self.writer.path, 'host_vars/test-zookeeper2.yml'), 0640)
+        self.host_vars['test-zookeeper2'] = dict(id = 3)
+        self.writer.write(self.inventory, self.group_vars, self.host_vars)
+        self.assertEqual(self.writer.written, ['host_vars/test-zookeeper2.yml'])
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.writer.path, 'host_vars/test-zookeeper2.yml')).st_mode), 0640)
+
+    def test_write_stale(self):
+        # stale files written by the writer are removed, while other files are kept
+        self.writer.write(self.inventory, self.group_vars, self.host_vars)
+        with open(os.path.join(self.writer.path, 'host_vars', 'other.yml'), 'wb') as f:
+            f.write('id: 4\n')
+
+        del self.inventory['zookeeper'][1]
+        del self.host_vars['test-zookeeper2']
+        self.writer.write(self.inventory, self.group_vars, self.host_vars)
+
+        self.assertEqual(self.writer.removed, ['host_vars/test-zookeeper2.yml'])
+        self.assertFalse(os.path.exists(os.path.join(self.writer.path, 'host_vars', 'test-zookeeper2.yml')))
+        self.assertTrue(os.path.exists(os.path.join(self.writer.path, 'host_vars', 'other.yml')))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.writer.path, 'host_vars'))), ['other.yml', 'test-zookeeper1.yml'])
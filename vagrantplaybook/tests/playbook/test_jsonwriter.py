@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+from cStringIO import StringIO
+from unittest import TestCase
+
+from vagrantplaybook.playbook.jsonwriter import JsonWriter
+
+sample_data = {
+    'b': [1, 2.5, True, None, 'x', {'k': [{}]}],
+    'a': {'z': {}, 'y': [], 'x': 'Österreich', 'w': u'Österreich', 'v': 'yes', 'u': '1'},
+    'c': [],
+}
+
+class TestJsonWriter(TestCase):
+
+    def _write(self, data, **kwargs):
+        stream = StringIO()
+        writer = JsonWriter(stream, **kwargs)
+        writer.open()
+        writer.start_mapping()
+        for key in sorted(data):
+            writer.add(key)
+            if key == 'b':
+                # sequences can be written one item at a time, or as a single value
+                writer.start_sequence()
+                for item in data[key]:
+                    writer.add(item)
+                writer.end_sequence()
+            else:
+                writer.add(data[key])
+        writer.end_mapping()
+        writer.close()
+        return stream.getvalue()
+
+    def test_write(self):
+        # writer generates a document with the same data encoded by json.dumps
+        for kwargs in [{}, dict(compact = True), dict(sort_keys = True), dict(compact = True, sort_keys = True)]:
+            self.assertEqual(json.loads(self._write(sample_data, **kwargs)), json.loads(json.dumps(sample_data)))
+
+        # in compact mode, the document is the same generated by json.dumps
+        self.assertEqual(self._write(sample_data, compact = True, sort_keys = True), json.dumps(sample_data, separators = (',', ':'), sort_keys = True))
+
+        # otherwise, items of mappings/sequences written one at a time are written one per line
+        self.assertEqual(self._write(dict(a = 1, b = [2])), '{\n  "a": 1,\n  "b": [\n    2\n  ]\n}\n')
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import yaml
+from cStringIO import StringIO
+from unittest import TestCase, skipUnless
+
+from vagrantplaybook.playbook.yamlwriter import YamlWriter
+
+sample_data = {
+    'b': [1, 2.5, True, None, 'x'],
+    'a': {'z': {}, 'y': [], 'x': 'Österreich', 'w': u'Österreich', 'v': 'yes', 'u': '1'},
+}
+
+class TestYamlWriter(TestCase):
+
+    def _write(self, data, dumper):
+        stream = StringIO()
+        writer = YamlWriter(stream, dumper = dumper)
+        writer.open()
+        writer.start_mapping()
+        for key in sorted(data):
+            writer.add(key)
+            writer.add(data[key])
+        writer.end_mapping()
+        writer.close()
+        return stream.getvalue()
+
+    def test_write(self):
+        # writer generates the same document generated by yaml.dump
+        self.assertEqual(self._write(sample_data, yaml.SafeDumper), yaml.dump(sample_data, Dumper=yaml.SafeDumper, default_flow_style=False))
+
+    @skipUnless(yaml.__with_libyaml__, "LibYAML not available")
+    def test_libyaml(self):
+        # LibYAML and pure-Python dumpers generate the same document
+        self.assertEqual(self._write(sample_data, yaml.CSafeDumper), self._write(sample_data, yaml.SafeDumper))
+
+        # LibYAML and pure-Python loaders load the same data
+        document = self._write(sample_data, yaml.CSafeDumper)
+        self.assertEqual(yaml.load(document, Loader=yaml.CSafeLoader), yaml.load(document, Loader=yaml.SafeLoader))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import stat
+import shutil
+import tempfile
+from cStringIO import StringIO
+from unittest import TestCase
+
+from vagrantplaybook import batch
+from vagrantplaybook.playbook.executor import Executor
+
+from vagrantplaybook.tests.playbook.sample.yaml import sample_yaml
+
+class TestBatch(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, content in [('a/env1.yml', sample_yaml), ('a/env1.composed.yml', ''), ('b/env2.yaml', sample_yaml),
+                              ('b/invalid.yml', '- not a cluster'), ('b/.vagrant/cached.yml', ''), ('b/notes.txt', '')]:
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def test_find_playbooks(self):
+        # playbooks are searched in directories (skipping composed clusters and hidden directories) and by glob patterns
+        expected = [self._path('a', 'env1.yml'), self._path('b', 'env2.yaml'), self._path('b', 'invalid.yml')]
+        self.assertEqual(batch.find_playbooks([self.directory]), expected)
+        self.assertEqual(batch.find_playbooks([self._path('*', '*.y*ml'), self._path('a', 'env1.yml')]), expected)
+        self.assertEqual(batch.find_playbooks([self._path('missing')]), [])
+
+    def test_get_outputs(self):
+        playbooks = [self._path('a', 'env1.yml'), self._path('b', 'env2.yaml')]
+
+        # composed clusters are written next to playbooks, or in the output directory keeping relative paths
+        self.assertEqual(batch.get_outputs(playbooks), [self._path('a', 'env1.composed.yml'), self._path('b', 'env2.composed.yml')])
+        self.assertEqual(batch.get_outputs(playbooks, 'out'), [os.path.join('out', 'a', 'env1.composed.yml'), os.path.join('out', 'b', 'env2.composed.yml')])
+        self.assertEqual(batch.get_outputs(playbooks[:1], 'out', 'json'), [os.path.join('out', 'env1.composed.json')])
+
+        # playbooks that would be composed to the same file are rejected
+        playbooks.append(self._path('a', 'env1.yaml'))
+        self.assertRaises(ValueError, batch.get_outputs, playbooks)
+        self.assertRaises(ValueError, batch.get_outputs, playbooks, 'out')
+        playbooks.pop()
+
+        # composed clusters in the output directory are not considered playbooks
+        outputs = batch.get_outputs(playbooks, self._path('out'))
+        batch.run_batch(playbooks, outputs, cache = False)
+        self.assertEqual(batch.find_playbooks([self.directory]), [self._path('a', 'env1.yml'), self._path('b', 'env2.yaml'), self._path('b', 'invalid.yml')])
+
+    def test_run_batch(self):
+        # playbooks are composed in process or by worker processes, with the same results; errors do not stop the batch
+        expected = Executor().execute(None, sample_yaml)
+        playbooks = batch.find_playbooks([self.directory])
+
+        for jobs in (1, 2):
+            outputs = batch.get_outputs(playbooks, self._path('out%i' % jobs))
+            results = batch.run_batch(playbooks, outputs, jobs = jobs, cache = False)
+
+            self.assertEqual([result['playbook'] for result in results], playbooks)
+            self.assertEqual([result['error'] is None for result in results], [True, True, False])
+            self.assertIn('Error parsing playbook', results[2]['error'])
+
+            for output in outputs[:2]:
+                with open(output, 'rb') as f:
+                    self.assertEqual(f.read(), expected)
+            self.assertFalse(os.path.exists(outputs[2]))
+
+        # composed clusters are written with the default mode for new files, and keep the mode of existing files
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(outputs[0]).st_mode), 0666 & ~umask)
+        os.chmod(outputs[0], 0640)
+        batch.run_batch(playbooks, outputs, cache = False)
+        self.assertEqual(stat.S_IMODE(os.stat(outputs[0]).st_mode), 0640)
+
+        stream = StringIO()
+        batch.report(results, stream)
+        self.assertIn('Composed 2 of 3 playbooks, 1 errors', stream.getvalue())
+        self.assertIn('ERROR', stream.getvalue())
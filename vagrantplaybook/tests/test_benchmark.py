@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import json
+import shutil
+import tempfile
+from cStringIO import StringIO
+from unittest import TestCase
+
+from vagrantplaybook import benchmark
+from vagrantplaybook.playbook.executor import Executor
+
+class TestBenchmark(TestCase):
+
+    def test_generate_playbook(self):
+        # synthetic playbooks can be executed, for each complexity
+        for complexity in benchmark.COMPLEXITIES:
+            playbook = benchmark.generate_playbook(3, 2, complexity, provisioners = 2)
+            executor = Executor(templating = 'native')
+            cluster = executor._parse(executor._load(playbook))
+            nodes, inventory, ansible_group_vars, ansible_host_vars = cluster.compose()
+
+            self.assertEqual(len(nodes), 6)
+            self.assertEqual(sorted(inventory), ['role0', 'role1', 'role2', 'tier0', 'tier1', 'tier2'])
+            self.assertEqual(ansible_group_vars['tier0']['total1'], '6')
+            self.assertEqual(len(ansible_host_vars[nodes[0].hostname]), 4)
+
+        self.assertRaises(ValueError, benchmark.generate_playbook, 1, 1, 'unknown')
+
+    def test_run_scenario(self):
+        # all the phases are timed
+        scenario = benchmark.get_scenario(5, groups = 10, templating = 'native')
+        self.assertEqual((scenario['groups'], scenario['instances']), (5, 1))
+
+        result = benchmark.run_scenario(scenario)
+        self.assertEqual(result['composed_nodes'], 5)
+        for phase in benchmark.EXECUTOR_PHASES + benchmark.COMPOSE_PHASES + ['total']:
+            self.assertGreaterEqual(result['timings'][phase], 0)
+        self.assertGreaterEqual(result['timings']['compose'], sum(result['timings'][phase] for phase in benchmark.COMPOSE_PHASES))
+
+        # nodes are spread across nodegroups, so the cluster has exactly the given number of nodes
+        scenario = benchmark.get_scenario(23, groups = 10, templating = 'native')
+        self.assertEqual((scenario['groups'], scenario['instances'], scenario['remainder']), (10, 2, 3))
+        self.assertEqual(benchmark.run_scenario(scenario)['composed_nodes'], 23)
+
+    def test_compare(self):
+        scenario = benchmark.get_scenario(1000)
+        baseline = dict(results = [dict(scenario, timings = dict(compose = 1.0, nodes = 0.001), peak_memory = 100)])
+        results = dict(results = [dict(scenario, timings = dict(compose = 1.5, nodes = 0.002), peak_memory = 110)])
+
+        # timings slower than tolerance are regressions, unless the difference is noise
+        self.assertEqual(benchmark.compare(results, baseline), [(1000, 'compose', 1.0, 1.5)])
+        self.assertEqual(benchmark.compare(results, baseline, tolerance = 0.05), [(1000, 'compose', 1.0, 1.5), (1000, 'peak_memory', 100, 110)])
+        self.assertEqual(benchmark.compare(results, baseline, tolerance = 1), [])
+
+        # other scenarios are not compared
+        results['results'][0]['templating'] = 'native'
+        self.assertEqual(benchmark.compare(results, baseline), [])
+
+    def test_main(self):
+        # results are saved in json format, and compared with a baseline
+        path = tempfile.mkdtemp()
+        try:
+            output = os.path.join(path, 'results.json')
+            out = StringIO()
+            self.assertEqual(benchmark.main(['-s', '10', '-t', 'native', '-o', output], out = out), 0)
+            self.assertIn('compose', out.getvalue())
+
+            with open(output, 'rb') as f:
+                results = json.load(f)
+            self.assertEqual([result['nodes'] for result in results['results']], [10])
+            self.assertIsNotNone(results['results'][0]['peak_memory'])
+
+            stream = StringIO()
+            benchmark.report(results, stream, baseline = results)
+            self.assertIn('(1.00x)', stream.getvalue())
+        finally:
+            shutil.rmtree(path)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import json
+from cStringIO import StringIO
+from unittest import TestCase
+
+from vagrantplaybook.profiler import Profiler, GeneratorStats, TraceRecorder, NULL_PROFILER
+from vagrantplaybook.playbook.executor import Executor
+
+from vagrantplaybook.tests.playbook.sample.yaml import sample_yaml
+
+class FakeTimer:
+    ''' a timer advancing by one second each time it is read '''
+
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        self.time += 1
+        return self.time
+
+class TestProfiler(TestCase):
+
+    def test_phases(self):
+        # phases are recorded in start order, with nested phases indented
+        completed = []
+        profiler = Profiler(timer = FakeTimer(), clock = FakeTimer())
+        profiler.on_phase = completed.append
+
+        with profiler.phase('compose'):
+            with profiler.phase('nodes') as phase:
+                phase.count = 3
+            with profiler.phase('host_vars'):
+                pass
+
+        self.assertEqual([(phase.name, phase.depth) for phase in profiler.phases], [('compose', 0), ('nodes', 1), ('host_vars', 1)])
+        self.assertEqual([phase.name for phase in completed], ['nodes', 'host_vars', 'compose'])
+        self.assertEqual([phase.wall for phase in profiler.phases], [5, 1, 1])
+        self.assertEqual(profiler.total, 5)
+
+        stream = StringIO()
+        profiler.report(stream)
+        self.assertIn('  nodes ', stream.getvalue())
+        self.assertIn('Total time: 5000.0 ms', stream.getvalue())
+
+        # phases raising errors are recorded too
+        with self.assertRaises(ValueError):
+            with profiler.phase('emit'):
+                raise ValueError()
+        self.assertEqual(profiler.phases[-1].name, 'emit')
+        self.assertIsNotNone(profiler.phases[-1].wall)
+
+    def test_null_profiler(self):
+        with NULL_PROFILER.phase('nodes') as phase:
+            phase.count = 3
+
+    def test_executor(self):
+        # the executor records each phase, and compose phases nested into compose
+        profiler = Profiler()
+        Executor(profiler = profiler).execute(None, sample_yaml)
+
+        self.assertEqual([phase.name for phase in profiler.phases], ['load', 'parse', 'compose', 'nodes', 'ansible_groups', 'context_vars', 'group_vars', 'host_vars', 'inventory', 'emit'])
+        counts = dict((phase.name, phase.count) for phase in profiler.phases)
+        self.assertEqual(counts['parse'], 2)
+        self.assertEqual(counts['nodes'], 2)
+        self.assertEqual(counts['compose'], 2)
+        self.assertEqual(counts['host_vars'], 3)
+
+    def test_generator_stats(self):
+        # calls, total/max time and size of generated values are recorded for each generator
+        stats = GeneratorStats()
+        stats.record(('node', 'master', 'ip'), 0, 0.5, '172.31.0.101')
+        stats.record(('node', 'master', 'ip'), 1, 1.5, '172.31.0.102')
+        stats.record(('host', 'zookeeper', 'ids'), 2, 1.0, [1, 2])
+
+        self.assertEqual(stats.generators[('node', 'master', 'ip')], [2, 2.0, 1.5, 24])
+        self.assertEqual(stats.generators[('host', 'zookeeper', 'ids')], [1, 1.0, 1.0, 6])
+
+        # stats recorded elsewhere (e.g. by worker processes) are merged
+        stats.merge({('node', 'master', 'ip'): [1, 3.0, 3.0, 12], ('group', 'all', 'count'): [1, 0.1, 0.1, 1]})
+        self.assertEqual(stats.generators[('node', 'master', 'ip')], [3, 5.0, 3.0, 36])
+
+        # generators are ranked by total time
+        self.assertEqual([key for key, values in stats.top(2)], [('node', 'master', 'ip'), ('host', 'zookeeper', 'ids')])
+
+        stream = StringIO()
+        stats.report(stream, 1)
+        self.assertIn('top 1 of 3', stream.getvalue())
+        self.assertIn('node/master/ip', stream.getvalue())
+        self.assertNotIn('zookeeper', stream.getvalue())
+
+    def test_executor_generators(self):
+        # value generators are recorded for each scope, also when they are executed by worker processes
+        for jobs in (1, 2):
+            profiler = Profiler(generators = True)
+            Executor(profiler = profiler).execute(None, sample_yaml, jobs = jobs)
+
+            generators = profiler.generators.generators
+            self.assertEqual(generators[('node', 'nodegroup1', 'ip')][0], 1)
+            self.assertEqual(generators[('group', 'ansible_groups1', 'var1')][0], 1)
+            self.assertEqual(generators[('host', 'ansible_groups1', 'var1')][0], 2)
+            self.assertEqual(generators[('host', 'ansible_groups1', 'var1')][3], len('nodegroup11') + len('nodegroup21'))
+
+    def test_trace_recorder(self):
+        # spans are recorded as complete events, with timestamps in microseconds
+        trace = TraceRecorder(clock = FakeTimer())
+        trace.complete('compose', 'phase', 1, 2, dict(count = 3))
+        trace.complete_generator(('node', 'master', 'ip'), 2, 0.5, dict(node_index = 1))
+
+        # events recorded elsewhere (e.g. by worker processes) are merged
+        trace.merge([dict(name = 'ip', cat = 'generator', ph = 'X', ts = 2500000, dur = 1, pid = trace.pid + 1, tid = 0, args = {})])
+
+        stream = StringIO()
+        trace.write(stream)
+        document = json.loads(stream.getvalue())
+
+        events = document['traceEvents']
+        self.assertEqual([(event['ph'], event['pid'] == trace.pid) for event in events], [('M', True), ('M', False), ('X', True), ('X', True), ('X', False)])
+        self.assertEqual(events[2], dict(name = 'compose', cat = 'phase', ph = 'X', ts = 1000000, dur = 2000000, pid = trace.pid, tid = 0, args = dict(count = 3)))
+        self.assertEqual(events[3]['args'], dict(scope = 'node', group = 'master', var = 'ip', node_index = 1))
+
+    def test_executor_trace(self):
+        # phases, nodegroups, nodes and value generators are traced, also when they are executed by worker processes
+        for jobs in (1, 2):
+            profiler = Profiler(trace = True)
+            Executor(profiler = profiler).execute(None, sample_yaml, jobs = jobs)
+
+            events = profiler.trace.events
+            phases = [event['name'] for event in events if event['cat'] == 'phase']
+            self.assertEqual(sorted(phases), sorted(['load', 'parse', 'compose', 'nodes', 'ansible_groups', 'context_vars', 'group_vars', 'host_vars', 'inventory', 'emit']))
+
+            nodegroups = [event['args']['group'] for event in events if event['cat'] == 'nodegroup']
+            self.assertEqual(sorted(set(nodegroups)), ['nodegroup1', 'nodegroup2'])
+
+            nodes = [event for event in events if event['cat'] == 'node']
+            self.assertEqual(sorted(event['name'] for event in nodes), ['nodegroup11', 'nodegroup21'])
+
+            generators = [event['args'] for event in events if event['cat'] == 'generator' and event['args']['scope'] == 'host']
+            self.assertEqual(sorted(args['host'] for args in generators if args['var'] == 'var1'), ['nodegroup11', 'nodegroup21'])
+
+            # nodes are traced by worker processes, when composed in parallel
+            self.assertEqual(all(event['pid'] != os.getpid() for event in nodes), jobs > 1)
+
+    def test_executor_memory(self):
+        # memory allocated by each phase is recorded, together with the top allocations
+        profiler = Profiler(memory = True)
+        Executor(profiler = profiler).execute(None, sample_yaml)
+
+        for phase in profiler.phases:
+            self.assertIsNotNone(phase.objects)
+            self.assertTrue(phase.peak is None or phase.peak >= 0)
+
+        # objects are allocated by parse (the cluster, node groups and value generators)
+        self.assertGreater([phase for phase in profiler.phases if phase.name == 'parse'][0].objects, 0)
+
+        stream = StringIO()
+        profiler.report(stream)
+        self.assertIn('memory in KB', stream.getvalue())
+        self.assertIn('gc objects', stream.getvalue())
+
+        top = profiler.memory.top(3)
+        self.assertLessEqual(len(top), 3)
+        self.assertTrue(all(count > 0 for name, size, count in top))
+
+        stream = StringIO()
+        profiler.memory.report(stream, 3)
+        self.assertIn('Memory profile (top 3', stream.getvalue())
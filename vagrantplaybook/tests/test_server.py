@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import sys
+import json
+import stat
+import socket
+import shutil
+import tempfile
+import threading
+from cStringIO import StringIO
+from unittest import TestCase
+
+from vagrantplaybook import server
+from vagrantplaybook.errors import PlaybookParseError
+from vagrantplaybook.playbook.executor import Executor
+
+from vagrantplaybook.tests.playbook.sample.yaml import sample_yaml
+
+class TestServer(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'server.sock')
+
+        self.server = server.ComposeServer(self.path)
+        self.server.start()
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        server.stop(self.path)
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def test_request(self):
+        # the playbook is composed by the server, with the same result of an in-process execution
+        expected = Executor().execute(None, sample_yaml)
+        for i in range(2):
+            output, report = server.request(self.path, yamlplaybook = sample_yaml, cache = False)
+            self.assertEqual(output, expected)
+            self.assertIsNone(report)
+
+        # compiled templates are kept by the server between requests
+        self.assertEqual(server.ping(self.path)['requests'], 2)
+        self.assertGreater(len(self.server._templates['ansible']), 0)
+
+    def test_request_error(self):
+        # errors executing the playbook are raised in the client
+        with self.assertRaises(PlaybookParseError):
+            server.request(self.path, yamlplaybook = '- not a cluster', cache = False)
+
+    def test_fallback(self):
+        # without a server (or with a server of another version), the playbook should be executed in-process
+        self.assertIsNone(server.request(os.path.join(self.directory, 'missing.sock'), yamlplaybook = sample_yaml))
+        self.assertIsNone(server.ping(os.path.join(self.directory, 'missing.sock')))
+
+        response = server._call(self.path, dict(version = '0.0.0', cwd = os.getcwd(), playbook = sample_yaml))
+        self.assertTrue(response['error'].startswith('version mismatch'))
+
+    def test_socket_permissions(self):
+        # the socket is accessible only to the user, and clients connect only to sockets owned by the user
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode) & 0077, 0)
+        self.assertTrue(server._check_socket(self.path))
+
+        path = os.path.join(self.directory, 'file.sock')
+        with open(path, 'wb') as f:
+            f.write('not a socket')
+        self.assertFalse(server._check_socket(path))
+        self.assertIsNone(server.ping(path))
+
+        # the socket directory should be private
+        directory = os.path.join(self.directory, 'sockets')
+        self.assertTrue(server._check_private_directory(directory, create = True))
+        self.assertEqual(stat.S_IMODE(os.stat(directory).st_mode), 0700)
+        os.chmod(directory, 0755)
+        self.assertFalse(server._check_private_directory(directory))
+
+    def test_environment(self):
+        # only the environment variables looked up by the playbook are sent to the server
+        os.environ['VAGRANTPLAYBOOK_TEST_SECRET'] = 'secret'
+        os.environ['VAGRANTPLAYBOOK_TEST_IP'] = '172.31.0.1'
+        try:
+            self.assertEqual(server._get_environment(None, sample_yaml), {})
+            self.assertEqual(server._get_environment(None, "ip: \"{{ lookup('env', 'VAGRANTPLAYBOOK_TEST_IP') }}{{ lookup('env', 'VAGRANTPLAYBOOK_TEST_MISSING') }}\""),
+                dict(VAGRANTPLAYBOOK_TEST_IP = '172.31.0.1', VAGRANTPLAYBOOK_TEST_MISSING = None))
+            self.assertEqual(server._get_environment(None, "ip: \"{{ lookup('env', 'VAGRANTPLAYBOOK_TEST_MISSING', 'VAGRANTPLAYBOOK_TEST_IP') }}\""),
+                dict(VAGRANTPLAYBOOK_TEST_IP = '172.31.0.1', VAGRANTPLAYBOOK_TEST_MISSING = None))
+
+            # variables with names that are not literals can't be sent, so the playbook should be executed in-process
+            self.assertIsNone(server._get_environment(None, "ip: \"{{ lookup('env', name) }}\""))
+            self.assertIsNone(server._get_environment(None, "ip: \"{{ lookup('env', 'VAGRANTPLAYBOOK_TEST_IP', name) }}\""))
+            self.assertIsNone(server._get_environment(None, "ip: \"{{ lookup(plugin, 'VAGRANTPLAYBOOK_TEST_IP') }}\""))
+            self.assertIsNone(server.request(self.path, yamlplaybook = "c: {ip: \"{{ lookup('env', name) }}\"}"))
+
+            # looked up variables are set in the server as in the client
+            playbook = "c:\n  g:\n    ip: \"{{ lookup('env', 'VAGRANTPLAYBOOK_TEST_IP') }}\"\n"
+            output, report = server.request(self.path, yamlplaybook = playbook, cache = False)
+            self.assertIn('ip: 172.31.0.1', output)
+            self.assertEqual(os.environ['VAGRANTPLAYBOOK_TEST_IP'], '172.31.0.1')
+
+            # all the variables looked up at once are set in the server
+            os.environ['VAGRANTPLAYBOOK_TEST_IP2'] = '172.31.0.2'
+            try:
+                playbook = "c:\n  g:\n    ip: \"{{ lookup('env', 'VAGRANTPLAYBOOK_TEST_IP', 'VAGRANTPLAYBOOK_TEST_IP2') }}\"\n"
+                output, report = server.request(self.path, yamlplaybook = playbook, cache = False)
+                self.assertIn('172.31.0.2', output)
+            finally:
+                del os.environ['VAGRANTPLAYBOOK_TEST_IP2']
+        finally:
+            del os.environ['VAGRANTPLAYBOOK_TEST_SECRET']
+            del os.environ['VAGRANTPLAYBOOK_TEST_IP']
+
+    def test_connection_errors(self):
+        # errors on a connection do not stop the server
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(self.path)
+            connection.sendall('{"command": "ping"')
+            connection.shutdown(socket.SHUT_WR)
+            connection.close()
+
+            # a client disconnecting before reading the response
+            for i in range(3):
+                connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                connection.connect(self.path)
+                connection.sendall('{"command": "execute", "version": "%s", "cwd": "%s", "playbook": %s}\n' % (server.vagrantplaybook.__version__, os.getcwd(), json.dumps(sample_yaml * 50)))
+                connection.close()
+
+            self.assertIsNotNone(server.ping(self.path))
+        finally:
+            sys.stderr = stderr
+
+    def test_stop(self):
+        # the socket is removed when the server stops
+        self.assertTrue(server.stop(self.path))
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(server.stop(self.path))
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import sys
+import shutil
+import timeit
+import tempfile
+import subprocess
+from unittest import TestCase
+
+import vagrantplaybook
+
+# The max time for starting vagrant-playbook and printing help, in seconds (regression threshold)
+STARTUP_THRESHOLD = float(os.environ.get('VAGRANTPLAYBOOK_STARTUP_THRESHOLD', '0.5'))
+
+# Modules that should not be imported until a playbook is parsed / composed
+HEAVY_MODULES = ['ansible', 'jinja2', 'multiprocessing']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(vagrantplaybook.__file__)))
+
+def _python(*args, **kwargs):
+    env = dict(os.environ, PYTHONPATH = ROOT)
+    process = subprocess.Popen([sys.executable, '-W', 'ignore'] + list(args), cwd = kwargs.get('cwd', ROOT), env = env, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    out, err = process.communicate()
+    return process.returncode, out, err
+
+def _profiled_packages(report):
+    # gets the top level packages in a startup profile (skipping headers and totals)
+    return set(line.split()[-1].split('.')[0] for line in report.splitlines()[2:-1])
+
+class TestStartup(TestCase):
+
+    def test_startup_time(self):
+        # help is printed without loading the executor, under the startup threshold
+        timings = []
+        for i in range(3):
+            start = timeit.default_timer()
+            returncode, out, err = _python('-m', 'vagrantplaybook', '-h')
+            timings.append(timeit.default_timer() - start)
+            self.assertEqual(returncode, 0)
+
+        self.assertLess(min(timings), STARTUP_THRESHOLD)
+
+    def test_lazy_imports(self):
+        # heavy modules are not imported for help / argument errors, nor by creating an executor
+        script = '\n'.join([
+            'import sys',
+            'from vagrantplaybook.__main__ import main',
+            'def loaded():',
+            '    sys.stdout.write(" ".join(set(m.split(".")[0] for m in sys.modules if sys.modules[m] is not None)) + "\\n")',
+            'try:',
+            '    main([])',
+            'except SystemExit:',
+            '    loaded()',
+            'from vagrantplaybook.playbook.executor import Executor',
+            'Executor()',
+            'loaded()',
+        ])
+        returncode, out, err = _python('-c', script)
+        self.assertEqual(returncode, 0)
+
+        main_loaded, executor_loaded = [set(line.split()) for line in out.splitlines()]
+        for module in HEAVY_MODULES + ['yaml']:
+            self.assertNotIn(module, main_loaded)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, executor_loaded)
+
+    def test_startup_profile(self):
+        # the startup profile reports import times to stderr, while the cluster is written to stdout
+        returncode, out, err = _python('-m', 'vagrantplaybook', '-p', 'mycluster:\n  master:\n    instances: 1', '-t', 'native', '--no-cache', '--startup-profile')
+        self.assertEqual(returncode, 0)
+
+        self.assertIn('nodes:', out)
+        self.assertIn('Startup profile', err)
+        self.assertIn('Total import time', err)
+
+        # the native backend does not import ansible
+        self.assertIn('vagrantplaybook.playbook.executor', err)
+        self.assertIn('jinja2', _profiled_packages(err))
+        self.assertNotIn('ansible', _profiled_packages(err))
+
+    def test_cache_hit(self):
+        # cached clusters are returned without importing the template engine (and yaml)
+        cwd = tempfile.mkdtemp()
+        try:
+            args = ['-m', 'vagrantplaybook', '-p', 'mycluster:\n  master:\n    instances: 1', '--startup-profile']
+            miss = _python(*args, cwd = cwd)
+            hit = _python(*args, cwd = cwd)
+
+            self.assertEqual(miss[0], 0)
+            self.assertEqual(hit[0], 0)
+            self.assertEqual(hit[1], miss[1])
+            self.assertTrue(os.listdir(os.path.join(cwd, '.vagrant', 'playbook-cache')))
+
+            self.assertIn('jinja2', _profiled_packages(miss[2]))
+            for module in HEAVY_MODULES + ['yaml']:
+                self.assertNotIn(module, _profiled_packages(hit[2]))
+        finally:
+            shutil.rmtree(cwd)
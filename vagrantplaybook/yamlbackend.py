@@ -0,0 +1,16 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type 
+
+# this module selects the classes used for loading and dumping yaml documents;
+# the LibYAML C bindings are used when available, with fallback to the pure-Python
+# implementation (loaded data and dumped documents are the same in both cases)
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+    yaml_backend = 'libyaml'
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+    yaml_backend = 'python'
+
+yaml_loader = SafeLoader
+yaml_dumper = SafeDumper